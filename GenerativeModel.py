@@ -3,10 +3,56 @@ import numpy as np
 from edward.models import RandomVariable
 from tensorflow.contrib.distributions import (Distribution,
                                               FULLY_REPARAMETERIZED)
+from tensorflow.contrib.keras import layers
 # from tensorflow.python.ops.distributions.special_math import log_ndtr
 from tf_gbds.utils import pad_extra_conds
 
 
+def pid_convolution(error, L):
+    """Change of the control signal from a PID controller: the control
+    errors [Batch_size x T x dim] convolved with the 3-tap filter of each
+    dimension L [dim x 3] (coefficients of t-2, t-1 and t), the beginning of
+    the signal padded with zeros. All dimensions are filtered by a single
+    depthwise convolution.
+    """
+    with tf.name_scope("convolution"):
+        # [Batch_size x 1 x T+2 x dim] signal, [1 x 3 x dim x 1] filter
+        signal = tf.expand_dims(
+            tf.pad(error, [[0, 0], [2, 0], [0, 0]], name="pad_zero"), 1,
+            "reshape_signal")
+        filt = tf.reshape(tf.transpose(L), [1, 3, -1, 1], "reshape_filter")
+        res = tf.nn.depthwise_conv2d(signal, filt, [1, 1, 1, 1], "VALID",
+                                     name="convolve_signal")
+
+        return tf.squeeze(res, 1, "control_signal_change")
+
+
+def sample_mixture(mu, lambda_, w, n):
+    """Draw n samples [... x n x dim] from each mixture of Gaussians with
+    means mu [... x K x dim], (diagonal) precisions lambda_ [... x K x dim]
+    and weights w [... x K]: all component indices are drawn with a single
+    multinomial and all Gaussian samples with a single random_normal.
+    """
+    with tf.name_scope("sample_mixture"):
+        K = tf.shape(w)[-1]
+        dim = tf.shape(mu)[-1]
+        batch_shape = tf.shape(w)[:-1]
+        with tf.name_scope("select_component"):
+            k = tf.multinomial(tf.reshape(tf.log(w), [-1, K], "log_w"), n,
+                               name="k")
+            k = tf.one_hot(k, K, name="one_hot_k")
+        with tf.name_scope("get_sample"):
+            # [(batch) x n x dim] parameters of the selected components
+            mu_k = tf.matmul(k, tf.reshape(mu, [-1, K, dim]))
+            lambda_k = tf.matmul(k, tf.reshape(lambda_, [-1, K, dim]))
+            samples = tf.add(
+                tf.random_normal(tf.shape(mu_k), name="std_normal") /
+                tf.sqrt(lambda_k, name="inv_std_dev"), mu_k)
+
+        return tf.reshape(samples, tf.concat([batch_shape, [n, dim]], 0),
+                          "samples")
+
+
 class GBDS(RandomVariable, Distribution):
 
     def __init__(self, params, states, ctrl_obs, extra_conds=None,
@@ -39,6 +85,12 @@ class GBDS(RandomVariable, Distribution):
             self.GMM_NN = params["GMM_NN"]
             self.params += self.GMM_NN.variables
             self.log_vars += self.GMM_NN.variables
+            # number of time steps per block of the GMM log-density (all
+            # time steps at once if None)
+            if "log_prob_chunk" in params:
+                self.chunk = params["log_prob_chunk"]
+            else:
+                self.chunk = None
 
             with tf.name_scope("g0"):
                 # initial goal distribution
@@ -139,6 +191,22 @@ class GBDS(RandomVariable, Distribution):
         # given state, current position, sample from goal posterior,
         # and previous control (and extra conditions if provided).
 
+        all_mu, all_lambda, all_w, next_g = self.get_GMM_preds(
+            s, post_g, extra_conds)
+
+        error = tf.subtract(post_g, y, "control_error")
+
+        u_diff = pid_convolution(error, self.L)
+
+        u_pred = tf.add(prev_u, u_diff, "predicted_control_signal")
+
+        return (all_mu, all_lambda, all_w, next_g, u_pred)
+
+    def get_GMM_preds(self, s, post_g, extra_conds=None):
+        # Return GMM parameters and one-step-ahead prediction of goal,
+        # given state and sample from goal posterior (and extra conditions
+        # if provided).
+
         with tf.name_scope("pad_extra_conds"):
             if extra_conds is not None:
                 s = pad_extra_conds(s, extra_conds)
@@ -161,30 +229,79 @@ class GBDS(RandomVariable, Distribution):
             tf.expand_dims(post_g[:, :-1], 2) + all_mu * all_lambda,
             1 + all_lambda, "next_goals")
 
-        error = tf.subtract(post_g, y, "control_error")
-
-        with tf.name_scope("convolution"):
-            u_diff = []
-            # get current error signal and corresponding filter
-            for i in range(self.dim):
-                signal = error[:, :, i]
-                # pad the beginning of control signal with zero
-                signal = tf.expand_dims(
-                    tf.pad(signal, [[0, 0], [2, 0]], name="pad_zero"),
-                    -1, name="reshape_signal")
-                filt = tf.reshape(self.L[i], [-1, 1, 1], "reshape_filter")
-                res = tf.nn.convolution(signal, filt, padding="VALID",
-                                        name="convolve_signal")
-                u_diff.append(res)
-
-        if len(u_diff) > 1:
-            u_diff = tf.concat([*u_diff], -1, "control_signal_change")
+        return (all_mu, all_lambda, all_w, next_g)
+
+    def GMM_log_density(self, g, all_mu, all_lambda, all_w, g_pred):
+        # Return log-density [Batch_size x T] of goals g under the GMM
+        # of each time step
+        res_gmm = tf.subtract(
+            tf.expand_dims(g, 2, "reshape_samples"), g_pred,
+            "GMM_residual")
+        gmm_term = tf.log(all_w + 1e-8) - tf.reduce_sum(
+            (1 + all_lambda) * (res_gmm ** 2) / (2 * self.sigma ** 2), -1)
+        gmm_term += (0.5 * tf.reduce_sum(tf.log(1 + all_lambda), -1) -
+                     tf.reduce_sum(0.5 * tf.log(2 * np.pi) +
+                                   tf.log(self.sigma), -1))
+
+        # tf.summary.scalar("average_log_density", tf.reduce_mean(
+        #     tf.reduce_logsumexp(gmm_term, -1)))
+
+        return tf.reduce_logsumexp(gmm_term, -1)
+
+    def boundary_penalty(self, all_mu, all_lambda):
+        # Return penalties [Batch_size x T x 3] at each time step on GMM
+        # means escaping the boundaries (below and above) and on small GMM
+        # precisions
+        return tf.stack([
+            self.g_pen * tf.reduce_sum(
+                tf.nn.relu(self.bounds[0] - all_mu), [2, 3]),
+            self.g_pen * tf.reduce_sum(
+                tf.nn.relu(all_mu - self.bounds[1]), [2, 3]),
+            .1 * tf.reduce_sum(1. / all_lambda, [2, 3])], -1)
+
+    def chunked_goal_terms(self, s, post_g, extra_conds=None):
+        # Return GMM log-density [Batch_size x T] of goals post_g[:, 1:]
+        # given states s and previous goals (as GMM_log_density), and
+        # boundary penalties [Batch_size x T x 3] (as boundary_penalty, None
+        # if g_pen is None), evaluated over blocks of self.chunk time steps
+        # in a while loop. In the forward pass (evaluation), the
+        # [Batch_size x T x K x dim] GMM parameters (and residuals) exist one
+        # block at a time; backprop keeps those of every block (swapped to
+        # host memory on a GPU), so it does not bound training memory
+        n_steps = tf.shape(post_g)[1] - 1
+        n_chunks = (n_steps + self.chunk - 1) // self.chunk
+
+        def _step(i, *terms):
+            t0 = i * self.chunk
+            t1 = tf.minimum(t0 + self.chunk, n_steps)
+            all_mu, all_lambda, all_w, g_pred = self.get_GMM_preds(
+                s[:, t0:t1], post_g[:, t0:(t1 + 1)], extra_conds)
+            # written time-major, to be concatenated over time
+            outputs = [i + 1, terms[0].write(i, tf.transpose(
+                self.GMM_log_density(post_g[:, (t0 + 1):(t1 + 1)], all_mu,
+                                     all_lambda, all_w, g_pred)))]
+            if self.g_pen is not None:
+                outputs.append(terms[1].write(i, tf.transpose(
+                    self.boundary_penalty(all_mu, all_lambda), [1, 0, 2])))
+
+            return outputs
+
+        n_terms = 1 if self.g_pen is None else 2
+        terms = tf.while_loop(
+            lambda i, *args: i < n_chunks, _step,
+            [tf.constant(0)] + [
+                tf.TensorArray(tf.float32, n_chunks, infer_shape=False)
+                for _ in range(n_terms)],
+            swap_memory=True, name="time_chunks")[1:]
+
+        log_density = tf.transpose(terms[0].concat(), name="GMM_log_density")
+        if self.g_pen is None:
+            penalty = None
         else:
-            u_diff = tf.identity(u_diff[0], "contrl_signal_change")
-
-        u_pred = tf.add(prev_u, u_diff, "predicted_control_signal")
+            penalty = tf.transpose(terms[1].concat(), [1, 0, 2],
+                                   "boundary_penalty")
 
-        return (all_mu, all_lambda, all_w, next_g, u_pred)
+        return log_density, penalty
 
     # def clip_log_prob(self, upsilon, u):
     #     """upsilon (derived from time series of y) is a censored version of
@@ -224,27 +341,27 @@ class GBDS(RandomVariable, Distribution):
     #                                               self.clip_tol)))
 
     def _log_prob(self, value):
-        all_mu, all_lambda, all_w, g_pred, u_pred = self.get_preds(
-            self.s[:, 1:-1], self.y[:, :-1],
-            value, tf.pad(
-                self.ctrl_obs[:, :-1], [[0, 0], [1, 0], [0, 0]],
-                name="previous_control"), self.extra_conds)
+        prev_u = tf.pad(self.ctrl_obs[:, :-1], [[0, 0], [1, 0], [0, 0]],
+                        name="previous_control")
+        if self.chunk is None:
+            all_mu, all_lambda, all_w, g_pred, u_pred = self.get_preds(
+                self.s[:, 1:-1], self.y[:, :-1], value, prev_u,
+                self.extra_conds)
+        else:
+            # GMM terms evaluated over blocks of time steps
+            error = tf.subtract(value, self.y[:, :-1], "control_error")
+            u_pred = tf.add(prev_u, pid_convolution(error, self.L),
+                            "predicted_control_signal")
 
         logdensity_g = 0.0
         with tf.name_scope("goal_states"):
-            res_gmm = tf.subtract(
-                tf.expand_dims(value[:, 1:], 2, "reshape_samples"), g_pred,
-                "GMM_residual")
-            gmm_term = tf.log(all_w + 1e-8) - tf.reduce_sum(
-                (1 + all_lambda) * (res_gmm ** 2) / (2 * self.sigma ** 2), -1)
-            gmm_term += (0.5 * tf.reduce_sum(tf.log(1 + all_lambda), -1) -
-                         tf.reduce_sum(0.5 * tf.log(2 * np.pi) +
-                                       tf.log(self.sigma), -1))
-            logdensity_g += tf.reduce_sum(
-                tf.reduce_logsumexp(gmm_term, -1), -1)
-
-            # tf.summary.scalar("average_log_density", tf.reduce_mean(
-            #     tf.reduce_logsumexp(gmm_term, -1)))
+            if self.chunk is None:
+                gmm_log_density = self.GMM_log_density(
+                    value[:, 1:], all_mu, all_lambda, all_w, g_pred)
+            else:
+                gmm_log_density, penalty = self.chunked_goal_terms(
+                    self.s[:, 1:-1], value, self.extra_conds)
+            logdensity_g += tf.reduce_sum(gmm_log_density, -1)
 
         with tf.name_scope("g0"):
             res_g0 = tf.subtract(tf.expand_dims(value[:, 0], 1), self.g0_mu,
@@ -262,11 +379,14 @@ class GBDS(RandomVariable, Distribution):
                 #     tf.nn.relu(self.bounds[0] - g_pred), [1, 2, 3])
                 # logdensity_g -= self.g_pen * tf.reduce_sum(
                 #     tf.nn.relu(g_pred - self.bounds[1]), [1, 2, 3])
-                logdensity_g -= self.g_pen * tf.reduce_sum(
-                    tf.nn.relu(self.bounds[0] - all_mu), [1, 2, 3])
-                logdensity_g -= self.g_pen * tf.reduce_sum(
-                    tf.nn.relu(all_mu - self.bounds[1]), [1, 2, 3])
-                logdensity_g -= .1 * tf.reduce_sum(1. / all_lambda, [1, 2, 3])
+                if self.chunk is None:
+                    penalty = self.boundary_penalty(all_mu, all_lambda)
+                # summed over time once, whether or not it was evaluated
+                # over blocks of time steps
+                penalty = tf.reduce_sum(penalty, 1)
+                logdensity_g -= penalty[:, 0]
+                logdensity_g -= penalty[:, 1]
+                logdensity_g -= penalty[:, 2]
                 # logdensity_g -= self.g_pen * tf.reduce_sum(
                 #     tf.nn.relu(self.bounds[0] - all_mu), [1, 2, 3]) / self.K
                 # logdensity_g -= self.g_pen * tf.reduce_sum(
@@ -298,59 +418,67 @@ class GBDS(RandomVariable, Distribution):
 
         return logdensity
 
-    def sample_g0(self, _=None):
-        # Sample from initial goal distribution
-        with tf.name_scope("select_component"):
-            k0 = tf.squeeze(tf.multinomial(tf.reshape(
-                tf.log(self.g0_w, name="log_g0_w"), [1, -1]), 1), name="k0")
-        with tf.name_scope("get_sample"):
-            g0 = tf.add(
-                (tf.random_normal([self.dim], name="std_normal") /
-                 tf.sqrt(self.g0_lambda[k0], name="inv_std_dev")),
-                self.g0_mu[k0], name="g0")
-
-        return g0
+    def sample_g0(self, n=None):
+        # Sample n [n x dim] (or, if n is None, a single [dim]) from initial
+        # goal distribution
+        g0 = sample_mixture(self.g0_mu, self.g0_lambda, self.g0_w,
+                            1 if n is None else n)
+        if n is None:
+            return tf.identity(g0[0], "g0")
+        else:
+            return tf.identity(g0, "g0")
 
     def sample_GMM(self, state, prev_g, extra_conds=None):
-        # Generate new goal given current state and previous goal
-        state = tf.reshape(state, [1, 1, -1], "reshape_state")
+        # Generate new goal given current state and previous goal, or a
+        # batch of new goals [Batch_size x dim] given states
+        # [Batch_size x state_dim] and previous goals [Batch_size x dim]
+        single = len(state.shape) == 1
+        if single:
+            state = tf.expand_dims(state, 0)
+        state = tf.expand_dims(state, 1, "reshape_state")
         with tf.name_scope("pad_extra_conds"):
             if extra_conds is not None:
                 state = pad_extra_conds(state, extra_conds)
 
-        NN_output = self.GMM_NN(state)
+        NN_output = self.GMM_NN(state)[:, 0]
         with tf.name_scope("mu"):
             all_mu = tf.reshape(
-                NN_output[:, :, :(self.K * self.dim)],
-                [self.K, self.dim], "all_mu")
+                NN_output[:, :(self.K * self.dim)],
+                [-1, self.K, self.dim], "all_mu")
         with tf.name_scope("lambda"):
             all_lambda = tf.reshape(tf.nn.softplus(
-                NN_output[:, :, (self.K * self.dim):(
+                NN_output[:, (self.K * self.dim):(
                     2 * self.K * self.dim)], "softplus_lambda"),
-                [self.K, self.dim], "all_lambda")
+                [-1, self.K, self.dim], "all_lambda")
         with tf.name_scope("w"):
-            all_w = tf.nn.softmax(tf.reshape(
-                NN_output[:, :, (2 * self.K * self.dim):],
-                [1, self.K], "reshape_w"), -1, "all_w")
+            all_w = tf.nn.softmax(
+                NN_output[:, (2 * self.K * self.dim):], -1, "all_w")
 
         with tf.name_scope("select_component"):
-            k = tf.squeeze(tf.multinomial(
-                tf.reshape(tf.log(all_w, "log_w"), [1, -1]), 1), name="k")
+            k = tf.one_hot(tf.multinomial(tf.log(all_w, "log_w"), 1)[:, 0],
+                           self.K, name="k")
+            mu_k = tf.reduce_sum(tf.expand_dims(k, -1) * all_mu, 1)
+            lambda_k = tf.reduce_sum(tf.expand_dims(k, -1) * all_lambda, 1)
         with tf.name_scope("get_sample"):
             g = tf.add(
-                tf.divide(prev_g + all_mu[k] * all_lambda[k],
-                          1 + all_lambda[k], name="mean"),
-                (tf.random_normal([self.dim], name="std_normal") *
-                 tf.divide(tf.squeeze(self.sigma),
-                           tf.sqrt(1 + all_lambda[k]), name="std_dev")),
-                name="new_goal")
+                tf.divide(prev_g + mu_k * lambda_k, 1 + lambda_k,
+                          name="mean"),
+                (tf.random_normal(tf.shape(mu_k), name="std_normal") *
+                 tf.divide(self.sigma[0], tf.sqrt(1 + lambda_k),
+                           name="std_dev")))
 
-        return g
+        if single:
+            g = g[0]
+
+        return tf.identity(g, "new_goal")
 
     def update_ctrl(self, errors, prev_u):
-        # Update control signal given errors and previous control
+        # Update control signal given errors [3 x (Batch_size x) dim] and
+        # previous control [(Batch_size x) dim]
+        L = tf.reshape(tf.transpose(self.L),
+                       [3] + [1] * (len(errors.shape) - 2) + [self.dim])
         u_diff = tf.reduce_sum(
-            tf.multiply(errors, tf.transpose(self.L), "convolve_signal"),
+            tf.multiply(errors, L, "convolve_signal"),
             0, name="control_signal_change")
         u = tf.add(prev_u, u_diff, "new_control")
 
@@ -402,16 +530,356 @@ class joint_GBDS(RandomVariable, Distribution):
         if n == 1:
             return tf.concat([agent.sample_g0() for agent in self.agents], 0)
         else:
-            return tf.concat([tf.map_fn(agent.sample_g0, tf.zeros(n))
-                              for agent in self.agents], -1)
+            return tf.concat([agent.sample_g0(n) for agent in self.agents],
+                             -1)
 
     def update_goal(self, state, prev_g, extra_conds=None):
         return tf.concat([agent.sample_GMM(
           state, tf.gather(prev_g, agent.col, axis=-1), extra_conds)
-                          for agent in self.agents], 0)
+                          for agent in self.agents], -1)
 
     def update_ctrl(self, errors, prev_u):
         return tf.concat([agent.update_ctrl(
             tf.gather(errors, agent.col, axis=-1),
             tf.gather(prev_u, agent.col, axis=-1))
-                          for agent in self.agents], 0)
+                          for agent in self.agents], -1)
+
+
+class stacked_GBDS(joint_GBDS):
+    """joint_GBDS whose agents are evaluated together: the GMM networks, PID
+    filters and noise parameters of all agents are stacked along a leading
+    agent axis (dimensions padded to the largest agent and masked), so that
+    the joint log-density, goal and control updates are single batched
+    computations instead of one subgraph per agent. The variables are those
+    of the agents (GBDS), whose GMM networks must be stacks of dense layers
+    with the same hidden sizes.
+    """
+
+    def __init__(self, params, states, ctrl_obs, extra_conds=None,
+                 *args, **kwargs):
+
+        super(stacked_GBDS, self).__init__(
+            params, states, ctrl_obs, extra_conds, *args, **kwargs)
+
+        with tf.name_scope("stacked_agents"):
+            self.s = tf.identity(states, "states")
+            self.ctrl_obs = ctrl_obs
+            self.extra_conds = self.agents[0].extra_conds
+            self.Tt = self.agents[0].Tt
+
+            self.K = self.agents[0].K
+            if any(agent.K != self.K for agent in self.agents):
+                raise ValueError("All agents must have the same GMM_K.")
+            if any(agent.chunk is not None for agent in self.agents):
+                raise ValueError("log_prob_chunk is not supported for "
+                                 "stacked agents.")
+            self.n_agents = len(self.agents)
+            self.dim = max(agent.dim for agent in self.agents)
+
+            # column of each padded agent dimension, and its mask
+            col_idx = np.zeros((self.n_agents, self.dim), np.int32)
+            mask = np.zeros((self.n_agents, self.dim), np.float32)
+            for (i, agent) in enumerate(self.agents):
+                col_idx[i, :agent.dim] = agent.col
+                mask[i, :agent.dim] = 1.
+            self.col_idx = tf.constant(col_idx.ravel(), name="column_index")
+            self.mask = tf.constant(mask, name="mask")
+            # position of each agent dimension in the (agent-ordered)
+            # concatenation of the agents
+            self.agent_idx = tf.constant(np.flatnonzero(mask), tf.int32,
+                                         name="agent_index")
+
+            self.GMM_layers = self._stack_GMM_NN()
+
+            with tf.name_scope("g0"):
+                self.g0_mu = self._stack_params(
+                    [agent.g0_mu for agent in self.agents], name="mu")
+                self.g0_lambda = self._stack_params(
+                    [agent.g0_lambda for agent in self.agents], 1.,
+                    "lambda")
+                self.g0_w = tf.stack([agent.g0_w for agent in self.agents],
+                                     name="w")
+
+            with tf.name_scope("goal_state_noise"):
+                self.sigma = self._stack_params(
+                    [agent.sigma[0] for agent in self.agents], 1., "sigma")
+
+            with tf.name_scope("goal_state_penalty"):
+                self.g_pen = tf.stack(
+                    [agent.g_pen if agent.g_pen is not None else 0.
+                     for agent in self.agents], name="goal_boundary_penalty")
+                self.bounds = tf.constant(
+                    [agent.bounds if agent.g_pen is not None else [-1., 1.]
+                     for agent in self.agents], tf.float32,
+                    name="goal_state_boundary")
+                self.lambda_pen = tf.constant(
+                    [.1 if agent.g_pen is not None else 0.
+                     for agent in self.agents], name="lambda_penalty")
+
+            with tf.name_scope("PID_control"):
+                # [n_agents * dim x 3] filters of the padded dimensions
+                self.L = tf.reshape(tf.transpose(self._stack_params(
+                    [tf.transpose(agent.L) for agent in self.agents]),
+                                                 [0, 2, 1]), [-1, 3],
+                                    "convolution_filter")
+
+            with tf.name_scope("control_signal_noise"):
+                self.eps = self._stack_params(
+                    [agent.eps[0] for agent in self.agents], 1., "epsilon")
+
+            with tf.name_scope("parameter_penalty"):
+                # penalties on the noise parameters do not depend on the data
+                pen = []
+                for agent in self.agents:
+                    pen_i = 0.
+                    if agent.sigma_pen is not None:
+                        pen_i += agent.sigma_pen * tf.reduce_sum(
+                            agent.unc_sigma)
+                    if agent.eps_pen is not None:
+                        pen_i += agent.eps_pen * tf.reduce_sum(agent.unc_eps)
+                    pen.append(pen_i)
+                self.param_pen = tf.add_n(
+                    [tf.convert_to_tensor(x) for x in pen], "penalty")
+
+    def _stack_params(self, tensors, pad_value=0., name=None):
+        """Pad the last axis of the tensors of every agent to the largest
+        dimension and stack them along a new leading agent axis.
+        """
+        return tf.stack(
+            [tf.pad(x, [[0, 0]] * (len(x.shape) - 1) +
+                    [[0, self.dim - agent.dim]], constant_values=pad_value)
+             for (x, agent) in zip(tensors, self.agents)], name=name)
+
+    def _stack_GMM_NN(self):
+        """Stack the weights of the dense layers of the agents' GMM networks
+        into [n_agents x input x output] kernels. The outputs of the last
+        layer are rearranged so that every agent has the layout of the
+        largest one, [mu (K * dim) | lambda (K * dim) | w (K)], padded
+        entries having zero weights.
+        """
+        with tf.name_scope("GMM_NN"):
+            # every layer but the input is stacked, so that the networks of
+            # all agents must be the same sequence of dense layers
+            agent_layers = [
+                [layer for layer in agent.GMM_NN.layers
+                 if not isinstance(layer, layers.InputLayer)]
+                for agent in self.agents]
+            for dense in agent_layers:
+                if not all(hasattr(layer, "kernel") for layer in dense):
+                    raise ValueError("The GMM networks of stacked agents "
+                                     "must consist of dense layers.")
+                if ([(type(layer), layer.activation) for layer in dense] !=
+                        [(type(layer), layer.activation)
+                         for layer in agent_layers[0]]):
+                    raise ValueError("The GMM networks of stacked agents "
+                                     "must have the same layers and "
+                                     "activations.")
+
+            GMM_layers = []
+            for l in range(len(agent_layers[0])):
+                kernels = []
+                biases = []
+                for (agent, dense) in zip(self.agents, agent_layers):
+                    kernel = dense[l].kernel
+                    bias = dense[l].bias
+                    if l == len(dense) - 1:
+                        out_idx = self._output_index(agent)
+                        # padded outputs take the extra zero column
+                        kernel = tf.gather(tf.pad(kernel, [[0, 0], [0, 1]]),
+                                           out_idx, axis=1)
+                        bias = tf.gather(tf.pad(bias, [[0, 1]]), out_idx)
+                    kernels.append(kernel)
+                    biases.append(bias)
+                GMM_layers.append(
+                    (tf.stack(kernels, name="kernel_%s" % (l + 1)),
+                     tf.expand_dims(tf.stack(biases), 1,
+                                    "bias_%s" % (l + 1)),
+                     agent_layers[0][l].activation))
+
+        return GMM_layers
+
+    def _output_index(self, agent):
+        """Index of the output of the agent's GMM network for each entry of
+        the padded layout (the number of outputs for padded entries).
+        """
+        K, d, D = self.K, agent.dim, self.dim
+        n_out = 2 * K * d + K
+        idx = np.full(2 * K * D + K, n_out, np.int32)
+        for k in range(K):
+            idx[(k * D):(k * D + d)] = np.arange(k * d, (k + 1) * d)
+            idx[(K * D + k * D):(K * D + k * D + d)] = np.arange(
+                K * d + k * d, K * d + (k + 1) * d)
+        idx[(2 * K * D):] = np.arange(2 * K * d, n_out)
+
+        return idx
+
+    def _GMM_NN(self, s):
+        """Evaluate the stacked GMM networks on [... x input] states and
+        return all_mu, all_lambda [n_agents x ... x K x dim] and all_w
+        [n_agents x ... x K].
+        """
+        batch_shape = tf.shape(s)[:-1]
+        h = tf.reshape(s, [-1, tf.shape(s)[-1]])
+        h = tf.tile(tf.expand_dims(h, 0), [self.n_agents, 1, 1])
+        for (kernel, bias, activation) in self.GMM_layers:
+            h = activation(tf.matmul(h, kernel) + bias)
+
+        K, D = self.K, self.dim
+        shape = tf.concat([[self.n_agents], batch_shape, [K, D]], 0)
+        all_mu = tf.reshape(h[:, :, :(K * D)], shape, "all_mu")
+        all_lambda = tf.reshape(
+            tf.nn.softplus(h[:, :, (K * D):(2 * K * D)], "softplus_lambda"),
+            shape, "all_lambda")
+        all_w = tf.nn.softmax(tf.reshape(
+            h[:, :, (2 * K * D):], shape[:-1], "reshape_w"), -1, "all_w")
+
+        return all_mu, all_lambda, all_w
+
+    def _flat_cols(self, x):
+        """Gather the columns of every (padded) agent dimension from the last
+        axis of x: [... x n_agents * dim], zero for padded dimensions.
+        """
+        return tf.gather(x, self.col_idx, axis=-1) * tf.reshape(self.mask,
+                                                                [-1])
+
+    def _stack_cols(self, x):
+        """Columns of every agent, [n_agents x ... x dim]."""
+        r = len(x.shape)
+        x = self._flat_cols(x)
+        x = tf.reshape(x, tf.concat(
+            [tf.shape(x)[:-1], [self.n_agents, self.dim]], 0))
+
+        return tf.transpose(x, [r - 1] + list(range(r - 1)) + [r])
+
+    def _log_prob(self, value):
+        with tf.name_scope("stack_agents"):
+            g = self._stack_cols(value)
+            y = self._stack_cols(self.s)
+            ctrl_obs = self._stack_cols(self.ctrl_obs)
+            mask = self.mask[:, tf.newaxis, tf.newaxis, tf.newaxis]
+
+        with tf.name_scope("pad_extra_conds"):
+            s = self.s[:, 1:-1]
+            if self.extra_conds is not None:
+                s = pad_extra_conds(s, self.extra_conds)
+        all_mu, all_lambda, all_w = self._GMM_NN(s)
+
+        next_g = tf.divide(
+            tf.expand_dims(g[:, :, :-1], 3) + all_mu * all_lambda,
+            1 + all_lambda, "next_goals")
+
+        with tf.name_scope("control_signal_prediction"):
+            error = tf.subtract(g, y[:, :, :-1], "control_error")
+            error = tf.reshape(tf.transpose(error, [1, 2, 0, 3]), [
+                tf.shape(error)[1], tf.shape(error)[2], -1])
+            u_diff = tf.reshape(pid_convolution(error, self.L), tf.concat(
+                [tf.shape(error)[:2], [self.n_agents, self.dim]], 0))
+            prev_u = tf.pad(ctrl_obs[:, :, :-1],
+                            [[0, 0], [0, 0], [1, 0], [0, 0]],
+                            name="previous_control")
+            u_pred = tf.add(prev_u, tf.transpose(u_diff, [2, 0, 1, 3]),
+                            "predicted_control_signal")
+
+        with tf.name_scope("goal_states"):
+            sigma = self.sigma[:, tf.newaxis, tf.newaxis, tf.newaxis]
+            res_gmm = tf.subtract(tf.expand_dims(g[:, :, 1:], 3), next_g,
+                                  "GMM_residual")
+            gmm_term = tf.log(all_w + 1e-8) - tf.reduce_sum(
+                mask * (1 + all_lambda) * (res_gmm ** 2) / (2 * sigma ** 2),
+                -1)
+            gmm_term += (0.5 * tf.reduce_sum(
+                mask * tf.log(1 + all_lambda), -1) - tf.reduce_sum(
+                    mask * (0.5 * np.log(2 * np.pi) + tf.log(sigma)), -1))
+            logdensity_g = tf.reduce_sum(
+                tf.reduce_logsumexp(gmm_term, -1), -1)
+
+        with tf.name_scope("g0"):
+            res_g0 = tf.subtract(tf.expand_dims(g[:, :, 0], 2),
+                                 tf.expand_dims(self.g0_mu, 1),
+                                 "g0_residual")
+            g0_lambda = tf.expand_dims(self.g0_lambda, 1)
+            g0_mask = mask[:, :, 0]
+            g0_term = tf.log(tf.expand_dims(self.g0_w, 1) + 1e-8) - \
+                tf.reduce_sum(g0_mask * g0_lambda * (res_g0 ** 2) / 2, -1)
+            g0_term += 0.5 * tf.reduce_sum(
+                g0_mask * (tf.log(g0_lambda) - tf.log(2 * np.pi)), -1)
+            logdensity_g += tf.reduce_logsumexp(g0_term, -1)
+
+        with tf.name_scope("boundary_penalty"):
+            bounds = self.bounds[:, tf.newaxis, tf.newaxis, tf.newaxis,
+                                 tf.newaxis]
+            logdensity_g -= tf.expand_dims(self.g_pen, 1) * tf.reduce_sum(
+                mask * (tf.nn.relu(bounds[..., 0] - all_mu) +
+                        tf.nn.relu(all_mu - bounds[..., 1])), [2, 3, 4])
+            logdensity_g -= tf.expand_dims(self.lambda_pen, 1) * \
+                tf.reduce_sum(mask / all_lambda, [2, 3, 4])
+
+        with tf.name_scope("control_signal"):
+            eps = self.eps[:, tf.newaxis, tf.newaxis]
+            u_res = tf.subtract(ctrl_obs, u_pred, "residual")
+            logdensity_u = -tf.reduce_sum(
+                mask[:, :, :, 0] * (0.5 * np.log(2 * np.pi) + tf.log(eps) +
+                                    u_res ** 2 / (2 * eps ** 2)), [2, 3])
+
+        logdensity = tf.divide(
+            tf.reduce_sum(tf.reduce_mean(logdensity_g + logdensity_u, 1)) -
+            self.param_pen, tf.cast(self.Tt, tf.float32))
+
+        return logdensity
+
+    def sample_g0(self, n=1):
+        # [n_agents x n x dim] samples of all agents at once
+        g0 = sample_mixture(self.g0_mu, self.g0_lambda, self.g0_w, n)
+        g0 = tf.gather(tf.reshape(tf.transpose(g0, [1, 0, 2]), [n, -1]),
+                       self.agent_idx, axis=1)
+        if n == 1:
+            return tf.identity(g0[0], "g0")
+        else:
+            return tf.identity(g0, "g0")
+
+    def update_goal(self, state, prev_g, extra_conds=None):
+        single = len(state.shape) == 1
+        if single:
+            state = tf.expand_dims(state, 0)
+            prev_g = tf.expand_dims(prev_g, 0)
+        with tf.name_scope("pad_extra_conds"):
+            if extra_conds is not None:
+                state = pad_extra_conds(tf.expand_dims(state, 1),
+                                        extra_conds)[:, 0]
+        # [n_agents x Batch_size x K x dim]
+        all_mu, all_lambda, all_w = self._GMM_NN(state)
+
+        with tf.name_scope("select_component"):
+            k = tf.multinomial(tf.reshape(tf.log(all_w, "log_w"),
+                                          [-1, self.K]), 1)[:, 0]
+            k = tf.reshape(tf.one_hot(k, self.K),
+                           tf.concat([tf.shape(all_w), [1]], 0), "k")
+            mu = tf.reduce_sum(k * all_mu, 2)
+            lambda_k = tf.reduce_sum(k * all_lambda, 2)
+        with tf.name_scope("get_sample"):
+            prev_g = tf.transpose(tf.reshape(
+                self._flat_cols(prev_g), [-1, self.n_agents, self.dim]),
+                                  [1, 0, 2])
+            g = tf.add(
+                tf.divide(prev_g + mu * lambda_k, 1 + lambda_k, name="mean"),
+                (tf.random_normal(tf.shape(mu), name="std_normal") *
+                 tf.divide(tf.expand_dims(self.sigma, 1),
+                           tf.sqrt(1 + lambda_k), name="std_dev")))
+            g = tf.gather(tf.reshape(tf.transpose(g, [1, 0, 2]),
+                                     [-1, self.n_agents * self.dim]),
+                          self.agent_idx, axis=1)
+
+        if single:
+            g = g[0]
+
+        return tf.identity(g, "new_goal")
+
+    def update_ctrl(self, errors, prev_u):
+        L = tf.reshape(tf.transpose(self.L),
+                       [3] + [1] * (len(errors.shape) - 2) + [-1])
+        u_diff = tf.reduce_sum(
+            tf.multiply(self._flat_cols(errors), L, "convolve_signal"), 0,
+            name="control_signal_change")
+        u = tf.add(self._flat_cols(prev_u), u_diff)
+
+        return tf.gather(u, self.agent_idx, axis=-1, name="new_control")
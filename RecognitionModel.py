@@ -36,7 +36,25 @@ class SmoothingLDSTimeSeries(RandomVariable, Distribution):
                                 matrix Q inverse;
                     * Q0invChol: square root of the initial innovation
                                  covariance matrix Q0 inverse;
-                    * Neural network parameters: NN_Mu, NN_Lambda, NN_LambdaX.
+                    * Neural network parameters: NN_Mu, NN_Lambda, NN_LambdaX,
+                      or NN_Rec (a single network whose output is the
+                      concatenation of the three);
+                    * lambda_rank (optional): if given, the precision
+                                              blocks of the networks are
+                                              diagonal plus rank
+                                              lambda_rank instead of dense.
+                    * blk_chol (optional): "sequential" (default) or
+                                           "parallel" block tridiagonal
+                                           Cholesky factorization.
+                    * window (optional): length of the windows for windowed
+                                         smoothing of long trials, with
+                                         window_lag (default: window // 4)
+                                         time steps of overlap on each side
+                                         and parallel_windows (default: all)
+                                         windows solved at a time. The
+                                         Cholesky factor used for sampling
+                                         and the entropy is assembled from
+                                         the windows.
             Input: A Tensor. Observations based on which samples are drawn.
             xDim, yDim: Integers. Dimension of latent space (x) and
                         observation (y).
@@ -62,28 +80,55 @@ class SmoothingLDSTimeSeries(RandomVariable, Distribution):
                 else:
                     self.extra_conds = None
 
-            self.NN_Mu = params["NN_Mu"]["network"]
-            # Mu will automatically be of size [Batch_size x T x xDim]
-            self.Mu = tf.identity(self.NN_Mu(self.y), "Mu")
+            # each precision block of the recognition networks is either
+            # LambdaChol LambdaChol^T with a dense square root, or
+            # diag(d) + U U^T with U of rank lambda_rank
+            if "lambda_rank" in params:
+                self.lambda_rank = params["lambda_rank"]
+                self.lambda_size = xDim * (self.lambda_rank + 1)
+                self.lambda_cols = xDim + self.lambda_rank
+            else:
+                self.lambda_rank = None
+                self.lambda_size = xDim ** 2
+                self.lambda_cols = xDim
+
+            self.shared_trunk = "NN_Rec" in params
+            if self.shared_trunk:
+                # a single network with three output heads, evaluated once
+                # over the sequence: [Mu | LambdaChol | LambdaXChol]
+                self.NN_Rec = params["NN_Rec"]["network"]
+                self.NN_Rec_output = self.NN_Rec(self.y)
+                self.Mu = tf.identity(
+                    self.NN_Rec_output[:, :, :xDim], "Mu")
+                self.NN_Lambda_output = self.NN_Rec_output[
+                    :, :, xDim:(xDim + self.lambda_size)]
+                self.NN_LambdaX_output = self.NN_Rec_output[
+                    :, 1:, (xDim + self.lambda_size):]
+                NN_variables = self.NN_Rec.variables
+            else:
+                self.NN_Mu = params["NN_Mu"]["network"]
+                # Mu will automatically be of size [Batch_size x T x xDim]
+                self.Mu = tf.identity(self.NN_Mu(self.y), "Mu")
+
+                self.NN_Lambda = params["NN_Lambda"]["network"]
+                self.NN_Lambda_output = self.NN_Lambda(self.y)
 
-            self.NN_Lambda = params["NN_Lambda"]["network"]
-            self.NN_Lambda_output = self.NN_Lambda(self.y)
-            self.LambdaChol = tf.reshape(
-                self.NN_Lambda_output, [self.B, self.Tt, xDim, xDim],
-                "LambdaChol")
+                self.NN_LambdaX = params["NN_LambdaX"]["network"]
+                self.NN_LambdaX_output = self.NN_LambdaX(self.y[:, 1:])
+                NN_variables = (self.NN_Mu.variables +
+                                self.NN_Lambda.variables +
+                                self.NN_LambdaX.variables)
 
-            self.NN_LambdaX = params["NN_LambdaX"]["network"]
-            self.NN_LambdaX_output = self.NN_LambdaX(self.y[:, 1:])
-            self.LambdaXChol = tf.reshape(
-                self.NN_LambdaX_output, [self.B, self.Tt - 1, xDim, xDim],
-                "LambdaXChol")
+            self.LambdaChol = self._lambda_chol(
+                self.NN_Lambda_output, "LambdaChol")
+            self.LambdaXChol = self._lambda_chol(
+                self.NN_LambdaX_output, "LambdaXChol")
 
             with tf.name_scope("init_posterior"):
                 self._initialize_posterior_distribution(params)
 
-            self.params = (self.NN_Mu.variables + self.NN_Lambda.variables +
-                           self.NN_LambdaX.variables + [self.A] +
-                           [self.QinvChol] + [self.Q0invChol])
+            self.params = (NN_variables + [self.A] + [self.QinvChol] +
+                           [self.Q0invChol])
             self.log_vars = self.params
 
         if "name" not in kwargs:
@@ -101,6 +146,26 @@ class SmoothingLDSTimeSeries(RandomVariable, Distribution):
 
         self._args = (params, Input, xDim, yDim, extra_conds)
 
+    def _lambda_chol(self, NN_output, name):
+        """Square root [... x xDim x lambda_cols] of precision blocks from
+        the output [... x lambda_size] of a recognition network. With
+        lambda_rank, the output holds the diagonal (before softplus) and the
+        low-rank factor of diag(d) + U U^T, whose square root is
+        [diag(sqrt(d)) | U].
+        """
+        batch_shape = tf.shape(NN_output)[:-1]
+        if self.lambda_rank is None:
+            return tf.reshape(
+                NN_output, tf.concat([batch_shape, [self.xDim, self.xDim]],
+                                     0), name)
+
+        d = tf.nn.softplus(NN_output[..., :self.xDim])
+        U = tf.reshape(
+            NN_output[..., self.xDim:],
+            tf.concat([batch_shape, [self.xDim, self.lambda_rank]], 0))
+
+        return tf.concat([tf.matrix_diag(tf.sqrt(d)), U], -1, name)
+
     def _initialize_posterior_distribution(self, params):
         # Compute the precisions (from square roots)
         self.Lambda = tf.matmul(self.LambdaChol, tf.transpose(
@@ -130,68 +195,194 @@ class SmoothingLDSTimeSeries(RandomVariable, Distribution):
 
         # Put together the total precision matrix
         with tf.name_scope("precision_matrix"):
-            AQinvA = tf.matmul(tf.matmul(tf.transpose(self.A), self.Qinv),
-                               self.A, name="AQinvA")
-            AQinvrep = tf.tile(tf.expand_dims(
-                -tf.matmul(tf.transpose(self.A), self.Qinv), 0),
-                [self.Tt - 1, 1, 1], "AQinvrep")
-            AQinvArep = tf.tile(tf.expand_dims(AQinvA + self.Qinv, 0),
-                                [self.Tt - 2, 1, 1], "AQinvArep")
-            AQinvArepPlusQ = tf.concat(
-                [tf.expand_dims(self.Q0inv + AQinvA, 0), AQinvArep,
-                 tf.expand_dims(self.Qinv, 0)], 0, "AQinvArepPlusQ")
+            # the blocks of the prior precision are the same at every time
+            # point except the first and last ones, and are broadcast over
+            # batch and time
+            AQinv = tf.matmul(tf.transpose(self.A), self.Qinv, name="AQinv")
+            AQinvA = tf.matmul(AQinv, self.A, name="AQinvA")
+            # first, interior and last diagonal blocks, and off-diagonal
+            # block of the prior precision
+            self.prior_blocks = [self.Q0inv + AQinvA, AQinvA + self.Qinv,
+                                 self.Qinv, -AQinv]
+
+            with tf.name_scope("recognition_blocks"):
+                AA_rec = self.Lambda + tf.pad(
+                    self.LambdaX, [[0, 0], [1, 0], [0, 0], [0, 0]])
+                BB_rec = tf.matmul(
+                    self.LambdaChol[:, :-1],
+                    tf.transpose(self.LambdaXChol, [0, 1, 3, 2]))
 
+            AA, BB = blk.blk_tridiag_add_stationary(
+                AA_rec, BB_rec, *self.prior_blocks)
             with tf.name_scope("diagonal_blocks"):
-                self.AA = tf.add(self.Lambda + tf.pad(
-                    self.LambdaX, [[0, 0], [1, 0], [0, 0], [0, 0]]),
-                    AQinvArepPlusQ, "diagonal")
+                self.AA = tf.identity(AA, "diagonal")
             with tf.name_scope("off-diagonal_blocks"):
-                self.BB = tf.add(tf.matmul(
-                    self.LambdaChol[:, :-1],
-                    tf.transpose(self.LambdaXChol, [0, 1, 3, 2])),
-                    AQinvrep, "off_diagonal")
+                self.BB = tf.identity(BB, "off_diagonal")
 
         with tf.name_scope("posterior_mean"):
             # scale by precision
             LambdaMu = tf.matmul(self.Lambda, tf.expand_dims(self.Mu, -1),
                                  name="Lambda_Mu")
 
-            # compute cholesky decomposition
-            self.the_chol = blk.blk_tridiag_chol(self.AA, self.BB)
-            # intermediary (mult by R^T)
-            ib = blk.blk_chol_inv(self.the_chol[0], self.the_chol[1],
-                                  LambdaMu)
-            # final result (mult by R)
-            self.postX = blk.blk_chol_inv(self.the_chol[0], self.the_chol[1],
-                                          ib, lower=False, transpose=True)
+            if "window" in params:
+                # windowed smoothing: overlapping windows of the trial are
+                # solved independently as a batch and stitched together
+                self.window = params["window"]
+                if "window_lag" in params:
+                    self.window_lag = params["window_lag"]
+                else:
+                    self.window_lag = self.window // 4
+                if "parallel_windows" in params:
+                    parallel_windows = params["parallel_windows"]
+                else:
+                    parallel_windows = None
+
+                R = blk.blk_tridiag_window_smooth(
+                    self.AA, self.BB, LambdaMu, self.window, self.window_lag,
+                    parallel_windows)
+                self.postX = R[0]
+                self.the_chol = R[3:]
+                postCov = R[1:3]
+            else:
+                self.window = None
+
+                # compute cholesky decomposition (sequential scan over time,
+                # or parallel prefix scan with O(log T) sequential depth)
+                if "blk_chol" in params:
+                    self.blk_chol = params["blk_chol"]
+                else:
+                    self.blk_chol = "sequential"
+
+                if self.blk_chol == "sequential":
+                    self.the_chol = blk.blk_tridiag_chol(self.AA, self.BB)
+                elif self.blk_chol == "parallel":
+                    self.the_chol = blk.blk_tridiag_chol_parallel(
+                        self.AA, self.BB)
+                else:
+                    raise ValueError(
+                        "blk_chol must be 'sequential' or 'parallel'.")
+                # intermediary (mult by R^T)
+                ib = blk.blk_chol_inv(self.the_chol[0], self.the_chol[1],
+                                      LambdaMu, triangular=True)
+                # final result (mult by R)
+                self.postX = blk.blk_chol_inv(
+                    self.the_chol[0], self.the_chol[1], ib, lower=False,
+                    transpose=True, triangular=True)
+
+        with tf.name_scope("posterior_covariance"):
+            # marginal covariances of each time point (block diagonal) and
+            # between neighboring time points (lower 1st block off-diagonal)
+            # by selected inversion of the precision matrix
+            if self.window is None:
+                postCov = blk.blk_chol_sel_inv(self.the_chol[0],
+                                               self.the_chol[1])
+            self.postCov_diag = tf.identity(postCov[0], "diagonal")
+            self.postCov_offdiag = tf.identity(postCov[1], "off_diagonal")
 
         # The determinant of covariance matrix is the square of the
         # determinant of Cholesky factor, which is the product of the diagonal
         # elements of the block-diagonal.
         with tf.name_scope("log_determinant"):
-            def comp_log_det(acc, inputs):
-                L = inputs[0]
-                return tf.reduce_sum(tf.log(tf.matrix_diag_part(L)), -1)
-
-            self.ln_determinant = -2 * tf.reduce_sum(tf.transpose(tf.scan(
-                comp_log_det,
-                [tf.transpose(self.the_chol[0], [1, 0, 2, 3])],
-                initializer=tf.zeros([self.B]))), -1, name="log_determinant")
+            self.ln_determinant = tf.negative(
+                blk.blk_chol_logdet(self.the_chol[0]), "log_determinant")
 
     def _sample_n(self, n, seed=None):
-        return tf.squeeze(tf.map_fn(self.get_sample, tf.zeros([n, self.B])),
-                          -1, "samples")
+        # the n samples are the columns of the right-hand side of a single
+        # back-substitution
+        norm_samp = tf.random_normal([self.B, self.Tt, self.xDim, n],
+                                     seed=seed,
+                                     name="standard_normal_samples")
+        samples = tf.add(blk.blk_chol_inv(
+            self.the_chol[0], self.the_chol[1], norm_samp, lower=False,
+            transpose=True, triangular=True), self.postX)
+
+        return tf.transpose(samples, [3, 0, 1, 2], name="samples")
 
     def get_sample(self, _=None):
         norm_samp = tf.random_normal([self.B, self.Tt, self.xDim],
                                      name="standard_normal_samples")
         return tf.add(blk.blk_chol_inv(
             self.the_chol[0], self.the_chol[1], tf.expand_dims(norm_samp, -1),
-            lower=False, transpose=True), self.postX)
+            lower=False, transpose=True, triangular=True), self.postX)
 
     def _log_prob(self, value):
         return tf.reduce_mean(self.eval_entropy())
 
+    def filter_initial_state(self, batch_size=1):
+        """Return the state of filter_step before the first observation:
+        [time step, last Cholesky block, last block of the partial solution
+        of the forward substitution, last LambdaChol].
+        """
+        with tf.name_scope("filter_initial_state"):
+            return [tf.constant(0, name="time_step"),
+                    tf.eye(self.xDim, batch_shape=[batch_size],
+                           name="cholesky_block"),
+                    tf.zeros([batch_size, self.xDim, 1],
+                             name="partial_solution"),
+                    tf.zeros([batch_size, self.xDim, self.lambda_cols],
+                             name="LambdaChol")]
+
+    def filter_step(self, y, state):
+        """Update the filtering posterior p(x_t | y_1, ..., y_t) with the
+        recognition network input of one new time step.
+
+        The state carries the running block of the Cholesky factor of the
+        posterior precision and the partial solution of its forward
+        substitution (the same blocks as the_chol and the intermediary
+        solution computed for postX), so that each update costs O(xDim^3)
+        regardless of the length of the history. The filtering posterior at
+        the last time step of a trial equals the smoothing posterior.
+
+        Args:
+            y: A Tensor. [Batch_size x dim] input of the recognition networks.
+            state: A list. Output of filter_initial_state or of the previous
+                   call.
+
+        Returns:
+            mean: [Batch_size x xDim] filtering posterior mean.
+            cov: [Batch_size x xDim x xDim] filtering posterior covariance.
+            state: Updated state.
+        """
+        with tf.name_scope("filter_step"):
+            t, L_prev, z_prev, LambdaChol_prev = state
+            first = tf.cast(tf.equal(t, 0), tf.float32)
+
+            y = tf.expand_dims(y, 1)
+            if self.shared_trunk:
+                NN_out = self.NN_Rec(y)[:, 0]
+                Mu = NN_out[:, :self.xDim]
+                NN_Lambda_out = NN_out[
+                    :, self.xDim:(self.xDim + self.lambda_size)]
+                NN_LambdaX_out = NN_out[:, (self.xDim + self.lambda_size):]
+            else:
+                Mu = self.NN_Mu(y)[:, 0]
+                NN_Lambda_out = self.NN_Lambda(y)[:, 0]
+                NN_LambdaX_out = self.NN_LambdaX(y)[:, 0]
+            LambdaChol = self._lambda_chol(NN_Lambda_out, "LambdaChol")
+            LambdaXChol = self._lambda_chol(NN_LambdaX_out, "LambdaXChol")
+
+            Lambda = tf.matmul(LambdaChol, LambdaChol, transpose_b=True)
+            LambdaX = (1. - first) * tf.matmul(
+                LambdaXChol, LambdaXChol, transpose_b=True)
+            prior_first, prior_mid, prior_last, prior_off = self.prior_blocks
+
+            # blocks of the precision matrix coupling t - 1 and t
+            BB = (1. - first) * (
+                tf.matmul(LambdaChol_prev, LambdaXChol, transpose_b=True) +
+                prior_off)
+            AA = (Lambda + LambdaX + first * prior_first +
+                  (1. - first) * prior_mid)
+            # while t is the last time step, its diagonal block does not
+            # include the dynamics term A^T Qinv A
+            L, z, mean, cov = blk.blk_tridiag_filter_step(
+                L_prev, z_prev, AA, BB,
+                tf.matmul(Lambda, tf.expand_dims(Mu, -1)),
+                AA - (prior_mid - prior_last))
+            mean = tf.squeeze(mean, -1, "filtering_mean")
+            cov = tf.identity(cov, "filtering_covariance")
+
+            return mean, cov, [t + 1, L, z, LambdaChol]
+
     def eval_entropy(self):
         # Compute the entropy of LDS (analogous to prior on smoothness)
         entropy = (self.ln_determinant / 2. +
@@ -223,14 +414,23 @@ class SmoothingPastLDSTimeSeries(SmoothingLDSTimeSeries):
             else:
                 self.lag = 1
 
-            y0 = [0., -0.58, 0.]
-            Input_ = tf.identity(Input)
-            for i in range(self.lag):
-                lagged = tf.concat(
-                    [tf.tile(tf.reshape(y0, [1, 1, yDim]),
-                             [tf.shape(Input_)[0], 1, 1]),
-                     Input_[:, :-1, -yDim:]], 1, "lagged")
-                Input_ = tf.concat([Input_, lagged], -1)
+            if "y0" in params:
+                self.y0 = params["y0"]
+            else:
+                self.y0 = [0., -0.58, 0.]
+            # [y_{t-1}, ..., y_{t-lag}] framed in a single gather from the
+            # observations padded with lag copies of y0
+            padded = tf.concat(
+                [tf.tile(tf.reshape(self.y0, [1, 1, yDim]),
+                         [tf.shape(Input)[0], self.lag, 1]),
+                 Input[:, :, -yDim:]], 1, "padded")
+            lag_idx = (tf.expand_dims(tf.range(tf.shape(Input)[1]), 1) +
+                       tf.range(self.lag - 1, -1, -1))
+            lagged = tf.reshape(
+                tf.gather(padded, lag_idx, axis=1),
+                [tf.shape(Input)[0], tf.shape(Input)[1], self.lag * yDim],
+                "lagged")
+            Input_ = tf.concat([Input, lagged], -1)
 
         if "name" not in kwargs:
             kwargs["name"] = "SmoothingPastLDSTimeSeries"
@@ -247,3 +447,179 @@ class SmoothingPastLDSTimeSeries(SmoothingLDSTimeSeries):
             params, Input_, xDim, yDim, extra_conds, *args, **kwargs)
 
         self._args = (params, Input, xDim, yDim, extra_conds)
+
+    def filter_initial_state(self, batch_size=1):
+        """Return the state of filter_step before the first observation,
+        which also carries the past observations (up to lag).
+        """
+        state = super(SmoothingPastLDSTimeSeries,
+                      self).filter_initial_state(batch_size)
+        with tf.name_scope("filter_initial_state"):
+            state.append(tf.tile(tf.reshape(self.y0, [1, -1]),
+                                 [batch_size, self.lag], "past_observations"))
+
+        return state
+
+    def filter_step(self, y, state, extra_conds=None):
+        """Update the filtering posterior with the observation of one new
+        time step, see SmoothingLDSTimeSeries.filter_step.
+
+        Args:
+            y: A Tensor. [Batch_size x yDim] new observation.
+            state: A list. Output of filter_initial_state or of the previous
+                   call.
+            extra_conds: Optional Tensor. Extra conditions of the trial.
+
+        Returns:
+            mean, cov, state: See SmoothingLDSTimeSeries.filter_step.
+        """
+        with tf.name_scope("pad_lag"):
+            Input_ = tf.concat([y, state[-1]], -1)
+            past_y = Input_[:, :(self.lag * self.yDim)]
+        if extra_conds is not None:
+            Input_ = pad_extra_conds(tf.expand_dims(Input_, 1),
+                                     extra_conds)[:, 0]
+
+        mean, cov, state = super(SmoothingPastLDSTimeSeries,
+                                 self).filter_step(Input_, state[:-1])
+
+        return mean, cov, state + [past_y]
+
+
+def _embed_cols(x, E, matrix=False):
+    """Embed vectors [... x d] (or matrices [... x d x d]) over the columns
+    of an agent into the joint space with the selection matrix E
+    [d x xDim], zero elsewhere.
+    """
+    r = len(x.shape)
+    x = tf.tensordot(x, E, [[r - 1], [0]])
+    if matrix:
+        perm = list(range(r - 2)) + [r - 1, r - 2]
+        x = tf.transpose(
+            tf.tensordot(tf.transpose(x, perm), E, [[r - 1], [0]]), perm)
+
+    return x
+
+
+class FactorizedSmoothingPastLDSTimeSeries(RandomVariable, Distribution):
+    """Product of independent SmoothingPastLDSTimeSeries, one over the
+    columns (col) of each agent, all evaluated on the joint observations.
+    The blocks of each posterior precision are of the size of the agent's
+    dimension instead of the joint one. Unlike stacked_GBDS, the agents are
+    not stacked along an agent axis, as their dimensions generally differ.
+    """
+
+    def __init__(self, params, Input, xDim, yDim, extra_conds=None, *args,
+                 **kwargs):
+        """Initialize FactorizedSmoothingPastLDSTimeSeries random variable
+        (batch)
+
+        Args:
+            params: A list of dictionaries. Parameters of the
+                    SmoothingPastLDSTimeSeries of each agent, with its name
+                    and (increasing) columns col in the joint latent space.
+            Input: A Tensor. Observations based on which samples are drawn.
+            xDim, yDim: Integers. Dimension of the joint latent space (x)
+                        and observation (y).
+            extra_conds: Optional Tensor. Extra conditions of the trial.
+            name: Optional name for the random variable.
+                  Default to "FactorizedSmoothingPastLDSTimeSeries".
+        """
+        name = kwargs.get("name", "FactorizedSmoothingPastLDSTimeSeries")
+        with tf.name_scope(name):
+            if not isinstance(params, list):
+                raise TypeError("params must be a list.")
+            self.xDim = xDim
+            self.yDim = yDim
+
+            self.agents = []
+            self.agent_names = []
+            self.agent_cols = []
+            for p in params:
+                if list(p["col"]) != sorted(p["col"]):
+                    raise ValueError(
+                        "The columns of %s must be increasing." % p["name"])
+                self.agents.append(SmoothingPastLDSTimeSeries(
+                    p, Input, len(p["col"]), yDim, extra_conds,
+                    name=p["name"]))
+                self.agent_names.append(p["name"])
+                self.agent_cols.append(
+                    tf.constant(np.eye(xDim, dtype=np.float32)[p["col"]],
+                                name="%s_columns" % p["name"]))
+
+            self.y = self.agents[0].y
+            self.lag = self.agents[0].lag
+            self.params = []
+            self.log_vars = []
+            for q in self.agents:
+                self.params += q.params
+                self.log_vars += q.log_vars
+
+            with tf.name_scope("posterior_mean"):
+                self.postX = tf.expand_dims(tf.add_n(
+                    [_embed_cols(q.postX[:, :, :, 0], E)
+                     for (q, E) in zip(self.agents, self.agent_cols)]), -1,
+                                            "postX")
+
+            # the joint Cholesky factor is block diagonal across agents (at
+            # each time step), with identity blocks for unmodeled columns
+            with tf.name_scope("cholesky"):
+                unmodeled = tf.diag(1. - tf.reduce_sum(
+                    tf.concat(self.agent_cols, 0), 0))
+                self.the_chol = [
+                    tf.add_n([_embed_cols(q.the_chol[0], E, True)
+                              for (q, E) in zip(self.agents,
+                                                self.agent_cols)]) +
+                    unmodeled,
+                    tf.add_n([_embed_cols(q.the_chol[1], E, True)
+                              for (q, E) in zip(self.agents,
+                                                self.agent_cols)])]
+
+        if "name" not in kwargs:
+            kwargs["name"] = name
+        if "dtype" not in kwargs:
+            kwargs["dtype"] = tf.float32
+        if "reparameterization_type" not in kwargs:
+            kwargs["reparameterization_type"] = FULLY_REPARAMETERIZED
+        if "validate_args" not in kwargs:
+            kwargs["validate_args"] = True
+        if "allow_nan_stats" not in kwargs:
+            kwargs["allow_nan_stats"] = False
+
+        super(FactorizedSmoothingPastLDSTimeSeries, self).__init__(
+            *args, **kwargs)
+
+        self._args = (params, Input, xDim, yDim, extra_conds)
+
+    def _sample_n(self, n, seed=None):
+        return tf.add_n([_embed_cols(q.sample(n, seed), E)
+                         for (q, E) in zip(self.agents, self.agent_cols)])
+
+    def _log_prob(self, value):
+        return tf.add_n([q.log_prob(tf.tensordot(
+            value, E, [[len(value.shape) - 1], [1]]))
+                         for (q, E) in zip(self.agents, self.agent_cols)])
+
+    def filter_initial_state(self, batch_size=1):
+        """Return the list of the filter states of the agents.
+        """
+        return [q.filter_initial_state(batch_size) for q in self.agents]
+
+    def filter_step(self, y, state, extra_conds=None):
+        """Update the filtering posterior of every agent with the
+        observation of one new time step, see
+        SmoothingPastLDSTimeSeries.filter_step. The joint filtering
+        covariance is block diagonal across agents (and zero for unmodeled
+        columns).
+        """
+        means = []
+        covs = []
+        states = []
+        for (q, E, s) in zip(self.agents, self.agent_cols, state):
+            mean, cov, s = q.filter_step(y, s, extra_conds)
+            means.append(_embed_cols(mean, E))
+            covs.append(_embed_cols(cov, E, True))
+            states.append(s)
+
+        return (tf.add_n(means, "filtering_mean"),
+                tf.add_n(covs, "filtering_covariance"), states)
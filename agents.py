@@ -1,15 +1,53 @@
 import tensorflow as tf
-from tf_gbds.GenerativeModel import joint_GBDS
-from tf_gbds.RecognitionModel import SmoothingPastLDSTimeSeries
+from tf_gbds.GenerativeModel import joint_GBDS, stacked_GBDS
+from tf_gbds.RecognitionModel import (SmoothingPastLDSTimeSeries,
+                                      FactorizedSmoothingPastLDSTimeSeries)
 from tf_gbds.utils import pad_extra_conds
 
 
+_FILTER_STATE = ["time_step", "cholesky_block", "partial_solution",
+                 "LambdaChol", "past_observations"]
+
+
+def _filter_state_op(g_q, fn, *states):
+    """Apply fn to (the filter states of) the recognition model, or to
+    those of each agent, under its name scope, if it is factorized.
+    """
+    if isinstance(g_q, FactorizedSmoothingPastLDSTimeSeries):
+        outputs = []
+        for (i, (name, q)) in enumerate(zip(g_q.agent_names, g_q.agents)):
+            with tf.name_scope(name):
+                outputs.append(fn(q, *[s[i] for s in states]))
+        return outputs
+    else:
+        return fn(g_q, *states)
+
+
+def _name_filter_state(q, state):
+    """Name the filter state of a single trial."""
+    return [tf.identity(state[0], _FILTER_STATE[0])] + [
+        tf.identity(x[0], name) for (x, name) in zip(state[1:],
+                                                     _FILTER_STATE[1:])]
+
+
+def _filter_state_placeholders(q):
+    """Placeholders of the filter state of a single trial."""
+    return [tf.placeholder(tf.int32, [], _FILTER_STATE[0]),
+            tf.placeholder(tf.float32, [q.xDim, q.xDim], _FILTER_STATE[1]),
+            tf.placeholder(tf.float32, [q.xDim, 1], _FILTER_STATE[2]),
+            tf.placeholder(tf.float32, [q.xDim, q.lambda_cols],
+                           _FILTER_STATE[3]),
+            tf.placeholder(tf.float32, q.lag * q.yDim, _FILTER_STATE[4])]
+
+
 class game_model(object):
     def __init__(self, params, inputs, max_vel, get_state,
                  extra_dim=0, n_samples=50):
         with tf.name_scope(params["name"]):
             self.name = params["name"]
             self.obs_dim = params["obs_dim"]
+            self.max_vel = max_vel
+            self.get_state = get_state
 
             self.traj = inputs["trajectory"]
             self.states = inputs["states"]
@@ -32,16 +70,28 @@ class game_model(object):
                     Tt = traj_shape[1] - 1
                 value_shape = [B, Tt, self.obs_dim]
 
-            self.p = joint_GBDS(
-                params["agent_priors"], self.states, self.ctrl_obs,
-                self.extra_conds, name="prior",
-                value=tf.zeros(value_shape))
+            if params.get("stacked_agents"):
+                # agents evaluated together along an agent axis
+                self.p = stacked_GBDS(
+                    params["agent_priors"], self.states, self.ctrl_obs,
+                    self.extra_conds, name="prior",
+                    value=tf.zeros(value_shape))
+            else:
+                self.p = joint_GBDS(
+                    params["agent_priors"], self.states, self.ctrl_obs,
+                    self.extra_conds, name="prior",
+                    value=tf.zeros(value_shape))
             self.var_list += self.p.params
             self.log_vars += self.p.log_vars
 
-            self.g_q = SmoothingPastLDSTimeSeries(
-                params["g_q_params"], self.traj[:, 1:], self.obs_dim,
-                self.obs_dim, self.extra_conds, name="recognition")
+            if isinstance(params["g_q_params"], list):
+                self.g_q = FactorizedSmoothingPastLDSTimeSeries(
+                    params["g_q_params"], self.traj[:, 1:], self.obs_dim,
+                    self.obs_dim, self.extra_conds, name="recognition")
+            else:
+                self.g_q = SmoothingPastLDSTimeSeries(
+                    params["g_q_params"], self.traj[:, 1:], self.obs_dim,
+                    self.obs_dim, self.extra_conds, name="recognition")
             self.var_list += self.g_q.params
             self.log_vars += self.g_q.log_vars
 
@@ -137,3 +187,103 @@ class game_model(object):
                 next_y = tf.clip_by_value(
                     curr_y + max_vel * tf.tanh(curr_u), -1., 1.,
                     name="next_position")
+
+            with tf.name_scope("rollout"):
+                # simulate a batch of trajectories in a single session run
+                init_y = tf.placeholder(tf.float32, [None, self.obs_dim],
+                                        "initial_position")
+                init_g = tf.placeholder(tf.float32, [None, self.obs_dim],
+                                        "initial_goal")
+                horizon = tf.placeholder(tf.int32, [], "horizon")
+                if extra_dim != 0:
+                    rollout_extra_conds = tf.placeholder(
+                        tf.float32, extra_dim, "extra_conditions")
+                else:
+                    rollout_extra_conds = None
+
+                goals, ctrls, positions = self.rollout(
+                    init_y, init_g, horizon, rollout_extra_conds)
+                tf.identity(goals, "goals")
+                tf.identity(ctrls, "controls")
+                tf.identity(positions, "positions")
+
+            with tf.name_scope("filter_one_step"):
+                # online goal inference: the posterior of the current goal
+                # given the trajectory so far, updated in constant time per
+                # observation by feeding the state back at each step
+                with tf.name_scope("initial_state"):
+                    _filter_state_op(self.g_q, _name_filter_state,
+                                     self.g_q.filter_initial_state())
+
+                obs_y = tf.placeholder(tf.float32, self.obs_dim,
+                                       "current_position")
+                if extra_dim != 0:
+                    filter_extra_conds = tf.placeholder(
+                        tf.float32, extra_dim, "extra_conditions")
+                else:
+                    filter_extra_conds = None
+
+                with tf.name_scope("previous_state"):
+                    prev_state = _filter_state_op(
+                        self.g_q, _filter_state_placeholders)
+                    prev_state = _filter_state_op(
+                        self.g_q, lambda q, state: [state[0]] + [
+                            tf.expand_dims(x, 0) for x in state[1:]],
+                        prev_state)
+
+                filt_mean, filt_cov, curr_state = self.g_q.filter_step(
+                    tf.expand_dims(obs_y, 0), prev_state, filter_extra_conds)
+
+                with tf.name_scope("goal"):
+                    tf.identity(filt_mean[0], "mean")
+                    tf.identity(filt_cov[0], "covariance")
+
+                with tf.name_scope("current_state"):
+                    _filter_state_op(self.g_q, _name_filter_state,
+                                     curr_state)
+
+    def rollout(self, init_y, init_g, horizon, extra_conds=None):
+        """Simulate trajectories [n_traj x horizon (+ 1) x obs_dim] of
+        goals, controls and positions from initial positions and goals
+        [n_traj x obs_dim], repeating the goal, control and position updates
+        of update_one_step in a tf.while_loop. The errors and the control
+        before the first time step are zero.
+        """
+        with tf.name_scope("rollout_loop"):
+            # the last positions, from which the states are computed
+            # (velocity, and acceleration if included in the state)
+            window = tf.tile(tf.expand_dims(init_y, 1), [1, 3, 1])
+            errors = tf.zeros([2, tf.shape(init_y)[0], self.obs_dim])
+            u = tf.zeros_like(init_y)
+            arrays = [tf.TensorArray(tf.float32, horizon)
+                      for _ in range(3)]
+
+            def step(t, window, prev_g, errors, prev_u, goals, ctrls,
+                     positions):
+                curr_y = window[:, -1]
+                curr_s = self.get_state(window, self.max_vel)[:, -1]
+                curr_g = tf.cond(
+                    tf.equal(t, 0), lambda: prev_g,
+                    lambda: self.p.update_goal(curr_s, prev_g, extra_conds))
+                errors = tf.concat(
+                    [errors, tf.expand_dims(curr_g - curr_y, 0)], 0)
+                curr_u = self.p.update_ctrl(errors, prev_u)
+                next_y = tf.clip_by_value(
+                    curr_y + self.max_vel * tf.tanh(curr_u), -1., 1.)
+
+                return (t + 1,
+                        tf.concat([window[:, 1:],
+                                   tf.expand_dims(next_y, 1)], 1),
+                        curr_g, errors[1:], curr_u,
+                        goals.write(t, curr_g), ctrls.write(t, curr_u),
+                        positions.write(t, next_y))
+
+            loop_vars = tf.while_loop(
+                lambda t, *args: t < horizon, step,
+                [tf.constant(0), window, init_g, errors, u] + arrays)
+
+            goals, ctrls, positions = [
+                tf.transpose(x.stack(), [1, 0, 2]) for x in loop_vars[-3:]]
+            positions = tf.concat([tf.expand_dims(init_y, 1), positions], 1)
+
+        return goals, ctrls, positions
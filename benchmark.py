@@ -0,0 +1,221 @@
+"""
+Benchmarks for the generative model (GBDS).
+
+Usage:
+    python -m tf_gbds.benchmark --pid --T=100,1000,10000 --dim=1,2,4 --B=1,8 \
+        --output=benchmark_model.json
+    python -m tf_gbds.benchmark --g0 --n_samples=1000,100000 --dim=1,2
+
+--pid compares the PID convolution of GBDS.get_preds (pid_convolution)
+with its previous implementation, which convolved each control dimension
+separately. For each combination of trial length (T), control dimension
+(dim) and batch size (B), the number of graph operations and the time of
+the forward pass and of the forward pass with its gradient are reported.
+--g0 compares drawing initial goals with sample_mixture (GBDS.sample_g0)
+with the previous sampler, which drew one sample at a time in a map_fn.
+The results are written as JSON so that they can be compared between
+versions.
+"""
+
+import argparse
+import json
+import platform
+import numpy as np
+import tensorflow as tf
+from tf_gbds.GenerativeModel import pid_convolution, sample_mixture
+from tf_gbds.lib.benchmark import time_op
+
+
+def pid_convolution_loop(error, L):
+    """
+    Previous implementation of pid_convolution, kept as the baseline for
+    bench_pid. Each control dimension is padded and convolved on its own.
+    """
+    with tf.name_scope("convolution"):
+        u_diff = []
+        # get current error signal and corresponding filter
+        for i in range(int(L.shape[0])):
+            signal = error[:, :, i]
+            # pad the beginning of control signal with zero
+            signal = tf.expand_dims(
+                tf.pad(signal, [[0, 0], [2, 0]], name="pad_zero"),
+                -1, name="reshape_signal")
+            filt = tf.reshape(L[i], [-1, 1, 1], "reshape_filter")
+            res = tf.nn.convolution(signal, filt, padding="VALID",
+                                    name="convolve_signal")
+            u_diff.append(res)
+
+    if len(u_diff) > 1:
+        u_diff = tf.concat([*u_diff], -1, "control_signal_change")
+    else:
+        u_diff = tf.identity(u_diff[0], "contrl_signal_change")
+
+    return u_diff
+
+
+def _with_gradients(fn, error, L):
+    """
+    Evaluate fn(error, L) and the gradients of its sum with respect to the
+    inputs.
+    """
+    u = fn(error, L)
+
+    return u, tf.gradients(tf.reduce_sum(u), [error, L])
+
+
+def _count_ops(build):
+    """
+    Call build() and return its outputs along with the number of operations
+    it added to the default graph.
+    """
+    graph = tf.get_default_graph()
+    n_ops = len(graph.get_operations())
+    outputs = build()
+
+    return outputs, len(graph.get_operations()) - n_ops
+
+
+def bench_pid(T_list, dim_list, B_list, n_iter=10, seed=1234):
+    """
+    Compare the forward pass and the gradient of pid_convolution with the
+    previous implementation (pid_convolution_loop).
+    """
+    results = []
+    for dim in dim_list:
+        for batch_size in B_list:
+            for T in T_list:
+                tf.reset_default_graph()
+                rng = np.random.RandomState(seed)
+                error = tf.placeholder(tf.float32, [None, None, dim])
+                L = tf.placeholder(tf.float32, [dim, 3])
+                feed_dict = {error: rng.randn(batch_size, T, dim),
+                             L: rng.randn(dim, 3)}
+
+                n_ops = {}
+                outputs = {}
+                for (name, fn) in [("previous", pid_convolution_loop),
+                                   ("current", pid_convolution)]:
+                    outputs[name], n_ops[name] = _count_ops(
+                        lambda: _with_gradients(fn, error, L))
+
+                with tf.Session() as sess:
+                    max_diff = np.abs(sess.run(
+                        outputs["previous"][0] - outputs["current"][0],
+                        feed_dict)).max()
+                    res = dict(T=T, dim=dim, batch_size=batch_size,
+                               max_abs_diff=float(max_diff))
+                    for name in ["previous", "current"]:
+                        u, grads = outputs[name]
+                        res[name + "_n_ops"] = n_ops[name]
+                        res[name + "_forward_s"] = time_op(
+                            sess, u, n_iter, feed_dict)
+                        res[name + "_gradient_s"] = time_op(
+                            sess, [u, grads], n_iter, feed_dict)
+
+                results.append(res)
+                print("T = %5d, dim = %d, B = %d: %3d ops, %8.2f ms "
+                      "(previous), %3d ops, %8.2f ms (current), "
+                      "forward + gradient" % (
+                          T, dim, batch_size, res["previous_n_ops"],
+                          1e3 * res["previous_gradient_s"],
+                          res["current_n_ops"],
+                          1e3 * res["current_gradient_s"]))
+
+    return results
+
+
+def sample_g0_map_fn(mu, lambda_, w, n):
+    """
+    Previous implementation of GBDS.sample_g0(n), kept as the baseline for
+    bench_g0. Each sample draws its own component and normal in a map_fn.
+    """
+    def sample_g0(_):
+        k0 = tf.squeeze(tf.multinomial(tf.reshape(
+            tf.log(w), [1, -1]), 1))
+        return (tf.random_normal(tf.shape(mu[0])) / tf.sqrt(lambda_[k0]) +
+                mu[k0])
+
+    return tf.map_fn(sample_g0, tf.zeros(n))
+
+
+def bench_g0(n_list, dim_list, K=8, n_iter=10, seed=1234):
+    """
+    Compare drawing n initial goals with sample_mixture and with the
+    previous implementation (sample_g0_map_fn). The moments of the samples
+    are reported for both.
+    """
+    results = []
+    for dim in dim_list:
+        for n in n_list:
+            tf.reset_default_graph()
+            rng = np.random.RandomState(seed)
+            mu = tf.constant(rng.randn(K, dim).astype(np.float32))
+            lambda_ = tf.constant(np.exp(rng.randn(K, dim)).astype(
+                np.float32))
+            w = tf.nn.softmax(tf.constant(rng.randn(K).astype(np.float32)))
+
+            samples = dict(previous=sample_g0_map_fn(mu, lambda_, w, n),
+                           current=sample_mixture(mu, lambda_, w, n))
+
+            res = dict(n=n, dim=dim, K=K)
+            with tf.Session() as sess:
+                for name in ["previous", "current"]:
+                    res[name + "_s"] = time_op(sess, samples[name], n_iter)
+                    x = sess.run(samples[name])
+                    res[name + "_mean"] = x.mean(0).tolist()
+                    res[name + "_std"] = x.std(0).tolist()
+
+            results.append(res)
+            print("n = %6d, dim = %d: %10.2f ms (previous), %8.2f ms "
+                  "(current)" % (n, dim, 1e3 * res["previous_s"],
+                                 1e3 * res["current_s"]))
+
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--pid", action="store_true",
+                        help="Compare pid_convolution with its previous "
+                        "implementation")
+    parser.add_argument("--g0", action="store_true",
+                        help="Compare sample_mixture with the previous "
+                        "sampler of the initial goals")
+    parser.add_argument("--n_samples", default="1000,100000",
+                        help="Numbers of initial goals drawn (separated by "
+                        ",)")
+    parser.add_argument("--T", default="100,1000,10000",
+                        help="Trial lengths (separated by ,)")
+    parser.add_argument("--dim", default="1,2,4",
+                        help="Control dimensions (separated by ,)")
+    parser.add_argument("--B", default="1,8",
+                        help="Batch sizes (separated by ,)")
+    parser.add_argument("--n_iter", type=int, default=10,
+                        help="Number of timed runs per configuration")
+    parser.add_argument("--output", default=None,
+                        help="File the results are written to (JSON)")
+    args = parser.parse_args()
+
+    T_list = [int(T) for T in args.T.split(",")]
+    dim_list = [int(d) for d in args.dim.split(",")]
+    B_list = [int(B) for B in args.B.split(",")]
+
+    results = []
+    if args.pid:
+        results += bench_pid(T_list, dim_list, B_list, args.n_iter)
+    if args.g0:
+        results += bench_g0([int(n) for n in args.n_samples.split(",")],
+                            dim_list, n_iter=args.n_iter)
+
+    if args.output is not None:
+        with open(args.output, "w") as f:
+            json.dump(dict(tensorflow_version=tf.__version__,
+                           numpy_version=np.__version__,
+                           platform=platform.platform(),
+                           n_iter=args.n_iter, results=results),
+                      f, indent=2)
+        print("Results written to %s." % args.output)
+
+
+if __name__ == "__main__":
+    main()
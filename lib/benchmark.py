@@ -0,0 +1,435 @@
+"""
+Benchmarks for the block tridiagonal routines in tf_gbds.lib.
+
+Usage:
+    python -m tf_gbds.lib.benchmark --T=10,100,1000,10000 --n=2,8,32 \
+        --B=1,8 --output=benchmark.json
+    python -m tf_gbds.lib.benchmark --T=10000 --n=8 --B=8 --memory \
+        --kernels=blk_tridiag_chol,blk_tridiag_chol_autodiff
+    python -m tf_gbds.lib.benchmark --sym_baseline --T=10,100,1000 --n=3
+
+The first form times the forward pass and the gradient of every kernel for
+each combination of trial length (T), block size (n) and batch size (B),
+and writes the results as JSON so that they can be compared between
+versions. With --memory, the peak memory of the forward pass and of the
+gradient of each kernel is measured as well; their difference is the memory
+retained for the backward pass. The *_autodiff kernels backprop through the
+scans instead of using the adjoint gradients, for comparison. The second
+form compares compute_sym_blk_tridiag with its previous implementation.
+"""
+
+import argparse
+import json
+import multiprocessing
+import platform
+import resource
+import sys
+import time
+import numpy as np
+import tensorflow as tf
+import tf_gbds.lib.blk_tridiag_chol_tools as blk
+import tf_gbds.lib.np_blk_tridiag as npblk
+import tf_gbds.lib.sym_blk_tridiag_inv as sym
+
+
+def random_blk_tridiag(batch_size, T, n, seed=None):
+    """
+    Generate a random symmetric, positive definite block tridiagonal matrix
+    as the product of a random block-bi-diagonal matrix and its transpose.
+    Outputs:
+    AA - [Batch_size x T x n x n] array of diagonal blocks
+    BB - [Batch_size x T-1 x n x n] array of (upper) off-diagonal blocks
+    """
+    rng = np.random.RandomState(seed)
+    L = (np.tril(.3 * rng.randn(batch_size, T, n, n)) +
+         2 * np.eye(n)).astype(np.float32)
+    # keep the off-diagonal blocks smaller than the diagonal ones, so that
+    # the matrix stays well conditioned for long trials
+    C = (.5 / np.sqrt(n) *
+         rng.randn(batch_size, T - 1, n, n)).astype(np.float32)
+
+    AA = np.matmul(L, np.swapaxes(L, -1, -2))
+    AA[:, 1:] += np.matmul(C, np.swapaxes(C, -1, -2))
+    BB = np.matmul(L[:, :-1], np.swapaxes(C, -1, -2))
+
+    return AA, BB
+
+
+def time_op(sess, fetches, n_iter=10, feed_dict=None):
+    """
+    Return the median wall time (in seconds) of evaluating fetches, after
+    one warm-up run.
+    """
+    sess.run(fetches, feed_dict)
+    times = []
+    for _ in range(n_iter):
+        start = time.time()
+        sess.run(fetches, feed_dict)
+        times.append(time.time() - start)
+
+    return float(np.median(times))
+
+
+def compute_sym_blk_tridiag_where(AA, BB):
+    """
+    Previous implementation of sym.compute_sym_blk_tridiag, kept as the
+    baseline for bench_sym_blk_tridiag. Every scan step recomputes the
+    boundary blocks with fresh matrix inverses and evaluates all tf.where
+    branches.
+    """
+    BB = -BB
+
+    nT = tf.shape(AA)[1]
+    batch_size = tf.shape(AA)[0]
+    d = tf.shape(AA)[2]
+
+    III = tf.eye(d, dtype=tf.float32)
+
+    initS = tf.zeros([batch_size, d, d], dtype=tf.float32)
+
+    def compute_S(acc, inputs):
+        Sp1 = acc
+        idx = inputs[0]
+        B_ip1 = BB[:, tf.minimum(idx + 1, nT - 2)]
+        S_nTm1 = tf.matmul(BB[:, -1], tf.matrix_inverse(AA[:, -1]))
+        S_i = tf.matmul(
+          BB[:, idx],
+          tf.matrix_inverse(AA[:, tf.minimum(idx + 1, nT - 2)] -
+                            tf.matmul(Sp1, tf.transpose(B_ip1,
+                                                        perm=[0, 2, 1]))))
+        Sm = tf.where(tf.equal(tf.tile([idx], [batch_size]), nT - 2),
+                      S_nTm1, S_i)
+
+        return Sm
+
+    S = tf.scan(compute_S, [tf.range(nT - 2, -1, -1)], initializer=initS)
+    S = tf.transpose(S, perm=[1, 0, 2, 3])
+
+    initD = tf.zeros([batch_size, d, d], dtype=tf.float32)
+
+    def compute_D(acc, inputs):
+        Dm1 = acc
+        idx = inputs[0]
+        D_nT = tf.matmul(tf.matrix_inverse(AA[:, -1]),
+                         (III + tf.matmul(
+                          tf.transpose(BB[:, idx-1], perm=[0, 2, 1]),
+                          tf.matmul(Dm1, S[:, 0]))))
+        D1 = (tf.matrix_inverse(AA[:, 0] -
+              tf.matmul(BB[:, 0],
+                        tf.transpose(S[:, -1], perm=[0, 2, 1]))))
+        B_ip11 = BB[:, tf.minimum(idx, nT - 2)]
+        S_t = tf.transpose(S[:, tf.maximum(-idx - 1, -nT + 1)],
+                           perm=[0, 2, 1])
+        B_t = tf.transpose(BB[:, tf.minimum(idx - 1, nT - 2)],
+                           perm=[0, 2, 1])
+        D = tf.where(
+          tf.equal(tf.tile([idx], [batch_size]), nT - 1), D_nT,
+          tf.where(tf.equal(tf.tile([idx], [batch_size]), 0), D1,
+                   tf.matmul(tf.matrix_inverse(AA[:, idx] -
+                             tf.matmul(B_ip11, S_t)),
+                   III + tf.matmul(B_t, tf.matmul(Dm1, S[:, -idx])))))
+
+        return D
+
+    D = tf.scan(compute_D, [tf.range(0, nT)], initializer=initD)
+    D = tf.transpose(D, perm=[1, 0, 2, 3])
+
+    def compute_OD(acc, inputs):
+        idx = inputs[0]
+        OD = tf.matmul(tf.transpose(S[:, -idx - 1], perm=[0, 2, 1]),
+                       D[:, idx])
+
+        return OD
+
+    OD = tf.scan(compute_OD, [tf.range(0, nT-1)],
+                 initializer=tf.matmul(tf.transpose(S[:, -1], perm=[0, 2, 1]),
+                                       D[:, 0]))
+
+    return [D, OD, S]
+
+
+def bench_sym_blk_tridiag(T_list, n, batch_size, n_iter=10, seed=1234):
+    """
+    Compare the per-time-step cost of compute_sym_blk_tridiag with the
+    previous implementation, and report the cost of
+    compute_sym_blk_tridiag_inv_b.
+    """
+    results = []
+    for T in T_list:
+        tf.reset_default_graph()
+        AA, BB = random_blk_tridiag(batch_size, T, n, seed)
+        AA = tf.constant(AA)
+        BB = tf.constant(BB)
+        b = tf.ones([batch_size, T, n, 1])
+
+        D_old, _, _ = compute_sym_blk_tridiag_where(AA, BB)
+        D, OD, S = sym.compute_sym_blk_tridiag(AA, BB)
+
+        with tf.Session() as sess:
+            t_old = time_op(sess, D_old, n_iter)
+            t_new = time_op(sess, [D, OD], n_iter)
+            max_diff = np.abs(sess.run(D_old - D)).max()
+
+            # time the solve on its own
+            D_val, S_val = sess.run([D, S])
+            x = sym.compute_sym_blk_tridiag_inv_b(
+                tf.constant(S_val), tf.constant(D_val), b)
+            t_inv_b = time_op(sess, x, n_iter)
+
+        results.append(dict(
+            T=T, n=n, batch_size=batch_size,
+            previous_us_per_step=1e6 * t_old / T,
+            current_us_per_step=1e6 * t_new / T,
+            inv_b_us_per_step=1e6 * t_inv_b / T,
+            max_abs_diff=float(max_diff)))
+        print("T = %5d: %8.1f us/step (previous), %8.1f us/step (current), "
+              "%8.1f us/step (inv_b)" % (
+                  T, 1e6 * t_old / T, 1e6 * t_new / T, 1e6 * t_inv_b / T))
+
+    return results
+
+
+# Each kernel maps the diagonal/off-diagonal blocks of a symmetric, positive
+# definite matrix (AA, BB), its Cholesky factor (L, C) and a right-hand side b
+# to the tensors it outputs, and names the inputs it is differentiated with
+# respect to.
+KERNELS = {
+    "blk_tridiag_chol": (
+        lambda AA, BB, L, C, b: blk.blk_tridiag_chol(AA, BB),
+        ("AA", "BB")),
+    "blk_tridiag_chol_parallel": (
+        lambda AA, BB, L, C, b: blk.blk_tridiag_chol_parallel(AA, BB),
+        ("AA", "BB")),
+    "blk_chol_inv_lower": (
+        lambda AA, BB, L, C, b: [blk.blk_chol_inv(
+            L, C, b, triangular=True)],
+        ("L", "C", "b")),
+    "blk_chol_inv_upper": (
+        lambda AA, BB, L, C, b: [blk.blk_chol_inv(
+            L, C, b, lower=False, transpose=True, triangular=True)],
+        ("L", "C", "b")),
+    "compute_sym_blk_tridiag": (
+        lambda AA, BB, L, C, b: sym.compute_sym_blk_tridiag(AA, BB)[:2],
+        ("AA", "BB")),
+    # backprop through the scans, without the adjoint gradients
+    "blk_tridiag_chol_autodiff": (
+        lambda AA, BB, L, C, b: blk._blk_tridiag_chol(AA, BB),
+        ("AA", "BB")),
+    "blk_chol_inv_lower_autodiff": (
+        lambda AA, BB, L, C, b: [blk._blk_chol_inv(
+            L, C, b, True, False, True)],
+        ("L", "C", "b")),
+    "blk_chol_inv_upper_autodiff": (
+        lambda AA, BB, L, C, b: [blk._blk_chol_inv(
+            L, C, b, False, True, True)],
+        ("L", "C", "b")),
+}
+
+
+def _kernel_data(batch_size, T, n, seed):
+    """
+    Generate the inputs of the kernels: the blocks of a random symmetric,
+    positive definite block tridiagonal matrix, its Cholesky factor and a
+    right-hand side.
+    """
+    AA, BB = random_blk_tridiag(batch_size, T, n, seed)
+    L, C = [x.astype(np.float32) for x in npblk.blk_tridiag_chol(
+        AA.astype(np.float64), BB.astype(np.float64))]
+    b = np.random.RandomState(seed).randn(
+        batch_size, T, n, 1).astype(np.float32)
+
+    return dict(AA=AA, BB=BB, L=L, C=C, b=b)
+
+
+def _build_kernel(name, n):
+    """
+    Build the graph of a kernel. Returns the dict of input placeholders, the
+    list of outputs and the list of gradients of their sum with respect to
+    the inputs the kernel is differentiated with respect to.
+    """
+    inputs = dict(
+        AA=tf.placeholder(tf.float32, [None, None, n, n]),
+        BB=tf.placeholder(tf.float32, [None, None, n, n]),
+        L=tf.placeholder(tf.float32, [None, None, n, n]),
+        C=tf.placeholder(tf.float32, [None, None, n, n]),
+        b=tf.placeholder(tf.float32, [None, None, n, 1]))
+
+    fn, wrt = KERNELS[name]
+    outputs = fn(inputs["AA"], inputs["BB"], inputs["L"], inputs["C"],
+                 inputs["b"])
+    grads = tf.gradients(tf.add_n([tf.reduce_sum(x) for x in outputs]),
+                         [inputs[x] for x in wrt])
+
+    return inputs, outputs, grads
+
+
+def _proc_status(field):
+    """
+    Read a memory field of /proc/self/status (Linux), in bytes.
+    """
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith(field + ":"):
+                return int(line.split()[1]) * 1024
+
+
+def _peak_memory_child(name, T, n, batch_size, seed, forward, queue):
+    data = _kernel_data(batch_size, T, n, seed)
+    inputs, outputs, grads = _build_kernel(name, n)
+    feed_dict = {inputs[x]: data[x] for x in data}
+    fetches = outputs if forward else grads
+    with tf.Session() as sess:
+        if sys.platform.startswith("linux"):
+            # reset the peak resident set size, which importing tensorflow
+            # and building the graph have already raised
+            with open("/proc/self/clear_refs", "w") as f:
+                f.write("5")
+            start = _proc_status("VmRSS")
+            sess.run(fetches, feed_dict)
+            queue.put(_proc_status("VmHWM") - start)
+        else:
+            start = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            sess.run(fetches, feed_dict)
+            rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            queue.put(rss - start)
+
+
+def peak_memory(name, T, n, batch_size, seed=1234, forward=False):
+    """
+    Return the peak resident memory (in bytes) of a fresh process while
+    evaluating the gradient of a kernel (or only its outputs, if forward),
+    relative to its memory before the run. Both include the inputs and the
+    outputs of the forward pass; the difference between the gradient and
+    the forward peaks is the memory retained for the backward pass. On
+    platforms other than Linux, the increase of the peak resident set size
+    is returned instead (in the unit of ru_maxrss), which underestimates
+    small peaks.
+    """
+    ctx = multiprocessing.get_context("spawn")
+    queue = ctx.Queue()
+    process = ctx.Process(target=_peak_memory_child,
+                          args=(name, T, n, batch_size, seed, forward,
+                                queue))
+    process.start()
+    peak = queue.get()
+    process.join()
+
+    return peak
+
+
+def bench_kernels(T_list, n_list, B_list, kernels=None, n_iter=10,
+                  max_elements=2.5e7, memory=False, seed=1234):
+    """
+    Time the forward pass and the gradient (forward and backward pass) of
+    each kernel for every combination of trial length, block size and batch
+    size, and optionally measure the peak memory of the forward pass and of
+    the gradient, and the memory retained for the backward pass.
+    Combinations whose inputs have more than max_elements entries are
+    skipped.
+    """
+    if kernels is None:
+        kernels = sorted(KERNELS)
+
+    results = []
+    for T in T_list:
+        for n in n_list:
+            for batch_size in B_list:
+                if batch_size * T * n * n > max_elements:
+                    print("Skipping T = %s, n = %s, B = %s." % (
+                        T, n, batch_size))
+                    continue
+
+                tf.reset_default_graph()
+                data = _kernel_data(batch_size, T, n, seed)
+
+                with tf.Session() as sess:
+                    for name in kernels:
+                        inputs, outputs, grads = _build_kernel(name, n)
+                        feed_dict = {inputs[x]: data[x] for x in data}
+
+                        t_forward = time_op(sess, outputs, n_iter, feed_dict)
+                        t_gradient = time_op(sess, grads, n_iter, feed_dict)
+
+                        result = dict(
+                            kernel=name, T=T, n=n, batch_size=batch_size,
+                            forward_s=t_forward, gradient_s=t_gradient)
+                        msg = ("%-28s T = %5d, n = %2d, B = %2d: "
+                               "forward %.4f s, gradient %.4f s" % (
+                                   name, T, n, batch_size, t_forward,
+                                   t_gradient))
+                        if memory:
+                            result["forward_peak_bytes"] = peak_memory(
+                                name, T, n, batch_size, seed, forward=True)
+                            result["gradient_peak_bytes"] = peak_memory(
+                                name, T, n, batch_size, seed)
+                            result["backprop_bytes"] = (
+                                result["gradient_peak_bytes"] -
+                                result["forward_peak_bytes"])
+                            msg += (", peak memory %.1f MB (forward), "
+                                    "%.1f MB (gradient), backprop retains "
+                                    "%.1f MB" % tuple(
+                                        result[x] / 2. ** 20 for x in [
+                                            "forward_peak_bytes",
+                                            "gradient_peak_bytes",
+                                            "backprop_bytes"]))
+                        results.append(result)
+                        print(msg)
+
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--T", default="10,100,1000,10000",
+                        help="Trial lengths (separated by ,)")
+    parser.add_argument("--n", default="2,8,32",
+                        help="Block sizes (separated by ,)")
+    parser.add_argument("--B", default="1,8",
+                        help="Batch sizes (separated by ,)")
+    parser.add_argument("--kernels", default=None,
+                        help="Kernels to time (separated by ,), one of %s" %
+                        ", ".join(sorted(KERNELS)))
+    parser.add_argument("--n_iter", type=int, default=10,
+                        help="Number of timed runs per configuration")
+    parser.add_argument("--max_elements", type=float, default=2.5e7,
+                        help="Skip configurations with larger inputs")
+    parser.add_argument("--memory", action="store_true",
+                        help="Measure the peak memory of the forward "
+                        "passes and of the gradients")
+    parser.add_argument("--output", default=None,
+                        help="File the results are written to (JSON)")
+    parser.add_argument("--sym_baseline", action="store_true",
+                        help="Compare compute_sym_blk_tridiag with its "
+                        "previous implementation")
+    args = parser.parse_args()
+
+    T_list = [int(T) for T in args.T.split(",")]
+    n_list = [int(n) for n in args.n.split(",")]
+    B_list = [int(B) for B in args.B.split(",")]
+
+    if args.sym_baseline:
+        results = []
+        for n in n_list:
+            for batch_size in B_list:
+                results += bench_sym_blk_tridiag(T_list, n, batch_size,
+                                                 args.n_iter)
+    else:
+        if args.kernels is not None:
+            kernels = args.kernels.split(",")
+        else:
+            kernels = None
+        results = bench_kernels(T_list, n_list, B_list, kernels,
+                                args.n_iter, args.max_elements, args.memory)
+
+    if args.output is not None:
+        with open(args.output, "w") as f:
+            json.dump(dict(tensorflow_version=tf.__version__,
+                           numpy_version=np.__version__,
+                           platform=platform.platform(),
+                           n_iter=args.n_iter, results=results),
+                      f, indent=2)
+        print("Results written to %s." % args.output)
+
+
+if __name__ == "__main__":
+    main()
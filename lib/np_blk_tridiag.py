@@ -0,0 +1,284 @@
+"""
+NumPy/SciPy implementation of the block tridiagonal routines in
+blk_tridiag_chol_tools and sym_blk_tridiag_inv, for evaluating the
+recognition posterior without building a TensorFlow graph. Every function
+follows the signature and batch conventions of its TensorFlow counterpart.
+"""
+
+import numpy as np
+from scipy.linalg import cholesky_banded, solve_banded
+
+
+def _to_banded(A, B):
+    """
+    Convert a block-bi-diagonal (lower) matrix to LAPACK lower banded storage
+    with 2n-1 subdiagonals, such that ab[:, k, j] = C[:, j+k, j].
+    Inputs:
+    A - [Batch_size x T x n x n] array of block diagonal matrices
+    B - [Batch_size x T-1 x n x n] array of (lower) 1st block off-diagonal
+        matrices, B[:, i] is the block at (i+1, i)
+    """
+    batch_size, T, n, _ = A.shape
+    cols = np.concatenate(
+        [A, np.pad(B, [(0, 0), (0, 1), (0, 0), (0, 0)], "constant")], 2)
+    ab = np.zeros((batch_size, 2 * n, T * n), A.dtype)
+    for k in range(2 * n):
+        for c in range(min(n, 2 * n - k)):
+            ab[:, k, c::n] = cols[:, :, c + k, c]
+
+    return ab
+
+
+def _from_banded(ab, n):
+    """
+    Inverse of _to_banded. Returns the list [A, B] of block diagonal and
+    (lower) 1st block off-diagonal matrices.
+    """
+    batch_size = ab.shape[0]
+    T = ab.shape[2] // n
+    cols = np.zeros((batch_size, T, 2 * n, n), ab.dtype)
+    for k in range(2 * n):
+        for c in range(min(n, 2 * n - k)):
+            cols[:, :, c + k, c] = ab[:, k, c::n]
+
+    return [cols[:, :, :n], cols[:, :-1, n:]]
+
+
+def blk_tridiag_chol(A, B):
+    """
+    Compute the cholesky decomposition of a symmetric, positive definite
+    block-tridiagonal matrix, by banded Cholesky factorization of each trial.
+    Inputs:
+    A - [Batch_size x T x n x n] array,
+        where each A[:,i,:,:] is the ith block diagonal matrix
+    B - [Batch_size x T-1 x n x n] array, where each B[:,i,:,:] is the ith
+        (upper) 1st block off-diagonal matrix
+    Outputs:
+    R - python list with two elements
+        * R[0] - [Batch_size x T x n x n] array of block diagonal elements
+        of Cholesky decomposition
+        * R[1] - [Batch_size x T-1 x n x n] array of (lower) 1st block
+        off-diagonal elements of Cholesky
+    """
+    n = A.shape[-1]
+    ab = _to_banded(A, np.swapaxes(B, -1, -2))
+    ab = np.stack([cholesky_banded(ab_i, lower=True) for ab_i in ab])
+
+    return _from_banded(ab, n)
+
+
+def blk_chol_sel_inv(A, B):
+    """
+    Compute the block diagonal and 1st block off-diagonal of the inverse of a
+    symmetric, positive definite block-tridiagonal matrix from its Cholesky
+    factor (selected inversion), in a single backward sweep.
+    Inputs:
+    A - [Batch_size x T x n x n] array of block diagonal elements of the
+        Cholesky factor (lower-triangular), as returned by blk_tridiag_chol
+    B - [Batch_size x T-1 x n x n] array of (lower) 1st block off-diagonal
+        elements of the Cholesky factor
+    Outputs:
+    R - python list with two elements
+        * R[0] - [Batch_size x T x n x n] array of block diagonal elements
+        of the inverse
+        * R[1] - [Batch_size x T-1 x n x n] array of (lower) 1st block
+        off-diagonal elements of the inverse
+    """
+    T, n = A.shape[1], A.shape[-1]
+    A_inv = np.linalg.solve(A, np.broadcast_to(np.eye(n, dtype=A.dtype),
+                                               A.shape))
+    P = np.matmul(np.swapaxes(A_inv, -1, -2), A_inv)
+    G = np.matmul(B, A_inv[:, :-1])
+
+    D = np.array(P)
+    OD = np.zeros_like(B)
+    for i in range(T - 2, -1, -1):
+        OD[:, i] = -np.matmul(D[:, i + 1], G[:, i])
+        D[:, i] = P[:, i] - np.matmul(np.swapaxes(G[:, i], -1, -2), OD[:, i])
+
+    return [D, OD]
+
+
+def blk_chol_inv(A, B, b, lower=True, transpose=False, triangular=False):
+    """
+    Solve the equation Cx = b for x, where C is assumed to be a
+    block-bi-diagonal matrix ( where only the first (lower or upper)
+    off-diagonal block is nonzero.
+    Inputs:
+    A - [Batch_size x T x n x n] array, where each A[:,i,:,:] is the ith block
+        diagonal matrix
+    B - [Batch_size x T-1 x n x n] array, where each B[:,i,:,:] is the ith
+        (upper or lower) 1st block off-diagonal matrix
+    b - [Batch_size x T x n x k] array
+
+    lower (default: True) - boolean specifying whether to treat B as the lower
+          or upper 1st block off-diagonal of matrix C
+    transpose (default: False) - boolean specifying whether to transpose the
+          off-diagonal blocks B[:,i,:,:] (useful if you want to compute solve
+          the problem C^T x = b with a representation of C.)
+    triangular (default: False) - boolean specifying whether the diagonal
+          blocks A[:,i,:,:] are lower-triangular (e.g. the Cholesky factor
+          returned by blk_tridiag_chol), in which case C is triangular and
+          each trial is solved in banded storage
+    Outputs:
+    x - solution of Cx = b
+    """
+    batch_size, T, n, _ = A.shape
+    k = b.shape[-1]
+
+    if triangular and lower != transpose:
+        # C (or C^T) is a banded lower-triangular matrix
+        ab = _to_banded(A, B)
+        if not lower:
+            # C is the transpose of the lower-triangular matrix built from A
+            # and B; shift the lower banded storage to upper banded storage
+            u = 2 * n - 1
+            ab_upper = np.zeros_like(ab)
+            for d in range(2 * n):
+                ab_upper[:, u - d, d:] = ab[:, d, :T * n - d]
+            ab = ab_upper
+        l_and_u = (2 * n - 1, 0) if lower else (0, 2 * n - 1)
+        x = np.stack([solve_banded(l_and_u, ab_i, b_i.reshape(T * n, k))
+                      for (ab_i, b_i) in zip(ab, b)])
+
+        return x.reshape(batch_size, T, n, k)
+
+    if transpose:
+        A = np.swapaxes(A, -1, -2)
+        B = np.swapaxes(B, -1, -2)
+    x = np.zeros(b.shape, np.result_type(A, b))
+    if lower:
+        x[:, 0] = np.linalg.solve(A[:, 0], b[:, 0])
+        for i in range(1, T):
+            x[:, i] = np.linalg.solve(
+                A[:, i], b[:, i] - np.matmul(B[:, i - 1], x[:, i - 1]))
+    else:
+        x[:, -1] = np.linalg.solve(A[:, -1], b[:, -1])
+        for i in range(T - 2, -1, -1):
+            x[:, i] = np.linalg.solve(
+                A[:, i], b[:, i] - np.matmul(B[:, i], x[:, i + 1]))
+
+    return x
+
+
+def blk_chol_mtimes(A, B, x, lower=True, transpose=False):
+    """
+    Evaluate Cx = b, where C is assumed to be a
+    block-bi-diagonal matrix ( where only the first (lower or upper)
+    off-diagonal block is nonzero.
+    Inputs:
+    A - [Batch_size x T x n x n] array, where each A[:,i,:,:] is the ith block
+        diagonal matrix
+    B - [Batch_size x T-1 x n x n] array, where each B[:,i,:,:] is the ith
+        (upper or lower) 1st block off-diagonal matrix
+    x - [Batch_size x T x n x k] array
+
+    lower (default: True) - boolean specifying whether to treat B as the lower
+          or upper 1st block off-diagonal of matrix C
+    transpose (default: False) - boolean specifying whether to transpose the
+          off-diagonal blocks B[:,i,:,:] (useful if you want to compute solve
+          the problem C^T x = b with a representation of C.)
+    Outputs:
+    b - result of Cx = b
+    """
+    if transpose:
+        A = np.swapaxes(A, -1, -2)
+        B = np.swapaxes(B, -1, -2)
+    b = np.matmul(A, x)
+    if lower:
+        b[:, 1:] += np.matmul(B, x[:, :-1])
+    else:
+        b[:, :-1] += np.matmul(B, x[:, 1:])
+
+    return b
+
+
+def compute_sym_blk_tridiag(AA, BB, iia=None, iib=None):
+    """
+    Compute block tridiagonal terms of the inverse of a *symmetric* block
+    tridiagonal matrix.
+
+    Input:
+    AA - (Batch_size x T x n x n) diagonal blocks
+    BB - (Batch_size x T-1 x n x n) off-diagonal blocks (upper triangle)
+    iia - (T x 1) block index of AA for the diagonal
+    iib - (T-1 x 1) block index of BB for the off-diagonal
+
+    Output:
+    D  - (Batch_size x T x n x n) diagonal blocks of the inverse
+    OD - (Batch_size x T-1 x n x n) off-diagonal blocks of the inverse
+         (lower triangle)
+    S  - (Batch_size x T-1 x n x n) intermediary matrix computation used in
+         inversion algorithm (stored last block first)
+
+    From:
+    Jain et al, 2006
+    "Numerically Stable Algorithms for Inversion of Block Tridiagonal and
+    Banded Matrices"
+    """
+    if iia is not None:
+        AA = np.take(AA, np.ravel(iia), axis=1)
+    if iib is not None:
+        BB = np.take(BB, np.ravel(iib), axis=1)
+    BB = -BB
+    T = AA.shape[1]
+
+    # backward sweep for S and the Schur complements K
+    K = np.array(AA)
+    S = np.zeros_like(BB)
+    for i in range(T - 2, -1, -1):
+        S[:, i] = np.swapaxes(np.linalg.solve(
+            K[:, i + 1], np.swapaxes(BB[:, i], -1, -2)), -1, -2)
+        K[:, i] = AA[:, i] - np.matmul(S[:, i], np.swapaxes(BB[:, i], -1, -2))
+
+    # forward sweep for D
+    III = np.broadcast_to(np.eye(AA.shape[-1], dtype=AA.dtype),
+                          K[:, 0].shape)
+    D = np.zeros_like(AA)
+    D[:, 0] = np.linalg.solve(K[:, 0], III)
+    for i in range(1, T):
+        D[:, i] = np.linalg.solve(K[:, i], III + np.matmul(
+            np.swapaxes(BB[:, i - 1], -1, -2),
+            np.matmul(D[:, i - 1], S[:, i - 1])))
+
+    OD = np.matmul(np.swapaxes(S, -1, -2), D[:, :-1])
+
+    return [D, OD, S[:, ::-1]]
+
+
+def compute_sym_blk_tridiag_inv_b(S, D, b):
+    """
+    Solve Cx = b for x, where C is assumed to be *symmetric* block matrix.
+
+    Input:
+    D  - (Batch_size x T x n x n) diagonal blocks of the inverse
+    S  - (Batch_size x T-1 x n x n) intermediary matrix computation returned by
+         the function compute_sym_blk_tridiag
+    b  - (Batch_size x T x n x 1) right-hand side
+
+    Output:
+    x - (Batch_size x T x n) solution of Cx = b
+
+    From:
+    Jain et al, 2006
+    "Numerically Stable Algorithms for Inversion of Block Tridiagonal and
+    Banded Matrices"
+    """
+    S = S[:, ::-1]
+    T = b.shape[1]
+
+    p = np.array(b)
+    for i in range(T - 2, -1, -1):
+        p[:, i] = b[:, i] + np.matmul(S[:, i], p[:, i + 1])
+
+    Db = np.matmul(D, b)
+    q = np.zeros_like(b[:, :-1])
+    q[:, 0] = np.matmul(np.swapaxes(S[:, 0], -1, -2), Db[:, 0])
+    for i in range(1, T - 1):
+        q[:, i] = np.matmul(np.swapaxes(S[:, i], -1, -2),
+                            q[:, i - 1] + Db[:, i])
+
+    y = np.matmul(D, p)
+    y[:, 1:] += q
+
+    return y
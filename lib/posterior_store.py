@@ -0,0 +1,175 @@
+"""
+On-disk store of the recognition posterior of a dataset. For every trial the
+posterior mean (postX) and the blocks of the Cholesky factor of the posterior
+precision (the_chol) are appended to flat binary files, which are read back
+as memory-mapped arrays. Posterior samples and marginal covariances of any
+trial are regenerated from the stored factors with the NumPy implementation
+of the block tridiagonal routines, without building a TensorFlow graph.
+
+Layout of a store directory:
+    postX.dat - [sum(T) x xDim] posterior means
+    chol_diag.dat - [sum(T) x xDim x xDim] block diagonal of the factor
+    chol_offdiag.dat - [sum(T-1) x xDim x xDim] (lower) 1st block
+                       off-diagonal of the factor
+    trajectory.dat - [sum(T) x yDim] observations (optional)
+    index.npz - trial lengths, offsets and dimensions
+"""
+
+import os
+import numpy as np
+import tf_gbds.lib.np_blk_tridiag as npblk
+
+
+class PosteriorWriter(object):
+    """Append the posterior of one trial at a time to a store directory.
+    """
+
+    def __init__(self, path, xDim, yDim=None, dtype=np.float32):
+        self.path = path
+        self.xDim = xDim
+        self.yDim = yDim
+        self.dtype = np.dtype(dtype)
+        self.lengths = []
+
+        if not os.path.exists(path):
+            os.makedirs(path)
+        names = ["postX", "chol_diag", "chol_offdiag"]
+        if yDim is not None:
+            names.append("trajectory")
+        self.files = {name: open(os.path.join(path, name + ".dat"), "wb")
+                      for name in names}
+
+    def write(self, postX, chol_diag, chol_offdiag, trajectory=None):
+        """Append a trial.
+
+        Args:
+            postX: [T x xDim] posterior mean.
+            chol_diag: [T x xDim x xDim] block diagonal of the Cholesky
+                       factor of the posterior precision.
+            chol_offdiag: [T-1 x xDim x xDim] (lower) 1st block off-diagonal
+                          of the Cholesky factor.
+            trajectory: [T x yDim] observations (if the store has yDim).
+        """
+        T = postX.shape[0]
+        if (postX.shape != (T, self.xDim) or
+                chol_diag.shape != (T, self.xDim, self.xDim) or
+                chol_offdiag.shape != (T - 1, self.xDim, self.xDim)):
+            raise ValueError("Inconsistent shapes of the posterior.")
+
+        arrays = dict(postX=postX, chol_diag=chol_diag,
+                      chol_offdiag=chol_offdiag)
+        if self.yDim is not None:
+            if trajectory is None or trajectory.shape != (T, self.yDim):
+                raise ValueError("Inconsistent shape of the trajectory.")
+            arrays["trajectory"] = trajectory
+        for (name, x) in arrays.items():
+            self.files[name].write(
+                np.ascontiguousarray(x, self.dtype).tobytes())
+        self.lengths.append(T)
+
+    def close(self):
+        """Close the data files and write the index.
+        """
+        for f in self.files.values():
+            f.close()
+
+        lengths = np.array(self.lengths, np.int64)
+        np.savez(os.path.join(self.path, "index.npz"),
+                 lengths=lengths,
+                 offsets=np.concatenate([[0], np.cumsum(lengths)[:-1]]),
+                 xDim=self.xDim,
+                 yDim=-1 if self.yDim is None else self.yDim,
+                 dtype=self.dtype.str)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class PosteriorStore(object):
+    """Read the posterior of the trials in a store directory.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with np.load(os.path.join(path, "index.npz")) as index:
+            self.lengths = index["lengths"]
+            self.offsets = index["offsets"]
+            self.xDim = int(index["xDim"])
+            self.yDim = int(index["yDim"])
+            dtype = np.dtype(str(index["dtype"]))
+        if self.yDim < 0:
+            self.yDim = None
+
+        n_steps = int(self.lengths.sum())
+        n = self.xDim
+
+        def _memmap(name, shape):
+            if shape[0] == 0:
+                return np.zeros(shape, dtype)
+            return np.memmap(os.path.join(path, name + ".dat"), dtype,
+                             mode="r", shape=shape)
+
+        self._postX = _memmap("postX", (n_steps, n))
+        self._chol_diag = _memmap("chol_diag", (n_steps, n, n))
+        self._chol_offdiag = _memmap(
+            "chol_offdiag", (n_steps - len(self.lengths), n, n))
+        if self.yDim is not None:
+            self._trajectory = _memmap("trajectory", (n_steps, self.yDim))
+
+    def __len__(self):
+        return len(self.lengths)
+
+    def _steps(self, i):
+        return slice(self.offsets[i], self.offsets[i] + self.lengths[i])
+
+    def _offdiag_steps(self, i):
+        start = self.offsets[i] - i
+        return slice(start, start + self.lengths[i] - 1)
+
+    def mean(self, i):
+        """[T x xDim] posterior mean of trial i.
+        """
+        return np.asarray(self._postX[self._steps(i)])
+
+    def chol(self, i):
+        """Block diagonal [T x xDim x xDim] and (lower) 1st block
+        off-diagonal [T-1 x xDim x xDim] of the Cholesky factor of the
+        posterior precision of trial i.
+        """
+        return [np.asarray(self._chol_diag[self._steps(i)]),
+                np.asarray(self._chol_offdiag[self._offdiag_steps(i)])]
+
+    def trajectory(self, i):
+        """[T x yDim] observations of trial i.
+        """
+        if self.yDim is None:
+            raise ValueError("The store does not contain the trajectories.")
+        return np.asarray(self._trajectory[self._steps(i)])
+
+    def sample(self, i, n=1, seed=None):
+        """Draw n samples [n x T x xDim] from the posterior of trial i.
+        """
+        L, C = self.chol(i)
+        T = L.shape[0]
+        eps = np.random.RandomState(seed).randn(1, T, self.xDim, n)
+        # the samples are the columns of the right-hand side
+        x = npblk.blk_chol_inv(L[np.newaxis].astype(np.float64),
+                               C[np.newaxis].astype(np.float64), eps,
+                               lower=False, transpose=True, triangular=True)
+
+        return (np.transpose(x[0], [2, 0, 1]) +
+                self.mean(i)).astype(L.dtype)
+
+    def marginals(self, i):
+        """Marginal covariances of trial i: each time step
+        [T x xDim x xDim] and neighboring time steps (lower 1st block
+        off-diagonal) [T-1 x xDim x xDim].
+        """
+        L, C = self.chol(i)
+        D, OD = npblk.blk_chol_sel_inv(L[np.newaxis].astype(np.float64),
+                                       C[np.newaxis].astype(np.float64))
+
+        return [D[0].astype(L.dtype), OD[0].astype(L.dtype)]
@@ -22,7 +22,12 @@ def compute_sym_blk_tridiag(AA, BB, iia=None, iib=None):
     OD - (Batch_size x T-1 x n x n) off-diagonal blocks of the inverse
          (lower triangle)
     S  - (Batch_size x T-1 x n x n) intermediary matrix computation used in
-         inversion algorithm
+         inversion algorithm (stored last block first)
+
+    The recursions need one n x n solve per time step: the Schur complements
+    are carried through the backward sweep and reused by the forward sweep,
+    so no block is inverted more than once and no branch is selected inside
+    the loops.
 
     From:
     Jain et al, 2006
@@ -35,83 +40,63 @@ def compute_sym_blk_tridiag(AA, BB, iia=None, iib=None):
     """
     BB = -BB
 
-    # Set up some parameters
-    if iia is None:
-        nT = tf.shape(AA)[1]
-    else:
-        nT = tf.shape(iia)[0]
+    # gather the blocks if we have special indexing requirements
+    if iia is not None:
+        AA = tf.gather(AA, iia, axis=1)
+    if iib is not None:
+        BB = tf.gather(BB, iib, axis=1)
 
     batch_size = tf.shape(AA)[0]
     d = tf.shape(AA)[2]
 
-    # if we don't have special indexing requirements, just use the obvious
-    # indices
-    if iia is None:
-        iia = tf.range(nT)
-    if iib is None:
-        iib = tf.range(nT - 1)
-
-    III = tf.eye(d, dtype=tf.float32)
-
-    initS = tf.zeros([batch_size, d, d], dtype=tf.float32)
+    III = tf.eye(d, batch_shape=[batch_size], dtype=AA.dtype)
 
     def compute_S(acc, inputs):
-        Sp1 = acc
-        idx = inputs[0]
-        B_ip1 = BB[:, iib[tf.minimum(idx + 1, nT - 2)]]
-        S_nTm1 = tf.matmul(BB[:, iib[-1]], tf.matrix_inverse(AA[:, iia[-1]]))
-        S_i = tf.matmul(
-          BB[:, iib[idx]],
-          tf.matrix_inverse(AA[:, iia[tf.minimum(idx + 1, nT - 2)]] -
-                            tf.matmul(Sp1, tf.transpose(B_ip1,
-                                                        perm=[0, 2, 1]))))
-        Sm = tf.where(tf.equal(tf.tile([idx], [batch_size]), nT - 2),
-                      S_nTm1, S_i)
-
-        return Sm
-
-    S = tf.scan(compute_S, [tf.range(nT - 2, -1, -1)], initializer=initS)
+        """
+        Backward recursion for S[i] = B[i] K[i+1]^{-1}, where K is the Schur
+        complement K[i] = A[i] - S[i] B[i]^T with K[-1] = A[-1]. K is
+        symmetric, so S is obtained by a single solve per time step.
+        """
+        Kp1, _ = acc
+        A_i, B_i = inputs
+        S_i = tf.transpose(tf.matrix_solve(
+            Kp1, tf.transpose(B_i, perm=[0, 2, 1])), perm=[0, 2, 1])
+        K_i = A_i - tf.matmul(S_i, B_i, transpose_b=True)
+
+        return [K_i, S_i]
+
+    K, S = tf.scan(compute_S,
+                   [tf.transpose(AA[:, :-1], perm=[1, 0, 2, 3])[::-1],
+                    tf.transpose(BB, perm=[1, 0, 2, 3])[::-1]],
+                   initializer=[AA[:, -1], tf.zeros_like(AA[:, -1])])
+    # S is returned in the order it is computed, i.e. S[:, 0] is the last
+    # block (as expected by compute_sym_blk_tridiag_inv_b)
     S = tf.transpose(S, perm=[1, 0, 2, 3])
-
-    initD = tf.zeros([batch_size, d, d], dtype=tf.float32)
+    K = tf.concat([tf.transpose(K, perm=[1, 0, 2, 3])[:, ::-1],
+                   AA[:, -1:]], 1)
+    S_fwd = S[:, ::-1]
 
     def compute_D(acc, inputs):
+        """
+        Forward recursion for D[i] = K[i]^{-1} (I + B[i-1]^T D[i-1] S[i-1]).
+        """
         Dm1 = acc
-        idx = inputs[0]
-        D_nT = tf.matmul(tf.matrix_inverse(AA[:, iia[-1]]),
-                         (III + tf.matmul(
-                          tf.transpose(BB[:, iib[idx-1]], perm=[0, 2, 1]),
-                          tf.matmul(Dm1, S[:, 0]))))
-        D1 = (tf.matrix_inverse(AA[:, iia[0]] -
-              tf.matmul(BB[:, iib[0]],
-                        tf.transpose(S[:, -1], perm=[0, 2, 1]))))
-        B_ip11 = BB[:, iib[tf.minimum(idx, nT - 2)]]
-        S_t = tf.transpose(S[:, tf.maximum(-idx - 1, -nT + 1)],
-                           perm=[0, 2, 1])
-        B_t = tf.transpose(BB[:, iib[tf.minimum(idx - 1, nT - 2)]],
-                           perm=[0, 2, 1])
-        D = tf.where(
-          tf.equal(tf.tile([idx], [batch_size]), nT - 1), D_nT,
-          tf.where(tf.equal(tf.tile([idx], [batch_size]), 0), D1,
-                   tf.matmul(tf.matrix_inverse(AA[:, iia[idx]] -
-                             tf.matmul(B_ip11, S_t)),
-                   III + tf.matmul(B_t, tf.matmul(Dm1, S[:, -idx])))))
-
-        return D
-
-    D = tf.scan(compute_D, [tf.range(0, nT)], initializer=initD)
-    D = tf.transpose(D, perm=[1, 0, 2, 3])
-
-    def compute_OD(acc, inputs):
-        idx = inputs[0]
-        OD = tf.matmul(tf.transpose(S[:, -idx - 1], perm=[0, 2, 1]),
-                       D[:, idx])
-
-        return OD
-
-    OD = tf.scan(compute_OD, [tf.range(0, nT-1)],
-                 initializer=tf.matmul(tf.transpose(S[:, -1], perm=[0, 2, 1]),
-                                       D[:, 0]))
+        K_i, B_im1, S_im1 = inputs
+
+        return tf.matrix_solve(K_i, III + tf.matmul(
+            B_im1, tf.matmul(Dm1, S_im1), transpose_a=True))
+
+    D0 = tf.matrix_solve(K[:, 0], III)
+    D = tf.scan(compute_D,
+                [tf.transpose(K[:, 1:], perm=[1, 0, 2, 3]),
+                 tf.transpose(BB, perm=[1, 0, 2, 3]),
+                 tf.transpose(S_fwd, perm=[1, 0, 2, 3])],
+                initializer=D0)
+    D = tf.concat([tf.expand_dims(D0, 1),
+                   tf.transpose(D, perm=[1, 0, 2, 3])], 1)
+
+    # the off-diagonal blocks do not depend on each other
+    OD = tf.matmul(S_fwd, D[:, :-1], transpose_a=True)
 
     return [D, OD, S]
 
@@ -125,6 +110,7 @@ def compute_sym_blk_tridiag_inv_b(S, D, b):
     D  - (Batch_size x T x n x n) diagonal blocks of the inverse
     S  - (Batch_size x T-1 x n x n) intermediary matrix computation returned by
          the function compute_sym_blk_tridiag
+    b  - (Batch_size x T x n x 1) right-hand side
 
     Output:
     x - (Batch_size x T x n) solution of Cx = b
@@ -136,49 +122,32 @@ def compute_sym_blk_tridiag_inv_b(S, D, b):
 
     (c) Evan Archer, 2015
     """
-    batch_size = tf.shape(b)[0]
-    nT = tf.shape(b)[1]
-    initp = tf.zeros(tf.shape(b)[2:4], dtype=tf.float32)
-
     def compute_p(acc, inputs):
         pp = acc
-        idx = inputs[0]
-        pm = tf.where(
-          tf.equal(tf.tile([idx], batch_size), nT - 1), b[:, -1],
-          b[:, idx] + tf.matmul(S[:, tf.maximum(-idx-1, -nT+1)], pp))
+        S_i, b_i = inputs
 
-        return pm
+        return b_i + tf.matmul(S_i, pp)
 
-    p = tf.scan(compute_p, [tf.range(nT - 1, -1, -1)], initializer=initp)
-    p = tf.transpose(p, perm=[1, 0, 2, 3])
+    # S is stored last block first, which is the order of the backward sweep
+    p = tf.scan(compute_p, [tf.transpose(S, perm=[1, 0, 2, 3]),
+                            tf.transpose(b[:, :-1], perm=[1, 0, 2, 3])[::-1]],
+                initializer=b[:, -1])
+    p = tf.concat([tf.transpose(p, perm=[1, 0, 2, 3])[:, ::-1],
+                   b[:, -1:]], 1)
 
     def compute_q(acc, inputs):
         qm = acc
-        idx = inputs[0]
-        qp = tf.where(
-          tf.equal(tf.tile([idx], batch_size), 0),
-          tf.matmul(tf.matmul(
-            tf.transpose(S[:, -1], perm=[0, 2, 1]), D[0]), b[0]),
-          tf.matmul(tf.transpose(S[:, -idx - 1], perm=[0, 2, 1]),
-                    qm + tf.matmul(D[:, idx], b[:, idx])))
+        S_i, Db_i = inputs
 
-        return qp
+        return tf.matmul(S_i, qm + Db_i, transpose_a=True)
 
-    q = tf.scan(compute_q, [tf.range(nT - 1)], initializer=p[0])
+    q = tf.scan(compute_q,
+                [tf.transpose(S, perm=[1, 0, 2, 3])[::-1],
+                 tf.transpose(tf.matmul(D[:, :-1], b[:, :-1]),
+                              perm=[1, 0, 2, 3])],
+                initializer=tf.zeros_like(b[:, 0]))
     q = tf.transpose(q, perm=[1, 0, 2, 3])
 
-    def compute_y(acc, inputs):
-        idx = inputs[0]
-        yi = tf.where(tf.equal(tf.tile([idx], batch_size), 0),
-                      tf.matmul(D[:, 0], p[:, -1]),
-                      tf.where(tf.equal(tf.tile([idx], batch_size), nT - 1),
-                      tf.matmul(D[:, -1], p[:, 0]) + q[:, -1],
-                      tf.matmul(D[:, idx], p[:, -idx - 1]) + q[:, idx - 1]))
-
-        return yi
-
-    y = tf.scan(compute_y, [tf.range(nT)],
-                initializer=tf.matmul(D[:, 0], p[:, -1]))
-    y = tf.transpose(y, perm=[1, 0, 2, 3])
+    y = tf.matmul(D, p) + tf.pad(q, [[0, 0], [1, 0], [0, 0], [0, 0]])
 
     return y
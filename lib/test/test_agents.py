@@ -0,0 +1,79 @@
+import numpy as np
+import numpy.testing as npt
+import tensorflow as tf
+
+from tf_gbds.agents import game_model
+from tf_gbds.utils import get_model_params, get_vel
+
+# shared testing data
+rng = np.random.RandomState(1234)
+obs_dim, n_traj, horizon = 3, 2, 6
+max_vel = np.array([.05, .04, .06], np.float32)
+npinit_y = rng.uniform(-.5, .5, [n_traj, obs_dim]).astype(np.float32)
+npinit_g = rng.uniform(-.5, .5, [n_traj, obs_dim]).astype(np.float32)
+
+
+def _game_model():
+    # a single mixture component and no goal noise, so that the goal
+    # updates are deterministic
+    agents = [dict(name="goalie", col=[0], dim=1),
+              dict(name="ball", col=[1, 2], dim=2)]
+    params = get_model_params(
+        "game", agents, obs_dim, 2 * obs_dim, 0, 2, 16, 1, None, -100.,
+        False, None, [-1., 1.], None, False, 1, 2, 16, None, -5., False,
+        None, False, None, None, None, tf.constant(0))
+    traj = tf.placeholder(tf.float32, [None, None, obs_dim])
+    inputs = dict(trajectory=traj, states=get_vel(traj, max_vel),
+                  extra_conds=None,
+                  ctrl_obs=tf.placeholder(tf.float32, [None, None, obs_dim]))
+
+    return game_model(params, inputs, max_vel, get_vel)
+
+
+def test_rollout():
+    with tf.Graph().as_default():
+        model = _game_model()
+        rollout = model.rollout(tf.constant(npinit_y), tf.constant(npinit_g),
+                                tf.constant(horizon))
+        graph = tf.get_default_graph()
+        step = "game/update_one_step/"
+        feeds = [graph.get_tensor_by_name(step + x + ":0") for x in [
+            "previous_position", "current_position", "goal/previous",
+            "control/error/previous", "control/error/previous2",
+            "control/previous"]]
+        fetches = [graph.get_tensor_by_name(step + x + ":0") for x in [
+            "goal/current", "control/current", "next_position"]]
+
+        with tf.Session() as sess:
+            sess.run(tf.global_variables_initializer())
+            goals, ctrls, positions = sess.run(rollout)
+
+            for i in range(n_traj):
+                prev_y = curr_y = npinit_y[i]
+                prev_g = npinit_g[i]
+                prev_error = prev2_error = prev_u = np.zeros(obs_dim)
+                for t in range(horizon):
+                    curr_g, curr_u, next_y = sess.run(fetches, dict(zip(
+                        feeds, [prev_y, curr_y, prev_g, prev_error,
+                                prev2_error, prev_u])))
+                    if t == 0:
+                        # the first goal is the initial goal
+                        curr_g = npinit_g[i]
+                        curr_u, next_y = sess.run(fetches[1:], dict(zip(
+                            feeds + fetches[:1],
+                            [prev_y, curr_y, prev_g, prev_error, prev2_error,
+                             prev_u, curr_g])))
+                    npt.assert_allclose(goals[i, t], curr_g, rtol=1e-5,
+                                        atol=1e-6)
+                    npt.assert_allclose(ctrls[i, t], curr_u, rtol=1e-5,
+                                        atol=1e-6)
+                    npt.assert_allclose(positions[i, t + 1], next_y,
+                                        rtol=1e-5, atol=1e-6)
+
+                    prev2_error = prev_error
+                    prev_error = curr_g - curr_y
+                    prev_y, curr_y = curr_y, next_y
+                    prev_g, prev_u = curr_g, curr_u
+
+    npt.assert_array_equal(positions[:, 0], npinit_y)
+    assert np.all(np.abs(positions) <= 1.)
@@ -44,6 +44,31 @@ def test_blk_tridiag_chol():
         npt.assert_allclose(x, y, atol=1e-4, rtol=1e-5)
 
 
+def test_blk_tridiag_chol_parallel():
+    alist = [cholmat[i:(i+2), i:(i+2)] for i in range(0, cholmat.shape[0], 2)]
+    blist = [cholmat[(i+2):(i+4), i:(i+2)].T
+             for i in range(0, cholmat.shape[0] - 2, 2)]
+
+    theDiag = tf.constant(np.array([alist, alist]))
+    theOffDiag = tf.constant(np.array([blist, blist]))
+    R = blk.blk_tridiag_chol_parallel(theDiag, theOffDiag)
+    R_seq = blk.blk_tridiag_chol(theDiag, theOffDiag)
+
+    with tf.Session() as sess:
+        R0, R1 = sess.run(R)
+        R0_seq, R1_seq = sess.run(R_seq)
+
+    for i in range(2):
+        for (x, y) in zip(R0[i], [npF, npC, npE, npG]):
+            npt.assert_allclose(x, y, atol=1e-4, rtol=1e-5)
+
+        for (x, y) in zip(R1[i], [npB.T, npD.T, npB.T]):
+            npt.assert_allclose(x, y, atol=1e-4, rtol=1e-5)
+
+    npt.assert_allclose(R0, R0_seq, atol=1e-5, rtol=1e-5)
+    npt.assert_allclose(R1, R1_seq, atol=1e-5, rtol=1e-5)
+
+
 def test_blk_chol_inv():
     xl = np.linalg.solve(lowermat, np.array([1, 2, 3, 4, 5, 6, 7, 8]))
     x = np.linalg.solve(cholmat, np.array([1, 2, 3, 4, 5, 6, 7, 8]))
@@ -89,3 +114,379 @@ def test_blk_chol_mtimes():
                         atol=1e-5, rtol=1e-4)
     npt.assert_allclose(tfb_val.flatten(), np.array(b).flatten(),
                         atol=1e-5, rtol=1e-4)
+
+
+def test_blk_chol_inv_triangular():
+    xl = np.linalg.solve(lowermat, np.array([1, 2, 3, 4, 5, 6, 7, 8]))
+    x = np.linalg.solve(cholmat, np.array([1, 2, 3, 4, 5, 6, 7, 8]))
+
+    alist = [npF, npC, npE, npG]
+    blist = [npB.T, npD.T, npB.T]
+    theDiag = tf.constant(np.array([alist, alist]))
+    theOffDiag = tf.constant(np.array([blist, blist]))
+    b = tf.expand_dims(tf.constant(np.array([npb, npb])), -1)
+
+    ib = blk.blk_chol_inv(theDiag, theOffDiag, b, triangular=True)
+    tfx = blk.blk_chol_inv(theDiag, theOffDiag, ib, lower=False,
+                           transpose=True, triangular=True)
+    ib_lu = blk.blk_chol_inv(theDiag, theOffDiag, b)
+    tfx_lu = blk.blk_chol_inv(theDiag, theOffDiag, ib_lu, lower=False,
+                              transpose=True)
+
+    with tf.Session() as sess:
+        ib_val, tfx_val = sess.run([ib, tfx])
+        ib_lu_val, tfx_lu_val = sess.run([ib_lu, tfx_lu])
+
+    for i in range(2):
+        npt.assert_allclose(ib_val[i].flatten(), xl, atol=1e-5, rtol=1e-4)
+        npt.assert_allclose(tfx_val[i].flatten(), x, atol=1e-5, rtol=3e-3)
+    npt.assert_allclose(ib_val, ib_lu_val, atol=1e-5, rtol=1e-5)
+    npt.assert_allclose(tfx_val, tfx_lu_val, atol=1e-5, rtol=1e-5)
+
+
+def test_blk_chol_mtimes_batch():
+    xx = np.array([1, 2, 3, 4, 5, 6, 7, 8])
+    bl = lowermat.T.dot(xx)
+    b = cholmat.dot(xx)
+
+    alist = [npF, npC, npE, npG]
+    blist = [npB.T, npD.T, npB.T]
+    theDiag = tf.constant(np.array([alist, alist, alist]))
+    theOffDiag = tf.constant(np.array([blist, blist, blist]))
+    x = tf.expand_dims(tf.constant(np.array([npb, npb, npb])), -1)
+
+    ix = blk.blk_chol_mtimes(theDiag, theOffDiag, x, lower=False,
+                             transpose=True)
+    tfb = blk.blk_chol_mtimes(theDiag, theOffDiag, ix)
+
+    with tf.Session() as sess:
+        ix_val, tfb_val = sess.run([ix, tfb])
+
+    for i in range(3):
+        npt.assert_allclose(ix_val[i].flatten(), np.array(bl).flatten(),
+                            atol=1e-5, rtol=1e-4)
+        npt.assert_allclose(tfb_val[i].flatten(), np.array(b).flatten(),
+                            atol=1e-5, rtol=1e-4)
+
+
+def test_blk_chol_sel_inv():
+    cholmat_inv = np.linalg.inv(cholmat)
+
+    alist = [npF, npC, npE, npG]
+    blist = [npB.T, npD.T, npB.T]
+    theDiag = tf.constant(np.array([alist, alist]))
+    theOffDiag = tf.constant(np.array([blist, blist]))
+
+    R = blk.blk_chol_sel_inv(theDiag, theOffDiag)
+
+    with tf.Session() as sess:
+        R0, R1 = sess.run(R)
+
+    for i in range(2):
+        for (x, j) in zip(R0[i], range(0, 8, 2)):
+            npt.assert_allclose(x, cholmat_inv[j:(j+2), j:(j+2)],
+                                rtol=1e-3)
+
+        for (x, j) in zip(R1[i], range(0, 6, 2)):
+            npt.assert_allclose(x, cholmat_inv[(j+2):(j+4), j:(j+2)],
+                                rtol=1e-3)
+
+
+def test_blk_tridiag_chol_lengths():
+    lengths = [4, 2, 3]
+    rng = np.random.RandomState(0)
+
+    alist = [cholmat[i:(i+2), i:(i+2)] for i in range(0, cholmat.shape[0], 2)]
+    blist = [cholmat[(i+2):(i+4), i:(i+2)].T
+             for i in range(0, cholmat.shape[0] - 2, 2)]
+    # the padded time steps hold arbitrary values
+    AA = np.array([alist] * 3) + np.array(
+        [[np.eye(2) * 10 * (t >= l) for t in range(4)] for l in lengths])
+    BB = np.array([blist] * 3) + rng.rand(3, 3, 2, 2) * np.array(
+        [[t + 1 >= l for t in range(3)] for l in lengths])[:, :, None, None]
+    bb = rng.randn(3, 4, 2, 1)
+
+    theDiag = tf.constant(AA.astype(prec))
+    theOffDiag = tf.constant(BB.astype(prec))
+    theb = tf.constant(bb.astype(prec))
+    theLengths = tf.constant(lengths)
+    R = blk.blk_tridiag_chol(theDiag, theOffDiag, theLengths)
+    RP = blk.blk_tridiag_chol_parallel(theDiag, theOffDiag, theLengths)
+    ib = blk.blk_chol_inv(R[0], R[1], theb, triangular=True,
+                          lengths=theLengths)
+    x = blk.blk_chol_inv(R[0], R[1], ib, lower=False, transpose=True,
+                         triangular=True, lengths=theLengths)
+    logdet = blk.blk_chol_logdet(R[0], theLengths)
+
+    with tf.Session() as sess:
+        R0, R1, RP0, RP1, x_val, logdet_val = sess.run(
+            R + RP + [x, logdet])
+
+    npt.assert_allclose(RP0, R0, rtol=1e-4, atol=1e-6)
+    npt.assert_allclose(RP1, R1, rtol=1e-4, atol=1e-6)
+    for (i, l) in enumerate(lengths):
+        mat = cholmat[:(2 * l), :(2 * l)]
+        L = np.linalg.cholesky(mat)
+        for t in range(l):
+            npt.assert_allclose(R0[i, t], L[(2*t):(2*t+2), (2*t):(2*t+2)],
+                                rtol=1e-4, atol=1e-6)
+        for t in range(l - 1):
+            npt.assert_allclose(R1[i, t],
+                                L[(2*t+2):(2*t+4), (2*t):(2*t+2)],
+                                rtol=1e-4, atol=1e-6)
+        for t in range(l, 4):
+            npt.assert_allclose(R0[i, t], np.eye(2))
+        for t in range(l - 1, 3):
+            npt.assert_allclose(R1[i, t], npZ)
+
+        npt.assert_allclose(
+            x_val[i, :l].ravel(),
+            np.linalg.solve(mat, bb[i, :l].ravel()), rtol=1e-3, atol=1e-5)
+        npt.assert_allclose(x_val[i, l:], 0.)
+        npt.assert_allclose(logdet_val[i], np.linalg.slogdet(mat)[1],
+                            rtol=1e-4, atol=1e-5)
+
+
+def test_blk_tridiag_chol_grad():
+    alist = [cholmat[i:(i+2), i:(i+2)] for i in range(0, cholmat.shape[0], 2)]
+    blist = [cholmat[(i+2):(i+4), i:(i+2)].T
+             for i in range(0, cholmat.shape[0] - 2, 2)]
+    rng = np.random.RandomState(0)
+
+    theDiag = tf.constant(np.array([alist, alist]).astype(np.float64))
+    theOffDiag = tf.constant(np.array([blist, blist]).astype(np.float64))
+    theb = tf.constant(rng.randn(2, 4, 2, 1))
+    wL = tf.constant(rng.randn(2, 4, 2, 2))
+    wC = tf.constant(rng.randn(2, 3, 2, 2))
+    wx = tf.constant(rng.randn(2, 4, 2, 1))
+
+    # adjoint gradients against backprop through the scans
+    grads = []
+    for (chol, inv) in [(blk.blk_tridiag_chol, blk.blk_chol_inv),
+                        (blk._blk_tridiag_chol, blk._blk_chol_inv)]:
+        R = chol(theDiag, theOffDiag)
+        grads.append(tf.gradients(
+            tf.reduce_sum(wL * R[0]) + tf.reduce_sum(wC * R[1]),
+            [theDiag, theOffDiag]))
+        for (lower, transpose) in [(True, False), (False, True)]:
+            x = inv(R[0], R[1], theb, lower=lower, transpose=transpose,
+                    triangular=True)
+            grads.append(tf.gradients(tf.reduce_sum(wx * x),
+                                      [R[0], R[1], theb]))
+
+    with tf.Session() as sess:
+        grads = sess.run(grads)
+
+    for (x, y) in zip(grads[:3], grads[3:]):
+        for (gx, gy) in zip(x, y):
+            npt.assert_allclose(gx, gy, rtol=1e-10, atol=1e-12)
+
+
+def test_blk_chol_logdet():
+    alist = [npF, npC, npE, npG]
+    theDiag = tf.constant(np.array([alist, alist[::-1]]))
+
+    # sum of log(diag(L)) over time by a scan, as previously computed in
+    # the recognition model
+    def comp_log_det(acc, inputs):
+        L = inputs[0]
+        return tf.reduce_sum(tf.log(tf.matrix_diag_part(L)), -1)
+
+    scan_logdet = 2 * tf.reduce_sum(tf.transpose(tf.scan(
+        comp_log_det, [tf.transpose(theDiag, [1, 0, 2, 3])],
+        initializer=tf.zeros([2]))), -1)
+    logdet = blk.blk_chol_logdet(theDiag)
+
+    with tf.Session() as sess:
+        scan_logdet, logdet = sess.run([scan_logdet, logdet])
+
+    npt.assert_allclose(logdet, scan_logdet, rtol=1e-5)
+    npt.assert_allclose(logdet, np.linalg.slogdet(cholmat)[1], rtol=1e-4)
+
+
+def test_blk_tridiag_filter_step():
+    mat64 = np.asarray(cholmat, np.float64)
+    alist = [mat64[i:(i+2), i:(i+2)] for i in range(0, mat64.shape[0], 2)]
+    blist = [mat64[(i+2):(i+4), i:(i+2)].T
+             for i in range(0, mat64.shape[0] - 2, 2)]
+    bb = npb.reshape(4, 2, 1).astype(np.float64)
+    # the diagonal block of a time step gains a term once it is followed by
+    # another one (as the dynamics term of the recognition model)
+    delta = .5 * np.eye(2)
+    nT = len(alist)
+
+    # full smoother of the trial
+    theDiag = tf.constant(np.array([[a + delta for a in alist[:-1]] +
+                                    [alist[-1]]]))
+    theOffDiag = tf.constant(np.array([blist]))
+    theb = tf.constant(np.array([bb]))
+    L, C = blk.blk_tridiag_chol(theDiag, theOffDiag)
+    x = blk.blk_chol_inv(L, C, blk.blk_chol_inv(L, C, theb, triangular=True),
+                         lower=False, transpose=True, triangular=True)
+    S = blk.blk_chol_sel_inv(L, C)[0]
+
+    # filter, one time step at a time
+    state = [tf.eye(2, batch_shape=[1], dtype=tf.float64),
+             tf.zeros([1, 2, 1], tf.float64)]
+    filtered = []
+    for t in range(nT):
+        B = (tf.constant(np.array([blist[t - 1]])) if t > 0 else
+             tf.zeros([1, 2, 2], tf.float64))
+        R = blk.blk_tridiag_filter_step(
+            state[0], state[1], tf.constant(np.array([alist[t] + delta])),
+            B, tf.constant(bb[None, t]), tf.constant(np.array([alist[t]])))
+        state = R[:2]
+        filtered.append(R[2:])
+
+    with tf.Session() as sess:
+        x, S, filtered = sess.run([x, S, filtered])
+
+    # the last filtered mean and covariance are the last marginal of the
+    # smoother
+    npt.assert_allclose(filtered[-1][0][0], x[0, -1], rtol=1e-10)
+    npt.assert_allclose(filtered[-1][1][0], S[0, -1], rtol=1e-10)
+
+    # every filtered marginal is the last marginal of the truncated trial
+    for t in range(nT):
+        mat = mat64[:(2 * t + 2), :(2 * t + 2)].copy()
+        mat[:(2 * t), :(2 * t)] += np.kron(np.eye(t), delta)
+        npt.assert_allclose(
+            filtered[t][0][0].ravel(),
+            np.linalg.solve(mat, bb[:(t + 1)].ravel())[-2:], rtol=1e-8)
+        npt.assert_allclose(filtered[t][1][0],
+                            np.linalg.inv(mat)[-2:, -2:], rtol=1e-8)
+
+
+def test_blk_tridiag_window_smooth():
+    alist = [cholmat[i:(i+2), i:(i+2)] for i in range(0, cholmat.shape[0], 2)]
+    blist = [cholmat[(i+2):(i+4), i:(i+2)].T
+             for i in range(0, cholmat.shape[0] - 2, 2)]
+    cholmat_inv = np.linalg.inv(cholmat)
+    sol = np.linalg.solve(cholmat, npb.reshape(-1)).reshape(4, 2, 1)
+
+    theDiag = tf.constant(np.array([alist, alist]))
+    theOffDiag = tf.constant(np.array([blist, blist]))
+    theb = tf.constant(np.array([npb, npb]).reshape(2, 4, 2, 1))
+
+    # windows covering the whole trial give the exact solution; solving
+    # groups of windows one after the other gives the same results
+    R = blk.blk_tridiag_window_smooth(theDiag, theOffDiag, theb, 6, 1)
+    RW = blk.blk_tridiag_window_smooth(theDiag, theOffDiag, theb, 3, 1)
+    RP = blk.blk_tridiag_window_smooth(theDiag, theOffDiag, theb, 3, 1,
+                                       parallel_windows=2)
+
+    with tf.Session() as sess:
+        R, RW, RP = sess.run([R, RW, RP])
+
+    for i in range(2):
+        npt.assert_allclose(R[0][i], sol, rtol=1e-3, atol=1e-5)
+        for (t, j) in zip(range(4), range(0, 8, 2)):
+            npt.assert_allclose(R[1][i, t], cholmat_inv[j:(j+2), j:(j+2)],
+                                rtol=1e-3)
+        for (t, j) in zip(range(3), range(0, 6, 2)):
+            npt.assert_allclose(R[2][i, t],
+                                cholmat_inv[(j+2):(j+4), j:(j+2)],
+                                rtol=1e-3)
+        for (x, y) in zip(R[3][i], [npF, npC, npE, npG]):
+            npt.assert_allclose(x, y, atol=1e-5, rtol=1e-4)
+        for (x, y) in zip(R[4][i], [npB.T, npD.T, npB.T]):
+            npt.assert_allclose(x, y, atol=1e-5, rtol=1e-4)
+
+    for (x, y) in zip(RW, RP):
+        assert x.shape == y.shape
+        npt.assert_allclose(x, y, rtol=1e-5, atol=1e-6)
+
+
+def test_blk_tridiag_window_smooth_lag():
+    rng = np.random.RandomState(0)
+    # A_t = 4 I and orthogonal B_t: the blocks of the inverse decay as r^k
+    # with the distance k between time steps, and so does the error of the
+    # windows with lag
+    r = 2. - np.sqrt(3.)
+    for T in [13, 16, 20]:
+        npDiag = np.tile(4. * np.eye(2), [2, T, 1, 1])
+        npOffDiag = np.linalg.qr(rng.randn(2 * (T - 1), 2, 2))[0].reshape(
+            2, T - 1, 2, 2)
+        npbb = rng.randn(2, T, 2, 1)
+        theDiag = tf.constant(npDiag)
+        theOffDiag = tf.constant(npOffDiag)
+        theb = tf.constant(npbb)
+
+        L, C = blk.blk_tridiag_chol(theDiag, theOffDiag)
+        x = blk.blk_chol_inv(L, C, blk.blk_chol_inv(L, C, theb),
+                             lower=False, transpose=True)
+        R = [[x] + blk.blk_chol_sel_inv(L, C)]
+        lags = [1, 2, 3, 4]
+        for lag in lags:
+            R.append(blk.blk_tridiag_window_smooth(
+                theDiag, theOffDiag, theb, 2 * lag + 3, lag)[:3])
+
+        with tf.Session() as sess:
+            R = sess.run(R)
+
+        for (lag, RW) in zip(lags, R[1:]):
+            for (x, y) in zip(RW, R[0]):
+                # first and last time steps, and every stitched one
+                for t in [0, -1]:
+                    npt.assert_allclose(x[:, t], y[:, t], atol=r ** lag)
+                npt.assert_allclose(x, y, atol=r ** lag)
+
+
+def test_blk_tridiag_window_smooth_grad():
+    mat64 = np.asarray(cholmat, np.float64)
+    alist = [mat64[i:(i+2), i:(i+2)] for i in range(0, mat64.shape[0], 2)]
+    blist = [mat64[(i+2):(i+4), i:(i+2)].T
+             for i in range(0, mat64.shape[0] - 2, 2)]
+    rng = np.random.RandomState(0)
+    # cholmat is close to singular, shift it for finite differences
+    npDiag = np.array([alist, alist[::-1]]) + np.eye(2)
+    npOffDiag = np.array([blist, blist[::-1]])
+    npbb = np.array([npb, npb[::-1]]).reshape(2, 4, 2, 1).astype(np.float64)
+    weights = [rng.randn(2, 4, 2, 1), rng.randn(2, 4, 2, 2),
+               rng.randn(2, 3, 2, 2), rng.randn(2, 4, 2, 2),
+               rng.randn(2, 3, 2, 2)]
+
+    theDiag = tf.constant(npDiag)
+    theOffDiag = tf.constant(npOffDiag)
+    theb = tf.constant(npbb)
+    # symmetric parameterization of the diagonal blocks
+    sym_diag = .5 * (theDiag + tf.transpose(theDiag, [0, 1, 3, 2]))
+
+    def _objective(parallel_windows):
+        R = blk.blk_tridiag_window_smooth(sym_diag, theOffDiag, theb, 3, 1,
+                                          parallel_windows)
+        return tf.add_n([tf.reduce_sum(w * x) for (w, x) in zip(weights, R)])
+
+    f_all, f_groups = _objective(None), _objective(2)
+    grads = [tf.gradients(f, [theDiag, theOffDiag, theb])
+             for f in [f_all, f_groups]]
+
+    with tf.Session() as sess:
+        grads = sess.run(grads)
+        # gradients of the windows solved in groups (map_fn) against finite
+        # differences
+        for (x, x_val) in [(theDiag, npDiag), (theOffDiag, npOffDiag),
+                           (theb, npbb)]:
+            err = tf.test.compute_gradient_error(
+                x, x_val.shape, f_groups, [], x_init_value=x_val, delta=1e-6)
+            assert err < 1e-6
+
+    for (gx, gy) in zip(*grads):
+        npt.assert_allclose(gx, gy, rtol=1e-10, atol=1e-12)
+
+
+def test_blk_tridiag_add_stationary():
+    alist = [npA, npB, npC, npD]
+    blist = [npE, npF, npG]
+    theDiag = tf.constant(np.array([alist, alist[::-1]]))
+    theOffDiag = tf.constant(np.array([blist, blist[::-1]]))
+
+    R = blk.blk_tridiag_add_stationary(theDiag, theOffDiag, npE, npF, npG,
+                                       npA)
+
+    with tf.Session() as sess:
+        R0, R1 = sess.run(R)
+
+    prior_diag = np.array([npE, npF, npF, npG])
+    npt.assert_allclose(R0, np.array([alist, alist[::-1]]) + prior_diag)
+    npt.assert_allclose(R1, np.array([blist, blist[::-1]]) + npA)
@@ -0,0 +1,236 @@
+import numpy as np
+import numpy.testing as npt
+import pytest
+import tensorflow as tf
+
+from tf_gbds.GenerativeModel import (GBDS, joint_GBDS, stacked_GBDS,
+                                     pid_convolution, sample_mixture)
+from tf_gbds.utils import get_network, get_g0_params
+
+# shared testing data: a batch of trials whose length is not a multiple of
+# the block sizes below, with agents of unequal dimensions (goalie [0] and
+# ball [1, 2])
+rng = np.random.RandomState(1234)
+K, obs_dim, extra_dim, B, T = 4, 3, 1, 3, 24
+state_dim = 2 * obs_dim
+npstates = .5 * rng.randn(B, T, state_dim).astype(np.float32)
+npctrl = .3 * rng.randn(B, T - 1, obs_dim).astype(np.float32)
+npextra = np.array([.4], np.float32)
+npvalue = .5 * rng.randn(B, T - 1, obs_dim).astype(np.float32)
+
+
+def _agent_params(name, col, g_bounds_pen=100.):
+    dim = len(col)
+    with tf.variable_scope(name):
+        return dict(
+            name=name, col=col, dim=dim,
+            g0=get_g0_params(dim, K),
+            GMM_NN=get_network("goal_GMM", state_dim + extra_dim,
+                               2 * K * dim + K, 16, 3)[0],
+            GMM_K=K,
+            unc_sigma=tf.constant(rng.randn(1, dim).astype(np.float32) - 2.),
+            sigma_trainable=True, sigma_pen=10.,
+            g_bounds=[-.1, .1], g_bounds_pen=g_bounds_pen,
+            # different gains for every dimension
+            PID=dict(Kp=tf.constant(rng.rand(dim).astype(np.float32)),
+                     Ki=tf.constant(.1 * rng.rand(dim).astype(np.float32)),
+                     Kd=tf.constant(.1 * rng.rand(dim).astype(np.float32)),
+                     vars=[]),
+            unc_eps=tf.constant(rng.randn(1, dim).astype(np.float32) - 3.),
+            eps_trainable=True, eps_pen=100.)
+
+
+def _joint_params():
+    # the goalie has no boundary penalty, so that its padded entries and
+    # penalties are masked differently from the ball's
+    return [_agent_params("goalie", [0], None), _agent_params("ball", [1, 2])]
+
+
+def _mixture_moments(mu, lambda_, w, var=None):
+    # mean and variance of mixtures of Gaussians [... x K x dim], with
+    # component variances var (1 / lambda_ by default)
+    if var is None:
+        var = 1. / lambda_
+    w = w[..., np.newaxis]
+    mean = np.sum(w * mu, -2)
+
+    return mean, np.sum(w * (var + mu ** 2), -2) - mean ** 2
+
+
+def _assert_moments(samples, mean, var):
+    # sample mean and variance over the first axis within 5 standard errors
+    n = samples.shape[0]
+    res = samples - samples.mean(0)
+    npt.assert_array_less(np.abs(samples.mean(0) - mean),
+                          5 * np.sqrt(var / n))
+    npt.assert_array_less(np.abs(samples.var(0) - var),
+                          5 * np.sqrt(np.var(res ** 2, 0) / n) + 1e-6)
+
+
+def test_pid_convolution():
+    with tf.Graph().as_default():
+        p = GBDS(_agent_params("ball", [1, 2]), tf.constant(npstates),
+                 tf.constant(npctrl))
+        error = tf.constant(npvalue[:, :, 1:])
+        u_diff = pid_convolution(error, p.L)
+
+        # one convolution per dimension
+        u_diff_dims = []
+        for i in range(2):
+            signal = tf.expand_dims(tf.pad(error[:, :, i], [[0, 0], [2, 0]]),
+                                    -1)
+            filt = tf.reshape(p.L[i], [-1, 1, 1])
+            u_diff_dims.append(tf.nn.convolution(signal, filt,
+                                                 padding="VALID"))
+        u_diff_dims = tf.concat(u_diff_dims, -1)
+
+        with tf.Session() as sess:
+            u_diff, u_diff_dims = sess.run([u_diff, u_diff_dims])
+
+    npt.assert_array_equal(u_diff, u_diff_dims)
+
+
+def test_sample_mixture():
+    n = 50000
+    npmu = rng.randn(2, K, 3)
+    nplambda = np.exp(rng.randn(2, K, 3))
+    npw = rng.dirichlet(np.ones(K), 2)
+
+    with tf.Graph().as_default():
+        samples = sample_mixture(tf.constant(npmu, tf.float32),
+                                 tf.constant(nplambda, tf.float32),
+                                 tf.constant(npw, tf.float32), n)
+
+        with tf.Session() as sess:
+            samples = sess.run(samples)
+
+    assert samples.shape == (2, n, 3)
+    _assert_moments(np.swapaxes(samples, 0, 1),
+                    *_mixture_moments(npmu, nplambda, npw))
+
+
+def test_GBDS_sample_g0():
+    n = 50000
+
+    with tf.Graph().as_default():
+        p = GBDS(_agent_params("ball", [1, 2]), tf.constant(npstates),
+                 tf.constant(npctrl))
+        g0 = [p.sample_g0(), p.sample_g0(n)]
+
+        with tf.Session() as sess:
+            sess.run(tf.global_variables_initializer())
+            (g0_single, g0), mu, lambda_, w = sess.run(
+                [g0, p.g0_mu, p.g0_lambda, p.g0_w])
+
+    assert g0_single.shape == (2,)
+    assert g0.shape == (n, 2)
+    _assert_moments(g0, *_mixture_moments(mu, lambda_, w))
+
+
+def test_GBDS_log_prob_chunk():
+    with tf.Graph().as_default():
+        params = _agent_params("ball", [1, 2])
+        states = tf.constant(npstates)
+        ctrl = tf.constant(npctrl)
+        extra = tf.constant(npextra)
+        value = tf.constant(npvalue[:, :, 1:])
+
+        p = GBDS(params, states, ctrl, extra)
+        all_mu, all_lambda, all_w, g_pred = p.get_GMM_preds(
+            p.s[:, 1:-1], value, p.extra_conds)
+        # GMM log-density and boundary penalties at each time step
+        terms = [[p.GMM_log_density(value[:, 1:], all_mu, all_lambda, all_w,
+                                    g_pred),
+                  p.boundary_penalty(all_mu, all_lambda)]]
+        log_prob = [p._log_prob(value)]
+        for chunk in [1, 5, 7]:
+            p = GBDS(dict(params, log_prob_chunk=chunk), states, ctrl, extra)
+            terms.append(p.chunked_goal_terms(p.s[:, 1:-1], value,
+                                              p.extra_conds))
+            log_prob.append(p._log_prob(value))
+        grads = [tf.gradients(x, [value] + params["GMM_NN"].variables)
+                 for x in log_prob]
+
+        with tf.Session() as sess:
+            sess.run(tf.global_variables_initializer())
+            terms, log_prob, grads = sess.run([terms, log_prob, grads])
+
+    for (x, g, t) in zip(log_prob[1:], grads[1:], terms[1:]):
+        for (tx, ty) in zip(t, terms[0]):
+            npt.assert_allclose(tx, ty, rtol=1e-5, atol=1e-7)
+        npt.assert_allclose(x, log_prob[0], rtol=1e-5)
+        for (gx, gy) in zip(g, grads[0]):
+            npt.assert_allclose(gx, gy, rtol=1e-4,
+                                atol=1e-5 * np.abs(gy).max())
+
+
+def test_stacked_GBDS():
+    n = 50000
+
+    with tf.Graph().as_default():
+        params = _joint_params()
+        args = [tf.constant(npstates), tf.constant(npctrl),
+                tf.constant(npextra)]
+        pj = joint_GBDS(params, *args)
+        ps = stacked_GBDS(params, *args)
+        value = tf.constant(npvalue)
+
+        errors = tf.constant(rng.randn(3, B, obs_dim).astype(np.float32))
+        prev_u = tf.constant(rng.randn(B, obs_dim).astype(np.float32))
+        state = tf.constant(npstates[0, 1])
+        prev_g = tf.constant(npvalue[0, 0])
+        deterministic = [[p._log_prob(value), p.update_ctrl(errors, prev_u),
+                          p.update_ctrl(errors[:, 0], prev_u[0])]
+                         for p in [pj, ps]]
+        samples = [[p.update_goal(state, prev_g, args[2]),
+                    p.update_goal(tf.tile(tf.expand_dims(state, 0), [n, 1]),
+                                  tf.tile(tf.expand_dims(prev_g, 0), [n, 1]),
+                                  args[2]),
+                    p.sample_g0(), p.sample_g0(n)] for p in [pj, ps]]
+
+        # parameters of the goal and initial goal mixtures of each agent
+        mixtures = []
+        for (agent, a) in zip(pj.agents, params):
+            all_mu, all_lambda, all_w, next_g = agent.get_GMM_preds(
+                tf.tile(tf.reshape(state, [1, 1, -1]), [B, 1, 1]),
+                tf.tile(tf.reshape(tf.gather(prev_g, a["col"]), [1, 1, -1]),
+                        [B, 2, 1]), args[2])
+            mixtures.append([next_g[0, 0], agent.sigma[0] ** 2 /
+                             (1 + all_lambda[0, 0]), all_w[0, 0],
+                             agent.g0_mu, agent.g0_lambda, agent.g0_w])
+
+        with tf.Session() as sess:
+            sess.run(tf.global_variables_initializer())
+            deterministic, samples, mixtures = sess.run(
+                [deterministic, samples, mixtures])
+
+    for (x, y) in zip(*deterministic):
+        npt.assert_allclose(x, y, rtol=1e-5, atol=1e-6)
+
+    goal_mean, goal_var, g0_mean, g0_var = [], [], [], []
+    for (next_g, var, w, mu0, lambda0, w0) in mixtures:
+        mean, var = _mixture_moments(next_g, None, w, var)
+        goal_mean.append(mean)
+        goal_var.append(var)
+        mean, var = _mixture_moments(mu0, lambda0, w0)
+        g0_mean.append(mean)
+        g0_var.append(var)
+    goal_mean, goal_var, g0_mean, g0_var = [
+        np.concatenate(x) for x in [goal_mean, goal_var, g0_mean, g0_var]]
+
+    for (goal, goals, g0, g0s) in samples:
+        assert goal.shape == (obs_dim,)
+        assert goals.shape == (n, obs_dim)
+        assert g0.shape == (obs_dim,)
+        assert g0s.shape == (n, obs_dim)
+        _assert_moments(goals, goal_mean, goal_var)
+        _assert_moments(g0s, g0_mean, g0_var)
+
+
+def test_stacked_GBDS_log_prob_chunk():
+    with tf.Graph().as_default():
+        params = [dict(p, log_prob_chunk=5) for p in _joint_params()]
+
+        with pytest.raises(ValueError):
+            stacked_GBDS(params, tf.constant(npstates), tf.constant(npctrl),
+                         tf.constant(npextra))
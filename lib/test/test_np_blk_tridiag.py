@@ -0,0 +1,96 @@
+import numpy as np
+import tensorflow as tf
+import numpy.testing as npt
+
+import tf_gbds.lib.blk_tridiag_chol_tools as blk
+import tf_gbds.lib.sym_blk_tridiag_inv as sym
+import tf_gbds.lib.np_blk_tridiag as npblk
+
+# shared testing data: a batch of random symmetric, positive definite block
+# tridiagonal matrices (product of a block-bi-diagonal matrix and its
+# transpose)
+prec = np.float64
+rng = np.random.RandomState(1234)
+batch_size, T, n = 3, 6, 3
+npL = np.tril(.3 * rng.randn(batch_size, T, n, n)) + 2 * np.eye(n)
+npC = .5 * rng.randn(batch_size, T - 1, n, n)
+
+npAA = np.matmul(npL, np.swapaxes(npL, -1, -2))
+npAA[:, 1:] += np.matmul(npC, np.swapaxes(npC, -1, -2))
+npBB = np.matmul(npL[:, :-1], np.swapaxes(npC, -1, -2))
+
+npb = rng.randn(batch_size, T, n, 2)
+
+
+def test_blk_tridiag_chol():
+    R = npblk.blk_tridiag_chol(npAA, npBB)
+    tfR = blk.blk_tridiag_chol(tf.constant(npAA), tf.constant(npBB))
+
+    with tf.Session() as sess:
+        tfR0, tfR1 = sess.run(tfR)
+
+    npt.assert_allclose(R[0], npL, atol=1e-10)
+    npt.assert_allclose(R[1], npC, atol=1e-10)
+    npt.assert_allclose(R[0], tfR0, atol=1e-10)
+    npt.assert_allclose(R[1], tfR1, atol=1e-10)
+
+
+def test_blk_chol_inv():
+    tfL, tfC, tfb = tf.constant(npL), tf.constant(npC), tf.constant(npb)
+
+    for lower, transpose in [(True, False), (False, True),
+                             (True, True), (False, False)]:
+        tfx = blk.blk_chol_inv(tfL, tfC, tfb, lower=lower,
+                               transpose=transpose)
+        with tf.Session() as sess:
+            tfx_val = sess.run(tfx)
+
+        x = npblk.blk_chol_inv(npL, npC, npb, lower=lower,
+                               transpose=transpose)
+        x_tri = npblk.blk_chol_inv(npL, npC, npb, lower=lower,
+                                   transpose=transpose, triangular=True)
+        npt.assert_allclose(x, tfx_val, atol=1e-10)
+        npt.assert_allclose(x_tri, tfx_val, atol=1e-10)
+
+
+def test_blk_chol_mtimes():
+    tfL, tfC, tfb = tf.constant(npL), tf.constant(npC), tf.constant(npb)
+
+    for lower, transpose in [(True, False), (False, True)]:
+        tfy = blk.blk_chol_mtimes(tfL, tfC, tfb, lower=lower,
+                                  transpose=transpose)
+        with tf.Session() as sess:
+            tfy_val = sess.run(tfy)
+
+        y = npblk.blk_chol_mtimes(npL, npC, npb, lower=lower,
+                                  transpose=transpose)
+        npt.assert_allclose(y, tfy_val, atol=1e-10)
+
+
+def test_compute_sym_blk_tridiag():
+    D, OD, S = npblk.compute_sym_blk_tridiag(npAA, npBB)
+    x = npblk.compute_sym_blk_tridiag_inv_b(S, D, npb[:, :, :, :1])
+
+    tfD, tfOD, tfS = sym.compute_sym_blk_tridiag(tf.constant(npAA),
+                                                  tf.constant(npBB))
+    tfx = sym.compute_sym_blk_tridiag_inv_b(tfS, tfD,
+                                            tf.constant(npb[:, :, :, :1]))
+
+    with tf.Session() as sess:
+        tfD_val, tfOD_val, tfS_val, tfx_val = sess.run([tfD, tfOD, tfS, tfx])
+
+    npt.assert_allclose(D, tfD_val, atol=1e-10)
+    npt.assert_allclose(OD, tfOD_val, atol=1e-10)
+    npt.assert_allclose(S, tfS_val, atol=1e-10)
+    npt.assert_allclose(x, tfx_val, atol=1e-10)
+
+
+def test_blk_chol_sel_inv():
+    D, OD = npblk.blk_chol_sel_inv(npL, npC)
+    tfD, tfOD = blk.blk_chol_sel_inv(tf.constant(npL), tf.constant(npC))
+
+    with tf.Session() as sess:
+        tfD_val, tfOD_val = sess.run([tfD, tfOD])
+
+    npt.assert_allclose(D, tfD_val, atol=1e-10)
+    npt.assert_allclose(OD, tfOD_val, atol=1e-10)
@@ -0,0 +1,79 @@
+import numpy as np
+import numpy.testing as npt
+
+import tf_gbds.lib.np_blk_tridiag as npblk
+from tf_gbds.lib.posterior_store import PosteriorWriter, PosteriorStore
+
+# shared testing data: trials of different lengths with random symmetric,
+# positive definite block tridiagonal posterior precisions
+rng = np.random.RandomState(1234)
+n = 3
+trials = []
+for T in [5, 1, 8]:
+    L = np.tril(.3 * rng.randn(1, T, n, n)) + 2 * np.eye(n)
+    C = .5 * rng.randn(1, T - 1, n, n)
+    AA = np.matmul(L, np.swapaxes(L, -1, -2))
+    AA[:, 1:] += np.matmul(C, np.swapaxes(C, -1, -2))
+    BB = np.matmul(L[:, :-1], np.swapaxes(C, -1, -2))
+    trials.append(dict(AA=AA[0], BB=BB[0], L=L[0], C=C[0],
+                       postX=rng.randn(T, n), traj=rng.randn(T, 2)))
+
+
+def _write(path):
+    with PosteriorWriter(path, n, 2, np.float64) as writer:
+        for trial in trials:
+            writer.write(trial["postX"], trial["L"], trial["C"],
+                         trial["traj"])
+
+    return PosteriorStore(path)
+
+
+def test_posterior_store(tmpdir):
+    store = _write(str(tmpdir))
+
+    assert len(store) == len(trials)
+    for (i, trial) in enumerate(trials):
+        npt.assert_allclose(store.mean(i), trial["postX"])
+        npt.assert_allclose(store.trajectory(i), trial["traj"])
+        L, C = store.chol(i)
+        npt.assert_allclose(L, trial["L"])
+        npt.assert_allclose(C, trial["C"])
+
+
+def test_posterior_store_marginals(tmpdir):
+    store = _write(str(tmpdir))
+
+    for (i, trial) in enumerate(trials):
+        T = trial["L"].shape[0]
+        prec = np.zeros((T * n, T * n))
+        for t in range(T):
+            prec[(t*n):(t*n+n), (t*n):(t*n+n)] = trial["AA"][t]
+        for t in range(T - 1):
+            prec[(t*n):(t*n+n), (t*n+n):(t*n+2*n)] = trial["BB"][t]
+            prec[(t*n+n):(t*n+2*n), (t*n):(t*n+n)] = trial["BB"][t].T
+        cov = np.linalg.inv(prec)
+
+        D, OD = store.marginals(i)
+        for t in range(T):
+            npt.assert_allclose(D[t], cov[(t*n):(t*n+n), (t*n):(t*n+n)],
+                                atol=1e-10)
+        for t in range(T - 1):
+            npt.assert_allclose(OD[t],
+                                cov[(t*n+n):(t*n+2*n), (t*n):(t*n+n)],
+                                atol=1e-10)
+
+
+def test_posterior_store_sample(tmpdir):
+    store = _write(str(tmpdir))
+    trial = trials[2]
+
+    samples = store.sample(2, 4, seed=0)
+    assert samples.shape == (4, 8, n)
+
+    # samples map back to the standard normal draws through the factor
+    eps = np.random.RandomState(0).randn(1, 8, n, 4)
+    y = npblk.blk_chol_mtimes(
+        trial["L"][np.newaxis], trial["C"][np.newaxis],
+        np.transpose(samples - trial["postX"], [1, 2, 0])[np.newaxis],
+        lower=False, transpose=True)
+    npt.assert_allclose(y, eps, atol=1e-10)
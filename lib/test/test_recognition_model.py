@@ -0,0 +1,169 @@
+import numpy as np
+import numpy.testing as npt
+import pytest
+import tensorflow as tf
+
+from tf_gbds.RecognitionModel import (SmoothingPastLDSTimeSeries,
+                                      FactorizedSmoothingPastLDSTimeSeries)
+from tf_gbds.utils import get_rec_params
+
+# shared testing data
+rng = np.random.RandomState(1234)
+obs_dim, x_dim, lag, B, T = 3, 2, 2, 2, 9
+npobs = .5 * rng.randn(B, T, obs_dim).astype(np.float32)
+
+
+def _dense_precision(AA, BB):
+    # dense symmetric block tridiagonal matrix of each trial, with diagonal
+    # blocks AA and upper off-diagonal blocks BB
+    n = AA.shape[-1]
+    M = np.zeros([AA.shape[0], AA.shape[1] * n, AA.shape[1] * n])
+    for t in range(AA.shape[1]):
+        M[:, (t * n):((t + 1) * n), (t * n):((t + 1) * n)] = AA[:, t]
+    for t in range(BB.shape[1]):
+        M[:, (t * n):((t + 1) * n), ((t + 1) * n):((t + 2) * n)] = BB[:, t]
+        M[:, ((t + 1) * n):((t + 2) * n), (t * n):((t + 1) * n)] = np.swapaxes(
+            BB[:, t], -1, -2)
+
+    return M
+
+
+def test_lambda_rank():
+    rank = 1
+
+    with tf.Graph().as_default():
+        params = get_rec_params(obs_dim, 0, lag, 2, 16, lambda_rank=rank,
+                                x_dim=x_dim)
+        q = SmoothingPastLDSTimeSeries(params, tf.constant(npobs), x_dim,
+                                       obs_dim)
+        LambdaMu = tf.matmul(q.Lambda, tf.expand_dims(q.Mu, -1))
+        grads = tf.gradients(tf.reduce_sum(q.eval_entropy()) +
+                             tf.reduce_sum(q.postX), q.params)
+
+        with tf.Session() as sess:
+            sess.run(tf.global_variables_initializer())
+            (NN_Lambda_output, LambdaChol, Lambda, AA, BB, LambdaMu, postX,
+             grads) = sess.run([q.NN_Lambda_output, q.LambdaChol, q.Lambda,
+                                q.AA, q.BB, LambdaMu, q.postX, grads])
+
+    assert LambdaChol.shape == (B, T, x_dim, x_dim + rank)
+    # precision blocks diag(d) + U U^T from the network output
+    d = np.log1p(np.exp(NN_Lambda_output[..., :x_dim]))
+    U = NN_Lambda_output[..., x_dim:].reshape(B, T, x_dim, rank)
+    npt.assert_allclose(
+        Lambda, d[..., np.newaxis] * np.eye(x_dim) +
+        np.matmul(U, np.swapaxes(U, -1, -2)), rtol=1e-5, atol=1e-6)
+
+    # the posterior mean solves the full precision system
+    M = _dense_precision(AA, BB)
+    npt.assert_allclose(
+        postX.reshape(B, -1),
+        np.linalg.solve(M, LambdaMu.reshape(B, -1, 1))[..., 0],
+        rtol=1e-4, atol=1e-5)
+    for g in grads:
+        assert g is not None and np.all(np.isfinite(g))
+
+
+class _Head(object):
+    """One output head (columns cols) of a network, called like the
+    separate recognition networks.
+    """
+
+    def __init__(self, network, cols):
+        self.network = network
+        self.cols = cols
+        self.variables = network.variables
+
+    def __call__(self, x):
+        return self.network(x)[..., self.cols]
+
+
+@pytest.mark.parametrize("lambda_rank", [None, 1])
+def test_shared_trunk(lambda_rank):
+    with tf.Graph().as_default():
+        params = get_rec_params(obs_dim, 0, lag, 2, 16, shared_trunk=True,
+                                lambda_rank=lambda_rank, x_dim=x_dim)
+        q = SmoothingPastLDSTimeSeries(params, tf.constant(npobs), x_dim,
+                                       obs_dim)
+        # the separate networks made of the heads of the shared one
+        size = q.lambda_size
+        NN_Rec = params["NN_Rec"]["network"]
+        separate = dict(
+            params, NN_Mu=dict(network=_Head(NN_Rec, slice(0, x_dim))),
+            NN_Lambda=dict(network=_Head(NN_Rec, slice(x_dim, x_dim + size))),
+            NN_LambdaX=dict(network=_Head(NN_Rec, slice(x_dim + size, None))))
+        del separate["NN_Rec"]
+        q_sep = SmoothingPastLDSTimeSeries(separate, tf.constant(npobs),
+                                           x_dim, obs_dim)
+        outputs = [[x.Mu, x.LambdaChol, x.LambdaXChol, x.postX,
+                    x.the_chol[0], x.the_chol[1]] for x in [q, q_sep]]
+
+        with tf.Session() as sess:
+            sess.run(tf.global_variables_initializer())
+            outputs = sess.run(outputs)
+
+    assert outputs[0][2].shape[1] == T - 1
+    for (x, y) in zip(*outputs):
+        npt.assert_allclose(x, y, rtol=1e-6, atol=1e-7)
+
+
+@pytest.mark.parametrize("cols", [[[0], [1, 2]], [[0], [2]]])
+def test_factorized(cols):
+    # the second set of columns leaves column 1 unmodeled
+    with tf.Graph().as_default():
+        params = []
+        for (i, col) in enumerate(cols):
+            params.append(get_rec_params(obs_dim, 0, lag, 2, 16,
+                                         name="agent%d" % i, x_dim=len(col)))
+            params[-1].update(name="agent%d" % i, col=col)
+        q = FactorizedSmoothingPastLDSTimeSeries(params, tf.constant(npobs),
+                                                 obs_dim, obs_dim)
+        agents = [[a.postX, a.the_chol[0], a.the_chol[1]] for a in q.agents]
+
+        with tf.Session() as sess:
+            sess.run(tf.global_variables_initializer())
+            postX, L, C, agents = sess.run([q.postX, q.the_chol[0],
+                                            q.the_chol[1], agents])
+
+    assert postX.shape == (B, T, obs_dim, 1)
+    assert L.shape == (B, T, obs_dim, obs_dim)
+    assert C.shape == (B, T - 1, obs_dim, obs_dim)
+    # the joint blocks are block diagonal across agents, with the blocks of
+    # each agent over its columns and identity blocks for unmodeled columns
+    L_joint = np.tile(np.eye(obs_dim), [B, T, 1, 1])
+    C_joint = np.zeros([B, T - 1, obs_dim, obs_dim])
+    postX_joint = np.zeros([B, T, obs_dim, 1])
+    for (col, (a_postX, a_L, a_C)) in zip(cols, agents):
+        r, c = np.ix_(col, col)
+        L_joint[..., r, c] = a_L
+        C_joint[..., r, c] = a_C
+        postX_joint[:, :, col] = a_postX
+    npt.assert_array_equal(L, L_joint)
+    npt.assert_array_equal(C, C_joint)
+    npt.assert_array_equal(postX, postX_joint)
+
+
+@pytest.mark.parametrize("n_lag", [1, 3])
+def test_lag_features(n_lag):
+    y0 = [0., -0.58, 0.]
+
+    with tf.Graph().as_default():
+        params = get_rec_params(obs_dim, 0, n_lag, 2, 16, x_dim=x_dim)
+        Input = tf.constant(npobs)
+        q = SmoothingPastLDSTimeSeries(dict(params, y0=y0), Input, x_dim,
+                                       obs_dim)
+
+        # previous construction: one concatenation per lag
+        Input_ = tf.identity(Input)
+        for _ in range(n_lag):
+            lagged = tf.concat(
+                [tf.tile(tf.reshape(y0, [1, 1, obs_dim]),
+                         [tf.shape(Input_)[0], 1, 1]),
+                 Input_[:, :-1, -obs_dim:]], 1)
+            Input_ = tf.concat([Input_, lagged], -1)
+
+        with tf.Session() as sess:
+            y, y_loop = sess.run([q.y, Input_])
+
+    assert y.shape == (B, T, obs_dim * (n_lag + 1))
+    npt.assert_array_equal(y, y_loop)
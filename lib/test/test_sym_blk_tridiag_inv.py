@@ -66,3 +66,37 @@ def test_compute_sym_blk_tridiag_inv_b():
     with tf.Session() as sess:
         tfx_val = tfx.eval()
     npt.assert_allclose(tfx_val.flatten(), x, atol=1e-5, rtol=1e-4)
+
+
+def test_compute_sym_blk_tridiag_batch():
+
+    alist = [fullmat[i:(i+2), i:(i+2)] for i in range(0, fullmat.shape[0], 2)]
+    blist = [fullmat[(i+2):(i+4), i:(i+2)].T
+             for i in range(0, fullmat.shape[0] - 2, 2)]
+
+    AAi = tf.constant(np.array([alist, alist]))
+    BBi = tf.constant(np.array([blist, blist]))
+
+    fullmat_inv = np.linalg.inv(fullmat)
+    x = np.linalg.solve(fullmat, np.array([0, 1, 2, 3, 4, 5, 6, 7]))
+
+    D, OD, S = sym.compute_sym_blk_tridiag(AAi, BBi)
+    b = tf.expand_dims(tf.constant(np.array([npb, npb])), -1)
+    tfx = sym.compute_sym_blk_tridiag_inv_b(S, D, b)
+
+    with tf.Session() as sess:
+        D_, OD_, tfx_val = sess.run([D, OD, tfx])
+
+    for i in range(2):
+        for (x_, y) in zip(D_[i], [fullmat_inv[0:2, 0:2],
+                                   fullmat_inv[2:4, 2:4],
+                                   fullmat_inv[4:6, 4:6],
+                                   fullmat_inv[6:8, 6:8]]):
+            npt.assert_allclose(x_, y, atol=1e-4, rtol=1e-5)
+
+        for (x_, y) in zip(OD_[i], [fullmat_inv[2:4, 0:2],
+                                    fullmat_inv[4:6, 2:4],
+                                    fullmat_inv[6:8, 4:6]]):
+            npt.assert_allclose(x_, y, atol=1e-4, rtol=1e-5)
+
+        npt.assert_allclose(tfx_val[i].flatten(), x, atol=1e-5, rtol=1e-4)
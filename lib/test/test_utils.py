@@ -0,0 +1,122 @@
+from types import SimpleNamespace
+
+import numpy as np
+import numpy.testing as npt
+import tensorflow as tf
+
+from tf_gbds.lib.posterior_store import PosteriorStore
+from tf_gbds.utils import (gen_data, gen_dataset, write_data, load_data,
+                           export_posterior)
+
+
+def test_export_posterior(tmpdir):
+    # the number of trials is not a multiple of the batch size
+    n_trials = 7
+    hps = SimpleNamespace(obs_dim=3, extra_dim=0, extra_conds=False,
+                          ctrl_obs=False, B=3)
+    trajectories, _ = gen_data(n_trials, 10, seed=1234)
+    path = str(tmpdir.join("data.tfrecords"))
+    write_data(path, trajectories)
+
+    with tf.Graph().as_default():
+        data_dir = tf.placeholder(tf.string)
+        iterator, train_init, export_init = load_data(data_dir, hps)
+        (traj,) = iterator.get_next()
+        # stand-in for the recognition posterior of a trial: a function of
+        # its trajectory
+        g_q = SimpleNamespace(
+            postX=tf.expand_dims(2. * traj, -1),
+            the_chol=[tf.matrix_diag(1. + traj), tf.matrix_diag(traj[:, 1:])],
+            y=traj)
+        model = SimpleNamespace(obs_dim=hps.obs_dim, g_q=g_q)
+
+        with tf.Session() as sess:
+            train_init.run({data_dir: path}, sess)
+            n_batches = 0
+            while True:
+                try:
+                    sess.run(traj)
+                    n_batches += 1
+                except tf.errors.OutOfRangeError:
+                    break
+            # training drops the incomplete last batch
+            assert n_batches == n_trials // hps.B
+
+            n_saved = export_posterior(sess, model, export_init,
+                                       {data_dir: path},
+                                       str(tmpdir.join("posterior")),
+                                       n_trials)
+
+    assert n_saved == n_trials
+    store = PosteriorStore(str(tmpdir.join("posterior")))
+    assert len(store) == n_trials
+    # every trial is stored once, in file order
+    for i in range(n_trials):
+        npt.assert_allclose(store.trajectory(i), trajectories[i], rtol=1e-6,
+                            atol=1e-7)
+        npt.assert_allclose(store.mean(i), 2. * trajectories[i], rtol=1e-6,
+                            atol=1e-7)
+        L, _ = store.chol(i)
+        npt.assert_allclose(np.diagonal(L, axis1=-2, axis2=-1),
+                            1. + trajectories[i], rtol=1e-6, atol=1e-7)
+
+
+def test_gen_data():
+    n_trials, n_obs = 4, 30
+    vel = np.array([.02, .05, .03])
+    Kp, Ki, Kd = np.array([1., .5, 2.]), .1, np.array([.1, 0., .2])
+    # without control noise, so that the PID recursion holds exactly
+    y, truth = gen_data(n_trials, n_obs, eps=0., Kp=Kp, Ki=Ki, Kd=Kd,
+                        vel=vel, seed=1234)
+    g, u = truth["goals"], truth["ctrls"]
+
+    assert y.shape == (n_trials, n_obs + 1, 3)
+    assert g.shape == u.shape == (n_trials, n_obs, 3)
+    npt.assert_array_equal(y[:, 0], np.tile([0., -0.58, 0.], [n_trials, 1]))
+    # the goalie follows the ball
+    npt.assert_array_equal(g[:, :, 0], y[:, :-1, 2])
+    npt.assert_allclose(y[:, 1:], np.clip(y[:, :-1] + vel * np.tanh(u),
+                                          -1., 1.))
+
+    # u_t = u_{t-1} + Kp (e_t - e_{t-1}) + Ki e_t +
+    #       Kd (e_t - 2 e_{t-1} + e_{t-2})
+    e = np.pad(g - y[:, :-1], [[0, 0], [2, 0], [0, 0]], "constant")
+    u_diff = (Kp * (e[:, 2:] - e[:, 1:-1]) + Ki * e[:, 2:] +
+              Kd * (e[:, 2:] - 2 * e[:, 1:-1] + e[:, :-2]))
+    npt.assert_allclose(
+        u - np.pad(u[:, :-1], [[0, 0], [1, 0], [0, 0]], "constant"), u_diff,
+        atol=1e-12)
+
+
+def test_gen_dataset(tmpdir):
+    n_trials, n_obs = 5, 12
+    hps = SimpleNamespace(obs_dim=3, extra_dim=0, extra_conds=False,
+                          ctrl_obs=True, B=2)
+    path = str(tmpdir.join("data.tfrecords"))
+    trajectories, truth = gen_dataset(path, n_trials, n_obs, ctrl_obs=True,
+                                      seed=1234)
+
+    saved = np.load(path + ".npz")
+    npt.assert_array_equal(saved["trajectories"], trajectories)
+    npt.assert_array_equal(saved["ctrls"], truth["ctrls"])
+
+    with tf.Graph().as_default():
+        iterator, _, export_init = load_data(path, hps)
+        batch = iterator.get_next()
+
+        with tf.Session() as sess:
+            export_init.run(session=sess)
+            traj, ctrl_obs = [], []
+            while True:
+                try:
+                    x, c = sess.run(batch)
+                except tf.errors.OutOfRangeError:
+                    break
+                traj.append(x)
+                ctrl_obs.append(c)
+
+    # the export batches hold the trials in file order
+    traj = np.concatenate(traj)[:n_trials]
+    ctrl_obs = np.concatenate(ctrl_obs)[:n_trials]
+    npt.assert_allclose(traj, trajectories, rtol=1e-6, atol=1e-7)
+    npt.assert_allclose(ctrl_obs, truth["ctrls"], rtol=1e-6, atol=1e-7)
@@ -5,7 +5,7 @@ import edward as ed
 from tf_gbds.agents import game_model
 from tf_gbds.utils import (get_max_velocities, load_data, get_vel, get_accel,
                            get_model_params, pad_batch, add_summary,
-                           KLqp_profile, KLqp_clipgrads)
+                           export_posterior, KLqp_profile, KLqp_clipgrads)
 # from tensorflow.python.client import timeline
 
 
@@ -29,12 +29,15 @@ EXTRA_DIM = 0
 OBSERVED_CONTROL = False
 ADD_ACCEL = False
 
+STACKED_AGENTS = False
+LOG_PROB_CHUNK = None
 GMM_K = 8
 GEN_N_LAYERS = 3
 GEN_HIDDEN_DIM = 64
 REC_LAG = 10
 REC_N_LAYERS = 3
 REC_HIDDEN_DIM = 32
+REC_BY_AGENT = False
 
 SIGMA = -7.
 SIGMA_TRAINABLE = False
@@ -101,6 +104,13 @@ flags.DEFINE_boolean("ctrl_obs", OBSERVED_CONTROL, "Are observed control \
 flags.DEFINE_boolean("add_accel", ADD_ACCEL,
                      "Is acceleration included in state")
 
+flags.DEFINE_boolean("stacked_agents", STACKED_AGENTS, "Are the agents \
+                     of the generative model evaluated together")
+flags.DEFINE_integer("log_prob_chunk", LOG_PROB_CHUNK, "Number of time \
+                     steps per block of the GMM log-density (all at once \
+                     if None, not supported with stacked_agents); bounds \
+                     the memory of the forward pass (evaluation) only, not \
+                     of the gradients")
 flags.DEFINE_integer("GMM_K", GMM_K, "Number of components in GMM")
 flags.DEFINE_integer("gen_n_layers", GEN_N_LAYERS, "Number of layers in \
                      neural networks (generative model)")
@@ -114,6 +124,8 @@ flags.DEFINE_integer("rec_n_layers", REC_N_LAYERS, "Number of layers in \
 flags.DEFINE_integer("rec_hidden_dim", REC_HIDDEN_DIM,
                      "Number of hidden units in each dense layer of \
                      neural networks (recognition model)")
+flags.DEFINE_boolean("rec_by_agent", REC_BY_AGENT, "Is the recognition \
+                     model factorized into one model per agent")
 
 flags.DEFINE_float("sigma_init", SIGMA,
                    "Initial value of unconstrained goal state variance")
@@ -215,6 +227,11 @@ def run_model(FLAGS):
     print("Number of GMM components: %s" % FLAGS.GMM_K)
     print("Number of layers in neural networks: %s" % FLAGS.gen_n_layers)
     print("Dimensions of hidden layers: %s" % FLAGS.gen_hidden_dim)
+    if FLAGS.stacked_agents:
+        print("Agents evaluated together (stacked)")
+    if FLAGS.log_prob_chunk is not None:
+        print("GMM log-density evaluated over blocks of %s time steps"
+              % FLAGS.log_prob_chunk)
     if FLAGS.g_bounds_pen is not None:
         print("Penalty on goal states leaving boundary: %s"
               % FLAGS.g_bounds_pen)
@@ -223,6 +240,8 @@ def run_model(FLAGS):
     print("Number of layers in neural networks: %s" % FLAGS.rec_n_layers)
     print("Dimensions of hidden layers: %s" % FLAGS.rec_hidden_dim)
     print("Lag of input: %s" % FLAGS.rec_lag)
+    if FLAGS.rec_by_agent:
+        print("One recognition model per agent")
 
     with tf.device("/cpu:0"):
         with tf.name_scope("get_max_velocities"):
@@ -237,7 +256,7 @@ def run_model(FLAGS):
         data_dir = tf.placeholder(tf.string, name="dataset_directory")
 
         with tf.name_scope("load_data"):
-            iterator = load_data(data_dir, FLAGS)
+            iterator, train_init, export_init = load_data(data_dir, FLAGS)
             data = iterator.get_next("data")
 
             if FLAGS.extra_conds and FLAGS.ctrl_obs:
@@ -275,7 +294,8 @@ def run_model(FLAGS):
             g_bounds, FLAGS.g_bounds_pen, FLAGS.latent_u,
             FLAGS.rec_lag, FLAGS.rec_n_layers, FLAGS.rec_hidden_dim,
             penalty_Q, FLAGS.eps_init, FLAGS.eps_trainable, FLAGS.eps_pen,
-            FLAGS.clip, clip_range, FLAGS.clip_tol, FLAGS.clip_pen, epoch)
+            FLAGS.clip, clip_range, FLAGS.clip_tol, FLAGS.clip_pen, epoch,
+            FLAGS.rec_by_agent, FLAGS.stacked_agents, FLAGS.log_prob_chunk)
 
         model = game_model(params, inputs, max_vel, get_state,
                            FLAGS.extra_dim, FLAGS.n_post_samp)
@@ -374,7 +394,7 @@ def run_model(FLAGS):
         if i == 0 or (i + 1) % 5 == 0:
             print("Entering epoch %s ..." % (i + 1))
 
-        iterator.initializer.run({data_dir: FLAGS.train_data_dir})
+        train_init.run({data_dir: FLAGS.train_data_dir})
         while True:
             try:
                 feed_dict = {epoch: (i + 1)}
@@ -391,7 +411,7 @@ def run_model(FLAGS):
 
         if (i + 1) % FLAGS.freq_val_loss == 0:
             curr_val_loss = []
-            iterator.initializer.run({data_dir: FLAGS.val_data_dir})
+            train_init.run({data_dir: FLAGS.val_data_dir})
             while True:
                 try:
                     curr_val_loss.append(
@@ -430,6 +450,15 @@ def run_model(FLAGS):
     #         f.write(chrome_trace)
     #         f.close()
 
+    if FLAGS.save_posterior:
+        for (name, path, n) in [
+                ("training", FLAGS.train_data_dir, n_trials[0]),
+                ("validation", FLAGS.val_data_dir, n_trials[1])]:
+            n_saved = export_posterior(
+                sess, model, export_init, {data_dir: path},
+                FLAGS.model_dir + "/posterior_%s" % name, n)
+            print("Posterior of %s %s trials saved." % (n_saved, name))
+
     inference.finalize()
     sess.close()
 
@@ -12,6 +12,7 @@ import six
 import os
 from datetime import datetime
 from tf_gbds.layers import PKBiasLayer, PKRowBiasLayer
+from tf_gbds.lib.posterior_store import PosteriorWriter
 
 
 class set_cbar_zero(Normalize):
@@ -75,64 +76,106 @@ def smooth_trial(trial, sigma=4.0, pad_method="extrapolate"):
     return rtrial
 
 
-# def gen_data(n_trials, n_obs, sigma=np.log1p(np.exp(-5. * np.ones((1, 2)))),
-#              eps=np.log1p(np.exp(-10.)), Kp=1, Ki=0, Kd=0,
-#              vel=1e-2 * np.ones((3))):
-#     """Generate fake data to test the accuracy of the model.
-#     """
-#     p = []
-#     g = []
-
-#     for _ in range(n_trials):
-#         p_b = np.zeros((n_obs, 2), np.float32)
-#         p_g = np.zeros((n_obs, 1), np.float32)
-#         g_b = np.zeros((n_obs, 2), np.float32)
-#         prev_error_b = 0
-#         prev_error_g = 0
-#         int_error_b = 0
-#         int_error_g = 0
-
-#         init_b_x = np.pi * (np.random.rand() * 2 - 1)
-#         g_b_x_mu = 0.25 * np.sin(2. * (np.linspace(0, 2 * np.pi, n_obs) -
-#                                        init_b_x))
-#         init_b_y = np.pi * (np.random.rand() * 2 - 1)
-#         g_b_y_mu = 0.25 * np.sin(2. * (np.linspace(0, 2 * np.pi, n_obs) -
-#                                        init_b_y))
-#         g_b_mu = np.hstack([g_b_x_mu.reshape(n_obs, 1),
-#                             g_b_y_mu.reshape(n_obs, 1)])
-#         g_b_lambda = np.array([16, 16], np.float32)
-#         g_b[0] = g_b_mu[0]
-
-#         for t in range(n_obs - 1):
-#             g_b[t + 1] = ((g_b[t] + g_b_lambda * g_b_mu[t + 1]) /
-#                           (1 + g_b_lambda))
-#             var = sigma ** 2 / (1 + g_b_lambda)
-#             g_b[t + 1] += (np.random.randn(1, 2) * np.sqrt(var)).reshape(2,)
-
-#             error_b = g_b[t + 1] - p_b[t]
-#             int_error_b += error_b
-#             der_error_b = error_b - prev_error_b
-#             u_b = (Kp * error_b + Ki * int_error_b + Kd * der_error_b +
-#                    eps * np.random.randn(2,))
-#             prev_error_b = error_b
-#             p_b[t + 1] = p_b[t] + vel[1:] * np.clip(u_b, -1, 1)
-
-#             error_g = p_b[t + 1, 1] - p_g[t]
-#             int_error_g += error_g
-#             der_error_g = error_g - prev_error_g
-#             u_g = (Kp * error_g + Ki * int_error_g + Kd * der_error_g +
-#                    eps * np.random.randn())
-#             prev_error_g = error_g
-#             p_g[t + 1] = p_g[t] + vel[0] * np.clip(u_g, -1, 1)
-
-#         p.append(np.hstack((p_g, p_b)))
-#         g.append(g_b)
-
-#     return p, g
+def gen_data(n_trials, n_obs, sigma=np.log1p(np.exp(-5. * np.ones((1, 2)))),
+             eps=np.log1p(np.exp(-10.)), Kp=1., Ki=0., Kd=0.,
+             vel=1e-2 * np.ones((3)), goal_lambda=16., seed=None):
+    """Generate fake goalie/shooter trials with known goals to test the
+    accuracy of the model. All trials are simulated at once; the goal, PID
+    control and position updates are those of the generative model (GBDS):
+        * the shooter's goal (ball x, y) moves toward a sinusoidal path with
+          precision goal_lambda and noise sigma
+        * the goalie's goal is the vertical position of the ball
+        * u_t = u_{t-1} + L [e_{t-2}, e_{t-1}, e_t] + eps * noise, with the
+          PID filter L of GBDS and errors e_t = g_t - y_t
+        * y_{t+1} = clip(y_t + vel * tanh(u_t), -1, 1)
+    Positions are [goalie y, ball x, ball y] and every trial starts at the
+    initial position of load_data.
+    Kp, Ki, Kd and eps are scalars or one value per dimension.
+    Returns trajectories [n_trials x (n_obs + 1) x 3] (including y0) and a
+    dictionary of the ground truth: goals and controls [n_trials x n_obs x 3]
+    (the goal and control at step t move the position at t to t + 1), and
+    the parameters of the simulation.
+    """
+    rng = np.random.RandomState(seed)
+    dim = len(vel)
+    Kp, Ki, Kd, eps = [np.broadcast_to(np.asarray(x, np.float64), (dim,))
+                       for x in [Kp, Ki, Kd, eps]]
+    L = np.stack([Kd, -Kp - 2 * Kd, Kp + Ki + Kd])
+
+    # sinusoidal path of the shooter's goal, with a random phase per trial
+    phase = np.pi * (rng.rand(n_trials, 1, 2) * 2 - 1)
+    g_b_mu = 0.25 * np.sin(
+        2. * (np.linspace(0, 2 * np.pi, n_obs + 1).reshape(1, -1, 1) - phase))
+    g_b_noise = (rng.randn(n_trials, n_obs, 2) *
+                 np.reshape(sigma, (1, 1, -1)) / np.sqrt(1 + goal_lambda))
+    u_noise = rng.randn(n_trials, n_obs, dim) * eps
+
+    y = np.zeros((n_trials, n_obs + 1, dim))
+    # the initial position
+    y[:, 0] = [0., -0.58, 0.]
+    g = np.zeros((n_trials, n_obs, dim))
+    u = np.zeros((n_trials, n_obs, dim))
+    g_b = g_b_mu[:, 0]
+    errors = np.zeros((3, n_trials, dim))
+    prev_u = np.zeros((n_trials, dim))
+    for t in range(n_obs):
+        g_b = (g_b + goal_lambda * g_b_mu[:, t + 1]) / (1 + goal_lambda)
+        g_b = g_b + g_b_noise[:, t]
+        g[:, t, 1:] = g_b
+        # the goalie follows the ball
+        g[:, t, 0] = y[:, t, 2]
+
+        errors = np.concatenate([errors[1:], [g[:, t] - y[:, t]]])
+        u[:, t] = prev_u + np.einsum("ti,tbi->bi", L, errors) + u_noise[:, t]
+        y[:, t + 1] = np.clip(y[:, t] + vel * np.tanh(u[:, t]), -1, 1)
+        prev_u = u[:, t]
+
+    truth = dict(goals=g, ctrls=u, Kp=Kp, Ki=Ki, Kd=Kd, eps=eps,
+                 sigma=np.asarray(sigma), vel=np.asarray(vel),
+                 goal_lambda=goal_lambda)
+
+    return y, truth
+
+
+def write_data(path, trajectories, extra_conds=None, ctrl_obs=None):
+    """Write trials to a TFRecord file in the format read by load_data.
+    The initial position of each trajectory (added back by load_data) is
+    not written.
+    """
+    with tf.python_io.TFRecordWriter(path) as writer:
+        for i in range(len(trajectories)):
+            feature = {"trajectory": trajectories[i][1:]}
+            if extra_conds is not None:
+                feature["extra_conds"] = extra_conds[i]
+            if ctrl_obs is not None:
+                feature["ctrl_obs"] = ctrl_obs[i]
+            example = tf.train.Example(features=tf.train.Features(
+                feature={k: tf.train.Feature(bytes_list=tf.train.BytesList(
+                    value=[np.asarray(v, np.float32).tobytes()]))
+                         for (k, v) in feature.items()}))
+            writer.write(example.SerializeToString())
+
+
+def gen_dataset(path, n_trials, n_obs, extra_conds=None, ctrl_obs=False,
+                **kwargs):
+    """Generate fake trials with gen_data and write them to path (TFRecord)
+    with write_data. The ground truth (true goals, controls and parameters)
+    is saved to path + ".npz".
+    """
+    trajectories, truth = gen_data(n_trials, n_obs, **kwargs)
+    write_data(path, trajectories, extra_conds,
+               truth["ctrls"] if ctrl_obs else None)
+    np.savez(path + ".npz", trajectories=trajectories, **truth)
+
+    return trajectories, truth
 
 
 def load_data(data_dir, hps):
     """ Load data from the given directory.
+    Returns an iterator over batches of hps.B trials, with an initializer
+    for training (trials shuffled, incomplete last batch dropped) and one for
+    export (trials in file order, the last batch completed with repeated
+    trials from the start of the file, which export_posterior discards).
     """
     features = {"trajectory": tf.FixedLenFeature((), tf.string)}
     if hps.extra_conds:
@@ -177,17 +220,28 @@ def load_data(data_dir, hps):
     with tf.name_scope("preprocessing"):
         dataset = tf.data.TFRecordDataset(data_dir)
         dataset = dataset.map(_read_data)
-        dataset = dataset.shuffle(
+        train_dataset = dataset.shuffle(
             buffer_size=100000,
             seed=tf.random_uniform([], minval=-2**63+1, maxval=2**63-1,
                                    dtype=tf.int64))
-        dataset = dataset.apply(
+        train_dataset = train_dataset.apply(
             tf.contrib.data.batch_and_drop_remainder(hps.B))
         # if hps.B > 1:
         #     dataset = dataset.map(_pad_data)
-        iterator = dataset.make_initializable_iterator("iterator")
+        export_dataset = dataset.concatenate(
+            dataset.repeat().take(hps.B - 1))
+        export_dataset = export_dataset.apply(
+            tf.contrib.data.batch_and_drop_remainder(hps.B))
+
+        iterator = tf.data.Iterator.from_structure(
+            train_dataset.output_types, train_dataset.output_shapes,
+            output_classes=train_dataset.output_classes)
+        train_init = iterator.make_initializer(train_dataset,
+                                               "training_initializer")
+        export_init = iterator.make_initializer(export_dataset,
+                                                "export_initializer")
 
-    return iterator
+    return iterator, train_init, export_init
 
 
 def get_max_velocities(data_dirs, dim):
@@ -257,7 +311,9 @@ def get_model_params(name, agents, obs_dim, state_dim, extra_dim,
                      goal_boundaries, goal_boundary_penalty, latent_ctrl,
                      rec_lag, rec_n_layers, rec_hidden_dim, penalty_Q,
                      unc_epsilon, epsilon_trainable, epsilon_penalty,
-                     clip, clip_range, clip_tolerance, clip_penalty, epoch):
+                     clip, clip_range, clip_tolerance, clip_penalty, epoch,
+                     rec_by_agent=False, stacked_agents=False,
+                     log_prob_chunk=None):
     with tf.variable_scope("model_parameters"):
         priors = []
 
@@ -297,10 +353,22 @@ def get_model_params(name, agents, obs_dim, state_dim, extra_dim,
                     eps_trainable=epsilon_trainable, eps_pen=epsilon_penalty,
                     clip=clip, clip_range=clip_range, clip_tol=clip_tolerance,
                     clip_pen=clip_penalty))
-
-        g_q_params = get_rec_params(
-            obs_dim, extra_dim, rec_lag, rec_n_layers,
-            rec_hidden_dim, penalty_Q, PKLparams, "goal_posterior")
+                if log_prob_chunk is not None:
+                    priors[-1]["log_prob_chunk"] = log_prob_chunk
+
+        if rec_by_agent:
+            # one recognition model per agent, over the agent's columns
+            g_q_params = []
+            for a in agents:
+                g_q_params.append(get_rec_params(
+                    obs_dim, extra_dim, rec_lag, rec_n_layers,
+                    rec_hidden_dim, penalty_Q, PKLparams,
+                    "%s_goal_posterior" % a["name"], x_dim=a["dim"]))
+                g_q_params[-1].update(name=a["name"], col=a["col"])
+        else:
+            g_q_params = get_rec_params(
+                obs_dim, extra_dim, rec_lag, rec_n_layers,
+                rec_hidden_dim, penalty_Q, PKLparams, "goal_posterior")
 
         if latent_ctrl:
             u_q_params = get_rec_params(
@@ -312,42 +380,76 @@ def get_model_params(name, agents, obs_dim, state_dim, extra_dim,
         params = dict(
             name=name, obs_dim=obs_dim, agent_priors=priors,
             g_q_params=g_q_params, u_q_params=u_q_params)
+        if stacked_agents:
+            params["stacked_agents"] = True
 
         return params
 
 
 def get_rec_params(obs_dim, extra_dim, lag, n_layers, hidden_dim,
-                   penalty_Q=None, PKLparams=None, name="recognition"):
+                   penalty_Q=None, PKLparams=None, name="recognition",
+                   blk_chol="sequential", shared_trunk=False, window=None,
+                   window_lag=None, lambda_rank=None, x_dim=None,
+                   parallel_windows=None):
     """Return a dictionary of parameters for recognition model.
+    The latent dimension x_dim defaults to obs_dim.
+    If shared_trunk is True, Mu, Lambda and LambdaX are the output heads of a
+    single network (NN_Rec) instead of three separate ones. If window is not
+    None, the posterior is computed by windowed smoothing (see
+    SmoothingLDSTimeSeries), parallel_windows windows at a time if it is not
+    None. If lambda_rank is not None, the networks output
+    diagonal plus rank lambda_rank precision blocks instead of dense ones.
     """
+    if x_dim is None:
+        x_dim = obs_dim
+    if lambda_rank is not None:
+        lambda_size = x_dim * (lambda_rank + 1)
+    else:
+        lambda_size = x_dim ** 2
+
     with tf.variable_scope("%s_params" % name):
-        Mu_net, PKbias_layers_mu = get_network(
-            "Mu_NN", (obs_dim * (lag + 1) + extra_dim), obs_dim, hidden_dim,
-            n_layers, PKLparams)
-        Lambda_net, PKbias_layers_lambda = get_network(
-            "Lambda_NN", obs_dim * (lag + 1) + extra_dim, obs_dim ** 2,
-            hidden_dim, n_layers, PKLparams)
-        LambdaX_net, PKbias_layers_lambdaX = get_network(
-            "LambdaX_NN", obs_dim * (lag + 1) + extra_dim, obs_dim ** 2,
-            hidden_dim, n_layers, PKLparams)
+        if shared_trunk:
+            Rec_net, PKbias_layers_rec = get_network(
+                "Rec_NN", obs_dim * (lag + 1) + extra_dim,
+                x_dim + 2 * lambda_size, hidden_dim, n_layers, PKLparams)
+        else:
+            Mu_net, PKbias_layers_mu = get_network(
+                "Mu_NN", (obs_dim * (lag + 1) + extra_dim), x_dim,
+                hidden_dim, n_layers, PKLparams)
+            Lambda_net, PKbias_layers_lambda = get_network(
+                "Lambda_NN", obs_dim * (lag + 1) + extra_dim, lambda_size,
+                hidden_dim, n_layers, PKLparams)
+            LambdaX_net, PKbias_layers_lambdaX = get_network(
+                "LambdaX_NN", obs_dim * (lag + 1) + extra_dim, lambda_size,
+                hidden_dim, n_layers, PKLparams)
 
         dyn_params = dict(
             A=tf.Variable(
-                .9 * np.eye(obs_dim), name="A", dtype=tf.float32),
+                .9 * np.eye(x_dim), name="A", dtype=tf.float32),
             QinvChol=tf.Variable(
-                np.eye(obs_dim), name="QinvChol", dtype=tf.float32),
+                np.eye(x_dim), name="QinvChol", dtype=tf.float32),
             Q0invChol=tf.Variable(
-                np.eye(obs_dim), name="Q0invChol", dtype=tf.float32))
-
-        rec_params = dict(
-            dyn_params=dyn_params,
-            NN_Mu=dict(network=Mu_net,
-                       PKbias_layers=PKbias_layers_mu),
-            NN_Lambda=dict(network=Lambda_net,
-                           PKbias_layers=PKbias_layers_lambda),
-            NN_LambdaX=dict(network=LambdaX_net,
-                            PKbias_layers=PKbias_layers_lambdaX),
-            lag=lag)
+                np.eye(x_dim), name="Q0invChol", dtype=tf.float32))
+
+        rec_params = dict(dyn_params=dyn_params, lag=lag, blk_chol=blk_chol)
+        if lambda_rank is not None:
+            rec_params["lambda_rank"] = lambda_rank
+        if window is not None:
+            rec_params["window"] = window
+            if window_lag is not None:
+                rec_params["window_lag"] = window_lag
+            if parallel_windows is not None:
+                rec_params["parallel_windows"] = parallel_windows
+        if shared_trunk:
+            rec_params["NN_Rec"] = dict(network=Rec_net,
+                                        PKbias_layers=PKbias_layers_rec)
+        else:
+            rec_params["NN_Mu"] = dict(network=Mu_net,
+                                       PKbias_layers=PKbias_layers_mu)
+            rec_params["NN_Lambda"] = dict(network=Lambda_net,
+                                           PKbias_layers=PKbias_layers_lambda)
+            rec_params["NN_LambdaX"] = dict(
+                network=LambdaX_net, PKbias_layers=PKbias_layers_lambdaX)
 
         with tf.name_scope("penalty_Q"):
             if penalty_Q is not None:
@@ -478,6 +580,33 @@ def pad_extra_conds(data, extra_conds):
         raise Exception("Must provide extra conditions.")
 
 
+def export_posterior(session, model, initializer, feed_dict, path,
+                     n_trials):
+    """Walk a dataset once and write the recognition posterior (mean and
+    Cholesky factor of the precision) and the trajectory of every trial to a
+    PosteriorStore directory. The trials are stored in the order in which
+    the iterator returns them (see the export initializer of load_data), and
+    only the first n_trials are kept.
+    """
+    initializer.run(feed_dict, session)
+    fetches = [model.g_q.postX, model.g_q.the_chol[0], model.g_q.the_chol[1],
+               model.g_q.y[:, :, :model.obs_dim]]
+
+    with PosteriorWriter(path, model.obs_dim, model.obs_dim) as writer:
+        while True:
+            try:
+                postX, chol_diag, chol_offdiag, traj = session.run(fetches)
+            except tf.errors.OutOfRangeError:
+                break
+
+            for i in range(min(postX.shape[0],
+                               n_trials - len(writer.lengths))):
+                writer.write(postX[i, :, :, 0], chol_diag[i],
+                             chol_offdiag[i], traj[i])
+
+    return len(writer.lengths)
+
+
 def add_summary(summary_op, inference, session, feed_dict, step):
     if inference.n_print != 0:
         if step == 1 or step % inference.n_print == 0: